@@ -0,0 +1,406 @@
+"""
+Streaming, memory-bounded aggregation of load test results.
+
+Each finished job is written to a JSONL file as soon as it completes (the
+bulky handler output is left out) and folded into running statistics, so a
+soak run of any length keeps a constant amount of state and a crash loses
+at most the jobs still in flight.
+
+Latencies go into LatencyHistogram, a log-linear histogram in the style of
+HdrHistogram: values are bucketed with a bounded relative error, memory
+depends only on the value range, and histograms from separate runs or
+sizes merge by adding counts.
+
+Failed jobs are counted by error category: the message with per-job values
+(durations, large numbers, job IDs) masked, capped at MAX_ERROR_CATEGORIES
+distinct categories with a few verbatim examples each.
+"""
+
+import base64
+import json
+import math
+import os
+import re
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, IO, Iterable, List, Optional, Tuple
+
+REPORTED_PERCENTILES = (50, 90, 99, 99.9)
+MAX_ERROR_CATEGORIES = 50  # Further categories are counted as "other"
+ERROR_EXAMPLES = 3         # Verbatim messages kept per category
+
+# Decimals, integers of four digits or more and UUIDs vary per job; short
+# integers such as HTTP status codes are kept
+_ERROR_VALUE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d+\.\d+|\d{4,}")
+
+
+def error_category(error: str, max_length: int = 120) -> str:
+    """
+    Category an error message is counted under.
+
+    Args:
+        error: Error message of a failed job
+        max_length: Longest category kept
+
+    Returns:
+        The message with per-job values replaced by "#", truncated
+    """
+    return _ERROR_VALUE.sub("#", error)[:max_length]
+
+
+def percentile(values: Iterable[float], q: float) -> float:
+    """
+    Linearly interpolated percentile of a (small) sample.
+
+    Args:
+        values: Sample values
+        q: Percentile between 0 and 100
+
+    Returns:
+        The q-th percentile, or 0 for an empty sample
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram with a fixed number of significant digits.
+
+    Values are recorded in seconds and stored as integer microseconds. Each
+    power-of-two range is split into 2**sub_bucket_bits linear sub-buckets,
+    which keeps the relative error of any reported value below
+    10**-significant_digits.
+    """
+
+    UNIT = 1e-6  # Seconds per recorded unit
+
+    def __init__(self, significant_digits: int = 3):
+        self.significant_digits = significant_digits
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10**significant_digits))
+        self.half_count = 2**(self.sub_bucket_bits - 1)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _index(self, value: int) -> int:
+        exponent = max(0, value.bit_length() - self.sub_bucket_bits)
+        return exponent * self.half_count + (value >> exponent)
+
+    def _value(self, index: int) -> float:
+        # Midpoint of the bucket, in seconds
+        exponent = max(0, index // self.half_count - 1)
+        sub_bucket = index - exponent * self.half_count
+        return ((sub_bucket << exponent) + ((1 << exponent) - 1) / 2) * self.UNIT
+
+    def record(self, seconds: float) -> None:
+        """Add one value in seconds; negative values are recorded as 0."""
+        seconds = max(0.0, seconds)
+        index = self._index(int(round(seconds / self.UNIT)))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """
+        Add another histogram's counts into this one.
+
+        Args:
+            other: Histogram recorded with the same significant digits
+
+        Returns:
+            This histogram
+        """
+        if other.significant_digits != self.significant_digits:
+            raise ValueError("Cannot merge histograms with different precision")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, q: float) -> float:
+        """
+        Value at the q-th percentile, in seconds.
+
+        Args:
+            q: Percentile between 0 and 100
+
+        Returns:
+            Representative value of the bucket holding the percentile, clamped
+            to the recorded min/max, or 0 when empty
+        """
+        if not self.count:
+            return 0
+        target = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.max, max(self.min, self._value(index)))
+        return self.max
+
+    def percentiles(self, qs: Iterable[float] = REPORTED_PERCENTILES) -> Dict[str, float]:
+        """Percentiles keyed "p50", "p90", "p99", "p99.9"."""
+        return {f"p{q:g}": self.percentile(q) for q in qs}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable form that from_dict reads back."""
+        return {
+            "significant_digits": self.significant_digits,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else 0,
+            "max": self.max,
+            "counts": {str(index): count for index, count in sorted(self.counts.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls(data["significant_digits"])
+        histogram.counts = {int(index): count for index, count in data["counts"].items()}
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"] if histogram.count else math.inf
+        histogram.max = data["max"]
+        return histogram
+
+
+class RunningStats:
+    """Count, mean, standard deviation, min and max in constant memory (Welford)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def stdev(self) -> float:
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0
+
+
+class ResultAggregator:
+    """
+    Fold per-job results into summary statistics as they arrive.
+
+    Optionally appends one JSON line per job to `records` (an open file)
+    and writes returned cProfile dumps to `cprofile_dir`. While the run is
+    going, every `report_interval` seconds it prints throughput, failures
+    and latency percentiles over the last `window` seconds.
+    """
+
+    def __init__(self, label: Any = None, records: Optional[IO[str]] = None,
+                 cprofile_dir: Optional[str] = None, window: float = 60.0,
+                 report_interval: float = 0.0):
+        self.label = label
+        self.records = records
+        self.cprofile_dir = cprofile_dir
+        self.window = window
+        self.report_interval = report_interval
+
+        self.total = 0
+        self.errors: Counter = Counter()
+        self.error_examples: Dict[str, List[str]] = {}
+        self.response_times = LatencyHistogram()
+        self.response_stats = RunningStats()
+        self.response_sizes = RunningStats()
+        self.wire_bytes = RunningStats()
+        self.serialization: Dict[str, LatencyHistogram] = {}
+        self.queue_delays = LatencyHistogram()
+        self.phases: Dict[str, LatencyHistogram] = {}
+        self.first_finished: Optional[float] = None
+        self.last_finished: Optional[float] = None
+        self.submit_retries = 0
+        self.poll_retries = 0
+        self.cancelled = 0
+
+        self.profile_jobs = 0
+        self.profile_num_docs: Optional[int] = None
+        self.profile_stage_seconds: Dict[str, RunningStats] = {}
+        self.profile_cpu_percent = RunningStats()
+        self.profile_peak_rss_mb = 0.0
+
+        self._recent: Deque[Tuple[float, bool, float]] = deque()
+        self._last_report = time.time()
+
+    @property
+    def successes(self) -> int:
+        return self.response_stats.count
+
+    def add(self, result: Dict[str, Any]) -> None:
+        """
+        Record one finished job.
+
+        Args:
+            result: Per-job result from JobTracker
+        """
+        self.total += 1
+        finished_at = result.get("finished_at", time.time())
+        output = result.get("result")
+        profile = output.get("profile") if isinstance(output, dict) else None
+        self.submit_retries += result.get("submit_retries", 0)
+        self.poll_retries += result.get("poll_retries", 0)
+        self.cancelled += bool(result.get("cancelled"))
+
+        if result["success"]:
+            self.response_times.record(result["response_time"])
+            self.response_stats.add(result["response_time"])
+            self.response_sizes.add(result["response_size"])
+            if result.get("queue_delay") is not None:
+                self.queue_delays.record(result["queue_delay"])
+            for phase, seconds in result.get("phases", {}).items():
+                self.phases.setdefault(phase, LatencyHistogram()).record(seconds)
+            if result.get("wire_bytes") is not None:
+                self.wire_bytes.add(result["wire_bytes"])
+            for step, seconds in result.get("serialization", {}).items():
+                self.serialization.setdefault(step, LatencyHistogram()).record(seconds)
+            if self.first_finished is None:
+                self.first_finished = finished_at
+            self.last_finished = finished_at
+            if profile:
+                self._add_profile(profile)
+        elif result.get("error"):
+            self._add_error(result["error"])
+
+        if self.cprofile_dir and profile and "cprofile_dump" in profile:
+            save_cprofile_dump(result, self.cprofile_dir)
+        if self.records is not None:
+            self._write_record(result, profile)
+
+        # The rolling window is only kept for reports, and only for `window` seconds
+        if self.report_interval:
+            self._recent.append((finished_at, result["success"], result["response_time"]))
+            self._trim_window(time.time())
+            if time.time() - self._last_report >= self.report_interval:
+                self.report_window()
+
+    def _add_error(self, error: str) -> None:
+        category = error_category(error)
+        if category not in self.errors and len(self.errors) >= MAX_ERROR_CATEGORIES:
+            category = "other"
+        self.errors[category] += 1
+        examples = self.error_examples.setdefault(category, [])
+        if len(examples) < ERROR_EXAMPLES:
+            examples.append(error[:500])
+
+    def _trim_window(self, now: float) -> None:
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def _add_profile(self, profile: Dict[str, Any]) -> None:
+        self.profile_jobs += 1
+        self.profile_num_docs = profile.get("num_docs", self.profile_num_docs)
+        for stage, record in profile["stages"].items():
+            self.profile_stage_seconds.setdefault(stage, RunningStats()).add(record["seconds"])
+        self.profile_cpu_percent.add(profile["cpu_percent"])
+        self.profile_peak_rss_mb = max(self.profile_peak_rss_mb, profile["peak_rss_mb"])
+
+    def _write_record(self, result: Dict[str, Any], profile: Optional[Dict[str, Any]]) -> None:
+        # The topic model output can be megabytes per job; keep only the measurements
+        record = {key: value for key, value in result.items() if key != "result"}
+        record["label"] = self.label
+        if profile:
+            record["profile"] = {key: value for key, value in profile.items() if key != "cprofile_dump"}
+        self.records.write(json.dumps(record) + "\n")
+        self.records.flush()
+
+    def report_window(self) -> None:
+        """Print throughput, failures and latency percentiles over the last `window` seconds."""
+        now = time.time()
+        self._trim_window(now)
+        latencies = [seconds for _, success, seconds in self._recent if success]
+        failed = sum(1 for _, success, _ in self._recent if not success)
+        print(f"  [last {self.window:.0f}s] {len(self._recent)} done "
+              f"({len(self._recent) / self.window:.2f}/s), {failed} failed, "
+              f"p50 {percentile(latencies, 50):.2f}s, p99 {percentile(latencies, 99):.2f}s "
+              f"| total {self.total} done")
+        self._last_report = now
+
+    def profile_summary(self) -> Dict[str, Any]:
+        """Mean seconds per stage, mean CPU usage and the largest peak RSS of profiled jobs."""
+        if not self.profile_jobs:
+            return {}
+        return {
+            "num_jobs": self.profile_jobs,
+            "num_docs": self.profile_num_docs,
+            "avg_stage_seconds": {stage: stats.mean for stage, stats in self.profile_stage_seconds.items()},
+            "avg_cpu_percent": self.profile_cpu_percent.mean,
+            "max_peak_rss_mb": self.profile_peak_rss_mb
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Statistics over every job recorded so far.
+
+        Returns:
+            Success counts, response time/size statistics and percentiles,
+            per-phase percentiles, wire bytes and serialization percentiles,
+            the profile summary, retries, cancelled jobs, error counts by
+            category with example messages and the serialized response time
+            histogram
+        """
+        successes = self.successes
+        return {
+            "total_requests": self.total,
+            "successful_requests": successes,
+            "failed_requests": self.total - successes,
+            "success_rate": successes / self.total if self.total else 0,
+            "avg_response_time": self.response_stats.mean,
+            "min_response_time": self.response_stats.min if successes else 0,
+            "max_response_time": self.response_stats.max if successes else 0,
+            "median_response_time": self.response_times.percentile(50),
+            "std_response_time": self.response_stats.stdev,
+            "response_time_percentiles": self.response_times.percentiles(),
+            "avg_response_size": self.response_sizes.mean,
+            "avg_wire_bytes": self.wire_bytes.mean,
+            "max_wire_bytes": self.wire_bytes.max if self.wire_bytes.count else 0,
+            "phases": {phase: histogram.percentiles() for phase, histogram in self.phases.items()},
+            "serialization": {step: histogram.percentiles() for step, histogram in self.serialization.items()},
+            "profile": self.profile_summary(),
+            "submit_retries": self.submit_retries,
+            "poll_retries": self.poll_retries,
+            "cancelled_jobs": self.cancelled,
+            "errors": dict(self.errors),
+            "error_examples": self.error_examples,
+            "response_time_histogram": self.response_times.to_dict()
+        }
+
+
+def save_cprofile_dump(result: Dict[str, Any], directory: str) -> None:
+    """
+    Write a job's cProfile dump to <directory>/<job_id>.prof.
+
+    The files load with pstats.Stats or snakeviz.
+
+    Args:
+        result: Per-job result from JobTracker
+        directory: Output directory, created if missing
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{result['job_id']}.prof"), 'wb') as f:
+        f.write(base64.b64decode(result["result"]["profile"]["cprofile_dump"]))
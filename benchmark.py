@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Benchmark the BERTopic handler in-process, without RunPod or the network.
+
+Sweeps document counts, topic counts, thread counts, embedding modes and
+hierarchy modes, runs warm-up and repeated trials of handler.handler for
+each combination and records the median stage timings and peak memory to
+a versioned JSON baseline. Compare mode checks a run against a baseline
+and exits non-zero when any metric got slower (or bigger) by more than
+the threshold. The fast hierarchy modes are also scored against the exact
+hierarchy, and a drop in that fidelity counts as a regression too:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json --output candidate.json
+
+The handler's embedding backend comes from EMBEDDING_BACKEND, so compare
+backends by running once per value; runs only match baseline entries of
+the same backend. --encode-batch-sizes instead measures
+raw encoding throughput of the configured backend per batch size and
+thread count, to pick EMBEDDING_BATCH_SIZE and EMBEDDING_THREADS.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Sequence
+
+SCHEMA_VERSION = 1
+
+# Embedding modes map onto the handler's input flags
+EMBEDDING_MODES = {
+    "encode": {"embedding_cache": False, "precomputed_embeddings": False},
+    "cache": {"embedding_cache": True, "precomputed_embeddings": False},
+    "precomputed": {"embedding_cache": False, "precomputed_embeddings": True},
+}
+
+HIERARCHY_MODES = ("full", "ctfidf", "embeddings", "none")
+
+# Metrics where a lower value is worse; everything else is a time or size
+HIGHER_IS_BETTER = {"hierarchy_cluster_recall", "hierarchy_cophenetic_correlation"}
+
+
+def set_threads(threads: int) -> None:
+    """
+    Limit the thread pools used by the handler (torch, BLAS/OpenMP, numba).
+
+    Args:
+        threads: Threads per pool
+    """
+    import numba
+    import torch
+    from threadpoolctl import threadpool_limits
+
+    torch.set_num_threads(threads)
+    threadpool_limits(limits=threads)
+    numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+
+
+def config_key(config: Dict[str, Any]) -> str:
+    """Stable name for one benchmark configuration, used to match runs against a baseline."""
+    key = (f"docs={config['num_docs']},topics={config['num_topics']},"
+           f"threads={config['threads']},embeddings={config['embeddings']}")
+    # Keys without a hierarchy mode are the exact hierarchy, as in baselines from before the sweep
+    if config.get("hierarchy", "full") != "full":
+        key += f",hierarchy={config['hierarchy']}"
+    # Likewise for the fp32 torch backend, so other backends never match a torch baseline
+    if config.get("backend", "torch") != "torch":
+        key += f",backend={config['backend']}"
+    return key
+
+
+def run_trial(handler, config: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    """
+    Run the handler once for a configuration.
+
+    Args:
+        handler: handler.handler
+        config: Benchmark configuration
+        seed: Random seed for document sampling
+
+    Returns:
+        Handler timings in seconds plus the job's peak RSS in MB and, for the
+        fast hierarchy modes, their fidelity to the exact hierarchy
+    """
+    hierarchy = config.get("hierarchy", "full")
+    event = {"input": {
+        "num_docs": config["num_docs"],
+        "num_topics": config["num_topics"],
+        "random_seed": seed,
+        "profile": True,
+        "hierarchy": hierarchy,
+        "check_hierarchy": hierarchy not in ("full", "none"),
+        **EMBEDDING_MODES[config["embeddings"]],
+    }}
+    start_time = time.time()
+    output = handler(event)
+    trial = {name: seconds for name, seconds in output["timings"].items() if name != "cold_start"}
+    trial["wall"] = time.time() - start_time
+    trial["peak_rss_mb"] = output["profile"]["peak_rss_mb"]
+    if "hierarchy_fidelity" in output:
+        fidelity = output["hierarchy_fidelity"]
+        trial["hierarchy_cluster_recall"] = fidelity["cluster_recall"]
+        trial["hierarchy_cophenetic_correlation"] = fidelity["cophenetic_correlation"]
+        trial["hierarchy_full"] = fidelity["full_seconds"]
+    return trial
+
+
+def summarize_trials(trials: List[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """Median, min, max and standard deviation of every metric across trials."""
+    metrics = {}
+    for name in trials[0]:
+        values = [trial[name] for trial in trials if name in trial]
+        metrics[name] = {
+            "median": statistics.median(values),
+            "min": min(values),
+            "max": max(values),
+            "stdev": statistics.stdev(values) if len(values) > 1 else 0,
+        }
+    return metrics
+
+
+def environment() -> Dict[str, Any]:
+    """Versions and hardware the benchmark ran on, stored with the results."""
+    import bertopic
+    import torch
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cuda": torch.cuda.is_available(),
+        "torch": torch.__version__,
+        "bertopic": bertopic.__version__,
+        "git_commit": commit,
+        "embedding_backend": os.environ.get("EMBEDDING_BACKEND") or "torch",
+        "embedding_batch_size": int(os.environ.get("EMBEDDING_BATCH_SIZE", "32")),
+    }
+
+
+def run_benchmarks(num_docs: List[int], num_topics: List[int], threads: List[int], embeddings: List[str],
+                   warmup: int = 1, trials: int = 3, seed: int = 42,
+                   hierarchies: Sequence[str] = ("full",)) -> Dict[str, Any]:
+    """
+    Run every combination of the swept parameters.
+
+    Args:
+        num_docs: Document counts to sweep
+        num_topics: Topic counts to sweep
+        threads: Thread counts to sweep
+        embeddings: Embedding modes to sweep ("encode", "cache", "precomputed")
+        warmup: Untimed runs per configuration before the trials
+        trials: Timed runs per configuration
+        seed: Random seed for document sampling, the same for every run
+        hierarchies: Hierarchy modes to sweep (see HIERARCHY_MODES)
+
+    Returns:
+        Versioned results document with one entry per configuration
+    """
+    import_start = time.time()
+    from handler import handler
+    print(f"Imported handler in {time.time() - import_start:.2f}s")
+
+    backend = os.environ.get("EMBEDDING_BACKEND") or "torch"
+    results = []
+    for docs, topics, thread_count, mode, hierarchy in itertools.product(num_docs, num_topics, threads,
+                                                                         embeddings, hierarchies):
+        config = {"num_docs": docs, "num_topics": topics, "threads": thread_count, "embeddings": mode,
+                  "hierarchy": hierarchy, "backend": backend}
+        print(f"\n{config_key(config)}")
+        set_threads(thread_count)
+
+        for _ in range(warmup):
+            run_trial(handler, config, seed)
+        config_trials = []
+        for trial in range(trials):
+            config_trials.append(run_trial(handler, config, seed))
+            print(f"  Trial {trial + 1}/{trials}: {config_trials[-1]['total']:.2f}s total, "
+                  f"{config_trials[-1]['peak_rss_mb']:.0f} MB peak RSS")
+            if "hierarchy_full" in config_trials[-1]:
+                print(f"    Hierarchy {config_trials[-1]['hierarchy']:.3f}s vs "
+                      f"{config_trials[-1]['hierarchy_full']:.3f}s exact, cluster recall "
+                      f"{config_trials[-1]['hierarchy_cluster_recall']:.2f}, cophenetic correlation "
+                      f"{config_trials[-1]['hierarchy_cophenetic_correlation']:.2f}")
+
+        results.append({
+            "key": config_key(config),
+            "config": config,
+            "metrics": summarize_trials(config_trials),
+        })
+
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "settings": {"warmup": warmup, "trials": trials, "seed": seed},
+        "results": results,
+    }
+
+
+def benchmark_encoding(batch_sizes: List[int], threads: List[int], num_docs: int = 1000,
+                       trials: int = 3) -> Dict[str, Any]:
+    """
+    Measure encoding throughput of the configured embedding backend.
+
+    Args:
+        batch_sizes: Encoding batch sizes to sweep
+        threads: Thread counts to sweep
+        num_docs: Corpus documents encoded per trial
+        trials: Timed runs per combination, after one warm-up
+
+    Returns:
+        Versioned results document with docs/sec per combination
+    """
+    from corpus import load_corpus
+    from embeddings import load_embedding_model
+
+    corpus = load_corpus()
+    docs = corpus.take(range(min(num_docs, len(corpus))))
+    results = []
+    for thread_count in threads:
+        set_threads(thread_count)
+        model = load_embedding_model(threads=thread_count)
+        for batch_size in batch_sizes:
+            model.encode(docs[:batch_size], batch_size=batch_size, show_progress_bar=False)
+            seconds = []
+            for _ in range(trials):
+                start_time = time.time()
+                model.encode(docs, batch_size=batch_size, show_progress_bar=False)
+                seconds.append(time.time() - start_time)
+            docs_per_second = len(docs) / statistics.median(seconds)
+            print(f"  threads={thread_count} batch_size={batch_size}: {docs_per_second:.1f} docs/sec")
+            results.append({"threads": thread_count, "batch_size": batch_size,
+                            "docs_per_second": docs_per_second})
+
+    best = max(results, key=lambda result: result["docs_per_second"])
+    print(f"\nFastest: EMBEDDING_THREADS={best['threads']} EMBEDDING_BATCH_SIZE={best['batch_size']}")
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "settings": {"num_docs": len(docs), "trials": trials},
+        "encoding": results,
+    }
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1,
+                    min_delta: float = 0.05) -> List[Dict[str, Any]]:
+    """
+    Find metrics whose median got worse than the baseline's by more than `threshold`.
+
+    Worse means higher for times and sizes and lower for the fidelity
+    metrics in HIGHER_IS_BETTER.
+
+    Args:
+        baseline: Results document to compare against
+        current: Results document of the new run
+        threshold: Allowed relative increase, e.g. 0.1 for 10%
+        min_delta: Changes smaller than this (seconds, MB or fidelity) are treated as noise
+
+    Returns:
+        One entry per regressed metric
+    """
+    if baseline.get("schema_version") != current.get("schema_version"):
+        raise ValueError(f"Baseline schema {baseline.get('schema_version')} does not match "
+                         f"{current.get('schema_version')}")
+
+    baseline_results = {result["key"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        reference = baseline_results.get(result["key"])
+        if reference is None:
+            print(f"  {result['key']}: not in baseline")
+            continue
+        for name, stats in result["metrics"].items():
+            if name not in reference["metrics"]:
+                continue
+            before = reference["metrics"][name]["median"]
+            after = stats["median"]
+            change = (after - before) / before if before > 0 else 0
+            worse = -change if name in HIGHER_IS_BETTER else change
+            marker = ""
+            if worse > threshold and abs(after - before) > min_delta:
+                marker = "  REGRESSION"
+                regressions.append({"key": result["key"], "metric": name, "baseline": before,
+                                    "current": after, "change": change})
+            print(f"  {result['key']} {name}: {before:.3f} -> {after:.3f} ({change:+.1%}){marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the BERTopic handler in-process')
+    parser.add_argument('--num-docs', nargs='+', type=int, default=[100, 1000], help='Document counts to sweep')
+    parser.add_argument('--num-topics', nargs='+', type=int, default=[10], help='Topic counts to sweep')
+    parser.add_argument('--threads', nargs='+', type=int, default=[os.cpu_count() or 1],
+                       help='Thread counts to sweep')
+    parser.add_argument('--embeddings', nargs='+', choices=list(EMBEDDING_MODES), default=['encode', 'cache'],
+                       help='Embedding modes to sweep')
+    parser.add_argument('--hierarchy', nargs='+', choices=HIERARCHY_MODES, default=['full'],
+                       help='Hierarchy modes to sweep; fast modes also report fidelity to "full"')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs per configuration')
+    parser.add_argument('--trials', type=int, default=3, help='Timed runs per configuration')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for document sampling')
+    parser.add_argument('--output', default='benchmark_results.json', help='Output file for results')
+    parser.add_argument('--compare', help='Baseline results file to check for regressions')
+    parser.add_argument('--results', help='With --compare: existing results file to check instead of running')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                       help='Relative slowdown that counts as a regression (default: 0.1 = 10%%)')
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                       help='Ignore slowdowns smaller than this many seconds (or MB)')
+    parser.add_argument('--encode-batch-sizes', nargs='+', type=int,
+                       help='Only measure encoding throughput for these batch sizes')
+
+    args = parser.parse_args()
+
+    if args.encode_batch_sizes:
+        results = benchmark_encoding(args.encode_batch_sizes, args.threads, max(args.num_docs), args.trials)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+        return
+
+    if args.results:
+        with open(args.results) as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(args.num_docs, args.num_topics, args.threads, args.embeddings,
+                                 args.warmup, args.trials, args.seed, args.hierarchy)
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nComparing against {args.compare} (threshold {args.threshold:.0%}):")
+        regressions = compare_results(baseline, current, args.threshold, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Pre-compute embeddings for the whole cleaned 20 Newsgroups corpus.
+
+Run once at image build time (see Dockerfile). The handler memory-maps the
+result and slices out the rows for each job's sampled documents instead of
+running the SentenceTransformer.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from corpus import load_corpus
+from embeddings import load_embedding_model, save_corpus_embeddings
+
+
+def build_embeddings(output_dir: str, dtype: str = "float16", batch_size: int = 64) -> None:
+    """
+    Encode the full corpus and write the precomputed store.
+
+    Args:
+        output_dir: Directory to write the store to
+        dtype: Storage dtype, "float16" (half the size) or "float32"
+        batch_size: Encoding batch size
+    """
+    corpus = load_corpus()
+    docs = corpus.take(range(len(corpus)))
+    print(f"Loaded {len(docs)} documents in {corpus.load_time:.2f}s")
+
+    # Always the fp32 model: the store is the reference other backends are compared with
+    model = load_embedding_model(backend="torch")
+
+    start_time = time.time()
+    embeddings = model.encode(docs, batch_size=batch_size, show_progress_bar=True)
+    print(f"Encoded {len(docs)} documents on {model.device} in {time.time() - start_time:.2f}s")
+
+    embeddings = np.asarray(embeddings, dtype=dtype)
+    save_corpus_embeddings(output_dir, embeddings, docs)
+    print(f"Saved {embeddings.shape} {dtype} embeddings ({embeddings.nbytes} bytes) to {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pre-compute 20 Newsgroups embeddings')
+    parser.add_argument('--output', default='corpus_embeddings', help='Output directory')
+    parser.add_argument('--dtype', choices=['float16', 'float32'], default='float16',
+                        help='Storage dtype for the embeddings')
+    parser.add_argument('--batch-size', type=int, default=64, help='Encoding batch size')
+
+    args = parser.parse_args()
+    build_embeddings(args.output, args.dtype, args.batch_size)
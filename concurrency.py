@@ -0,0 +1,94 @@
+"""
+Admission control for running several jobs at once on one worker.
+
+Jobs are weighted by document count against a shared document budget sized
+from the memory available to the worker. Many small jobs fit side by side,
+while a job at least as large as the budget waits for the worker to drain
+and then runs alone. Jobs are admitted in arrival order, so small jobs that
+arrive later cannot keep a large job waiting.
+"""
+
+import asyncio
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+# Rough resident memory per document in flight (embeddings, UMAP graph,
+# c-TF-IDF); tune with the peak_rss_mb reported by profiled jobs
+BYTES_PER_DOC = 100 * 2**10
+
+
+def available_memory_bytes() -> int:
+    """Memory available to new allocations, from /proc/meminfo when present."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def default_doc_budget() -> int:
+    """Documents that can be in flight at once given the available memory."""
+    return max(1, available_memory_bytes() // BYTES_PER_DOC)
+
+
+class DocumentBudget:
+    """Weighted FIFO semaphore over the number of documents being processed."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self.running = 0
+        self._condition = asyncio.Condition()
+        self._waiters: deque = deque()
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.in_use
+
+    @property
+    def waiting(self) -> int:
+        """Jobs waiting for their turn."""
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def reserve(self, num_docs: int) -> AsyncIterator[None]:
+        """
+        Hold `num_docs` of the budget for the duration of the block.
+
+        A job larger than the whole budget is admitted once nothing else is
+        running, so it gets the machine to itself. Jobs are admitted in the
+        order they call reserve: a job that does not fit yet holds back the
+        jobs behind it, even ones that would fit.
+
+        Args:
+            num_docs: Document count of the job
+        """
+        weight = min(max(1, num_docs), self.capacity)
+        ticket = object()
+        async with self._condition:
+            self._waiters.append(ticket)
+            try:
+                await self._condition.wait_for(
+                    lambda: self._waiters[0] is ticket and self.in_use + weight <= self.capacity)
+            except BaseException:
+                # A cancelled waiter must not block the queue behind it
+                self._waiters.remove(ticket)
+                self._condition.notify_all()
+                raise
+            self._waiters.popleft()
+            self.in_use += weight
+            self.running += 1
+            # The next job in line may fit alongside this one
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= weight
+                self.running -= 1
+                self._condition.notify_all()
@@ -0,0 +1,140 @@
+"""
+Process-level cache of the cleaned 20 Newsgroups corpus.
+
+The dataset is fetched and stripped of headers, footers and quotes once per
+worker process. The cleaned documents are packed into a single UTF-8 buffer
+with an offsets array, so sampling a job's documents is just slicing.
+
+The packed form can be saved at image build time (see prefetch.py) and
+pointed to with CORPUS_PATH. Workers then load it straight from disk,
+without fetching or cleaning anything and without importing scikit-learn.
+
+Jobs sample documents as an array of unique corpus positions plus a count
+per position (sample_documents), so a job asking for more documents than
+the corpus holds never embeds or clusters the same document twice.
+"""
+
+import os
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class Corpus:
+    """Cleaned documents stored as one UTF-8 buffer plus an offsets array."""
+
+    def __init__(self, docs: Sequence[str], load_time: float = 0.0):
+        encoded = [doc.encode("utf-8") for doc in docs]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=self.offsets[1:])
+        self.buffer = b"".join(encoded)
+        self.load_time = load_time
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.buffer[start:end].decode("utf-8")
+
+    def take(self, indices: Sequence[int]) -> List[str]:
+        """
+        Return the documents at the given indices, in order.
+
+        Args:
+            indices: Corpus positions to fetch (repeats allowed)
+
+        Returns:
+            List of document strings
+        """
+        return [self[i] for i in indices]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the packed buffer and offsets."""
+        return len(self.buffer) + self.offsets.nbytes
+
+    def save(self, path: str) -> None:
+        """Write the packed buffer and offsets to an .npz file."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, buffer=np.frombuffer(self.buffer, dtype=np.uint8), offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path: str) -> "Corpus":
+        """Read a corpus written by save()."""
+        corpus = cls([])
+        with np.load(path) as packed:
+            corpus.buffer = packed["buffer"].tobytes()
+            corpus.offsets = packed["offsets"]
+        return corpus
+
+
+def sample_documents(corpus_size: int, num_docs: int,
+                     rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sample corpus positions for a job.
+
+    Up to the corpus size, documents are drawn without replacement. Above it
+    they are drawn with replacement, and repeats are folded into counts.
+
+    Args:
+        corpus_size: Number of documents in the corpus
+        num_docs: Number of documents the job asked for
+        rng: The job's own generator, so concurrent jobs do not share state
+
+    Returns:
+        tuple: Contains:
+            - indices: Sorted unique corpus positions (int64)
+            - counts: How many times each position was drawn; sums to num_docs
+    """
+    if num_docs <= corpus_size:
+        indices = np.sort(rng.choice(corpus_size, size=num_docs, replace=False))
+        return indices, np.ones(len(indices), dtype=np.int64)
+    return np.unique(rng.integers(0, corpus_size, size=num_docs), return_counts=True)
+
+
+_corpus: Optional[Corpus] = None
+_corpus_lock = threading.Lock()
+
+
+def load_corpus(path: Optional[str] = None) -> Corpus:
+    """
+    Load the cleaned 20 Newsgroups corpus, timing the whole load.
+
+    Args:
+        path: Packed corpus written by Corpus.save; defaults to $CORPUS_PATH.
+            Without one (or with ""), the dataset is fetched and cleaned.
+
+    Returns:
+        The loaded Corpus
+    """
+    start_time = time.time()
+    if path is None:
+        path = os.environ.get("CORPUS_PATH")
+    if path and os.path.exists(path):
+        corpus = Corpus.load(path)
+    else:
+        from sklearn.datasets import fetch_20newsgroups
+        newsgroups = fetch_20newsgroups(subset='all', remove=('headers', 'footers', 'quotes'))
+        corpus = Corpus(newsgroups.data)
+    corpus.load_time = time.time() - start_time
+    return corpus
+
+
+def get_corpus() -> Corpus:
+    """
+    Return the process-wide corpus, loading it on first use.
+
+    Returns:
+        The cached Corpus instance
+    """
+    global _corpus
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                _corpus = load_corpus()
+                print(f"Loaded {len(_corpus)} documents in {_corpus.load_time:.2f}s "
+                      f"({_corpus.nbytes} bytes)")
+    return _corpus
@@ -0,0 +1,109 @@
+"""
+Job deadlines passed in by the caller.
+
+A job's input can carry "deadline", an absolute Unix time after which the
+caller no longer wants the result (load_test.py sends its own timeout this
+way). The handler checks it between stages, including between BERTopic's
+internal fit stages and between online chunks, and gives up at the first
+check past the deadline instead of finishing work nobody will collect. A
+stage that is already running (a UMAP fit, say) is not interrupted.
+
+The deadline is read from the input on every check, so whoever holds the
+input dict can move it while the job runs; local_server.py cancels a running
+job by setting it to now.
+
+The check compares against this machine's clock, so caller and worker
+clocks are assumed to be in sync (NTP).
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from profiling import BERTOPIC_STAGES
+
+
+class DeadlineExceeded(Exception):
+    """Raised by Deadline.check once the deadline has passed."""
+
+    def __init__(self, stage: str, overrun: float):
+        super().__init__(f"Deadline exceeded by {overrun:.2f}s before {stage}")
+        self.stage = stage
+        self.overrun = overrun
+
+
+class Deadline:
+    """
+    Absolute deadline for one job; a Deadline(None) never expires.
+
+    Args:
+        at: Fixed deadline as Unix time
+        source: Dict whose "deadline" is read at every check instead
+    """
+
+    def __init__(self, at: Optional[float] = None, source: Optional[Dict[str, Any]] = None):
+        self._at = at
+        self._source = source
+
+    @classmethod
+    def from_input(cls, job_input: Dict[str, Any]) -> "Deadline":
+        """Deadline that follows a job input's "deadline" (Unix time), if any."""
+        return cls(source=job_input)
+
+    @property
+    def at(self) -> Optional[float]:
+        """The deadline as it stands now."""
+        if self._source is None:
+            return self._at
+        at = self._source.get("deadline")
+        return float(at) if at is not None else None
+
+    def remaining(self) -> float:
+        """Seconds left, or infinity without a deadline."""
+        at = self.at
+        return at - time.time() if at is not None else float("inf")
+
+    def check(self, stage: str) -> None:
+        """
+        Raise DeadlineExceeded if the deadline has passed.
+
+        Args:
+            stage: Name of the stage about to start, for the error message
+        """
+        remaining = self.remaining()
+        if remaining < 0:
+            raise DeadlineExceeded(stage, -remaining)
+
+    @contextmanager
+    def instrument(self, topic_model: Any) -> Iterator[None]:
+        """
+        Check the deadline before each of BERTopic's internal fit stages.
+
+        Args:
+            topic_model: BERTopic instance to instrument
+        """
+        if self._source is None and self._at is None:
+            yield
+            return
+        # Wrappers already on the instance (StageProfiler.instrument) are kept and restored
+        previous = {}
+        for method_name, stage_name in BERTOPIC_STAGES.items():
+            method = getattr(topic_model, method_name, None)
+            if method is None:
+                continue
+            previous[method_name] = vars(topic_model).get(method_name)
+            setattr(topic_model, method_name, self._checked(method, f"fit.{stage_name}"))
+        try:
+            yield
+        finally:
+            for method_name, method in previous.items():
+                if method is None:
+                    delattr(topic_model, method_name)
+                else:
+                    setattr(topic_model, method_name, method)
+
+    def _checked(self, method, stage_name: str):
+        def checked(*args, **kwargs):
+            self.check(stage_name)
+            return method(*args, **kwargs)
+        return checked
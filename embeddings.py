@@ -0,0 +1,490 @@
+"""
+Document embedding with a content-hash-keyed cache.
+
+Load tests sample the same 20 Newsgroups documents over and over, so the
+SentenceTransformer output for a document is cached under a hash of its
+text. The in-memory tier is an LRU bounded by bytes; an optional on-disk
+tier keeps embeddings in a memory-mapped .npy file that survives worker
+restarts.
+
+The whole corpus can also be encoded ahead of time (build_embeddings.py)
+into a precomputed store whose rows follow corpus order, so a job just
+gathers the rows for its sampled indices.
+
+CPU workers can swap the fp32 PyTorch encoder for an int8 dynamically
+quantized one or for ONNX Runtime (EMBEDDING_BACKEND), with the encoding
+batch size and thread count set per deployment.
+
+Empty posts are not encoded; they share one precomputed embedding. With a
+token budget set, documents are also encoded in length-bucketed batches, so
+short posts are not padded to the length of a long one in the same batch.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+KEY_SIZE = 16  # Bytes of blake2b digest used as the cache key
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# torch: fp32 PyTorch (on GPU when available); torch-int8: PyTorch with int8
+# dynamically quantized Linear layers; onnx / onnx-int8: ONNX Runtime on CPU
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+ONNX_INT8_FILE = "onnx/model_qint8_avx2.onnx"  # Written by prefetch.py, also published on the Hub
+
+
+def load_embedding_model(device: Optional[str] = None, backend: Optional[str] = None,
+                         threads: Optional[int] = None) -> Any:
+    """
+    Load the SentenceTransformer, from $EMBEDDING_MODEL_PATH when set.
+
+    The image saves the model to that directory at build time (prefetch.py),
+    so workers load it from local files without contacting the Hugging Face Hub.
+
+    Args:
+        device: Torch device for the fp32 backend; defaults to CUDA when available
+        backend: One of EMBEDDING_BACKENDS; defaults to $EMBEDDING_BACKEND or "torch"
+        threads: Intra-op threads for the int8 and ONNX backends (the fp32 torch backend
+            ignores it); defaults to $EMBEDDING_THREADS or the library default
+
+    Returns:
+        The SentenceTransformer
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or os.environ.get("EMBEDDING_BACKEND") or "torch"
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+    threads = threads or int(os.environ.get("EMBEDDING_THREADS", "0")) or None
+    model_path = os.environ.get("EMBEDDING_MODEL_PATH") or EMBEDDING_MODEL_NAME
+
+    if backend == "torch":
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        return SentenceTransformer(model_path, device=device)
+
+    if backend == "torch-int8":
+        if threads:
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(model_path, device="cpu")
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    import onnxruntime
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+    model_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+    if backend == "onnx-int8":
+        model_kwargs["file_name"] = ONNX_INT8_FILE
+    return SentenceTransformer(model_path, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+
+def document_key(doc: str) -> bytes:
+    """Content hash used as the cache key for a document."""
+    return hashlib.blake2b(doc.encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+class DiskEmbeddingStore:
+    """
+    Append-only memory-mapped store of embeddings on disk.
+
+    Vectors live in <directory>/embeddings.npy and the key for each row in
+    <directory>/keys.npy; an all-zero key marks an unused row. Once the store
+    is full, new embeddings are only kept in memory.
+    """
+
+    def __init__(self, directory: str, capacity: int):
+        self.directory = directory
+        self.capacity = capacity
+        self.vectors: Optional[np.ndarray] = None
+        self.keys: Optional[np.ndarray] = None
+        self.index: Dict[bytes, int] = {}
+        self.size = 0
+        if os.path.exists(self._path("embeddings.npy")):
+            self._open()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open(self, dim: Optional[int] = None) -> None:
+        if os.path.exists(self._path("embeddings.npy")):
+            self.vectors = np.load(self._path("embeddings.npy"), mmap_mode="r+")
+            self.keys = np.load(self._path("keys.npy"), mmap_mode="r+")
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            self.vectors = np.lib.format.open_memmap(
+                self._path("embeddings.npy"), mode="w+", dtype=np.float32, shape=(self.capacity, dim))
+            self.keys = np.lib.format.open_memmap(
+                self._path("keys.npy"), mode="w+", dtype=np.uint8, shape=(self.capacity, KEY_SIZE))
+        self.capacity = len(self.keys)
+        used = np.flatnonzero(self.keys.any(axis=1))
+        self.index = {self.keys[row].tobytes(): int(row) for row in used}
+        self.size = len(self.index)
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        row = self.index.get(key)
+        return None if row is None else self.vectors[row]
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray) -> None:
+        if self.vectors is None:
+            self._open(dim=vectors.shape[1])
+        for key, vector in zip(keys, vectors):
+            if self.size >= self.capacity:
+                break
+            if key in self.index:
+                continue
+            self.vectors[self.size] = vector
+            self.keys[self.size] = np.frombuffer(key, dtype=np.uint8)
+            self.index[key] = self.size
+            self.size += 1
+        self.vectors.flush()
+        self.keys.flush()
+
+
+class EmbeddingCache:
+    """LRU cache of document embeddings bounded by memory, with an optional disk tier."""
+
+    def __init__(self, max_bytes: int = 256 * 2**20, disk_dir: Optional[str] = None,
+                 disk_capacity: int = 100000):
+        self.max_bytes = max_bytes
+        self.memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = DiskEmbeddingStore(disk_dir, disk_capacity) if disk_dir else None
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[bytes]) -> Tuple[Dict[bytes, np.ndarray], int, int]:
+        """
+        Look up embeddings, promoting disk hits into memory.
+
+        Args:
+            keys: Document keys to look up
+
+        Returns:
+            tuple: Contains:
+                - found: Mapping of key to embedding for every hit
+                - memory_hits: Number of keys found in memory, repeats included
+                - disk_hits: Number of keys found on disk, repeats included
+        """
+        found = {}
+        on_disk = set()
+        memory_hits = disk_hits = 0
+        with self._lock:
+            for key in keys:
+                if key in found:
+                    # A repeat counts as a hit in whichever tier the first occurrence came from
+                    if key in on_disk:
+                        disk_hits += 1
+                    else:
+                        memory_hits += 1
+                    continue
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    memory_hits += 1
+                elif self.disk is not None:
+                    vector = self.disk.get(key)
+                    if vector is not None:
+                        vector = np.array(vector)
+                        self._remember(key, vector)
+                        on_disk.add(key)
+                        disk_hits += 1
+                if vector is not None:
+                    found[key] = vector
+        return found, memory_hits, disk_hits
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray) -> None:
+        """
+        Store freshly encoded embeddings in memory and, if configured, on disk.
+
+        Args:
+            keys: Document keys
+            vectors: Embeddings, one row per key
+        """
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                # Copy so a cached row does not keep the whole batch array alive
+                self._remember(key, np.array(vector))
+            if self.disk is not None:
+                self.disk.put_many(keys, vectors)
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        if vector.nbytes > self.max_bytes:
+            return
+        self.memory[key] = vector
+        self.memory_bytes += vector.nbytes
+        while self.memory_bytes > self.max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        """Current size of each tier."""
+        return {
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_bytes,
+            "disk_entries": self.disk.size if self.disk is not None else 0,
+        }
+
+
+MAX_BATCH_DOCS = 512  # Upper bound on documents per batch, however short they are
+BUCKET_RATIO = 2  # A batch never holds documents shorter than 1/BUCKET_RATIO of its longest
+ENCODING_BATCH_KEYS = ("batches", "empty_docs", "real_tokens", "padded_tokens", "fixed_batch_padded_tokens")
+
+_empty_embeddings: Dict[int, np.ndarray] = {}
+
+
+def empty_embedding(embedding_model: Any) -> np.ndarray:
+    """The model's embedding of "", computed once per model."""
+    key = id(embedding_model)
+    if key not in _empty_embeddings:
+        _empty_embeddings[key] = np.asarray(embedding_model.encode([""], show_progress_bar=False),
+                                            dtype=np.float32)[0]
+    return _empty_embeddings[key]
+
+
+def encode_documents(embedding_model: Any, docs: List[str], batch_size: int = 32,
+                     token_budget: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Encode documents, skipping empty ones.
+
+    Without a token budget this is SentenceTransformer.encode with its own
+    fixed-size batches; empty and whitespace-only documents all get the
+    embedding of "" instead of being encoded. With a token budget the
+    documents go through encode_length_bucketed.
+
+    Args:
+        embedding_model: SentenceTransformer
+        docs: Documents to encode
+        batch_size: Encoding batch size
+        token_budget: Padded tokens per batch for length bucketing; None to not bucket
+
+    Returns:
+        tuple: Contains:
+            - embeddings: float32 array with one row per document
+            - stats: Empty documents, plus the bucketing statistics when bucketing
+    """
+    if token_budget:
+        return encode_length_bucketed(embedding_model, docs, batch_size, token_budget)
+    empty = np.array([not doc.strip() for doc in docs], dtype=bool)
+    embeddings = np.empty((len(docs), len(empty_embedding(embedding_model))), dtype=np.float32)
+    embeddings[empty] = empty_embedding(embedding_model)
+    if not empty.all():
+        embeddings[~empty] = embedding_model.encode([doc for doc, skip in zip(docs, empty) if not skip],
+                                                    batch_size=batch_size, show_progress_bar=False)
+    return embeddings, {"empty_docs": int(empty.sum())}
+
+
+def encode_length_bucketed(embedding_model: Any, docs: List[str], batch_size: int = 32,
+                           token_budget: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Encode documents in batches of similar length, returning rows in input order.
+
+    Documents are sorted by token count and packed greedily so that each
+    batch, padded to its longest member, stays within `token_budget` tokens
+    and only holds documents within BUCKET_RATIO of that length.
+    Documents that tokenize to nothing but the special tokens (empty or
+    whitespace-only posts) are not encoded; they all get the model's
+    embedding of "", computed once.
+
+    Args:
+        embedding_model: SentenceTransformer
+        docs: Documents to encode
+        batch_size: Fixed batch size the default budget is derived from
+        token_budget: Padded tokens per batch; defaults to batch_size full-length documents
+
+    Returns:
+        tuple: Contains:
+            - embeddings: float32 array with one row per document
+            - stats: Batch count, empty documents, real tokens, padded tokens and
+              the padded tokens SentenceTransformer.encode's fixed-size batches
+              (sorted by character length) would have used
+    """
+    max_length = embedding_model.max_seq_length
+    token_budget = token_budget or batch_size * max_length
+    lengths = np.array([len(ids) for ids in embedding_model.tokenizer(
+        [""] + list(docs), truncation=True, max_length=max_length)["input_ids"]])
+    empty_length, lengths = lengths[0], lengths[1:]
+
+    embeddings = np.empty((len(docs), len(empty_embedding(embedding_model))), dtype=np.float32)
+    empty = lengths <= empty_length
+    embeddings[empty] = empty_embedding(embedding_model)
+
+    # Longest first, so each batch's padded length is set by its first document
+    order = [int(i) for i in np.argsort(-lengths, kind="stable") if not empty[i]]
+    sorted_lengths = lengths[order]
+    batches = 0
+    padded_tokens = 0
+    start = 0
+    while start < len(order):
+        longest = sorted_lengths[start]
+        bucket_size = int(np.sum(sorted_lengths[start:] * BUCKET_RATIO >= longest))
+        size = max(1, min(MAX_BATCH_DOCS, token_budget // longest, bucket_size))
+        batch = order[start:start + size]
+        embeddings[batch] = embedding_model.encode([docs[i] for i in batch], batch_size=size,
+                                                   show_progress_bar=False)
+        batches += 1
+        padded_tokens += size * longest
+        start += size
+
+    # Baseline: SentenceTransformer.encode's own batching, batch_size documents at a time
+    # in order of character length (longest first), each padded to its longest member
+    encode_lengths = lengths[np.argsort([-len(doc) for doc in docs], kind="stable")]
+    fixed_padded = sum(len(chunk) * chunk.max() for chunk in
+                       (encode_lengths[i:i + batch_size] for i in range(0, len(encode_lengths), batch_size)))
+    return embeddings, {
+        "batches": batches,
+        "empty_docs": int(empty.sum()),
+        "real_tokens": int(lengths[~empty].sum()),
+        "padded_tokens": int(padded_tokens),
+        "fixed_batch_padded_tokens": int(fixed_padded),
+    }
+
+
+def embed_documents(embedding_model: Any, docs: List[str], cache: Optional[EmbeddingCache] = None,
+                    batch_size: int = 32, token_budget: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Embed documents, encoding only the ones missing from the cache.
+
+    Repeated documents within the batch are encoded once. Hit and miss
+    counts are per document, repeats included: hits is memory_hits plus
+    disk_hits, and hits plus misses is the number of documents. encoded
+    counts the distinct documents actually encoded.
+
+    Args:
+        embedding_model: SentenceTransformer
+        docs: Documents to embed
+        cache: Optional EmbeddingCache to read from and fill
+        batch_size: Encoding batch size
+        token_budget: Padded tokens per batch to encode length-bucketed; None to not bucket
+
+    Returns:
+        tuple: Contains:
+            - embeddings: float32 array with one row per document
+            - stats: Hit/miss counts and encoding batch statistics for the response
+    """
+    if cache is None:
+        embeddings, batch_stats = encode_documents(embedding_model, docs, batch_size, token_budget)
+        return embeddings, {"hits": 0, "misses": len(docs), "encoded": len(docs), **batch_stats}
+
+    keys = [document_key(doc) for doc in docs]
+    found, memory_hits, disk_hits = cache.get_many(keys)
+
+    # Encode each distinct missing document once
+    missing: Dict[bytes, str] = {}
+    for key, doc in zip(keys, docs):
+        if key not in found and key not in missing:
+            missing[key] = doc
+    batch_stats = {}
+    if missing:
+        encoded, batch_stats = encode_documents(embedding_model, list(missing.values()), batch_size, token_budget)
+        cache.put_many(list(missing), encoded)
+        found.update(zip(missing, encoded))
+
+    embeddings = np.stack([found[key] for key in keys])
+    stats = {
+        "hits": memory_hits + disk_hits,
+        "misses": len(docs) - memory_hits - disk_hits,
+        "memory_hits": memory_hits,
+        "disk_hits": disk_hits,
+        "encoded": len(missing),
+        **batch_stats,
+        **cache.stats(),
+    }
+    return embeddings, stats
+
+
+def save_corpus_embeddings(directory: str, embeddings: np.ndarray, docs: Sequence[str],
+                           model_name: str = EMBEDDING_MODEL_NAME) -> None:
+    """
+    Write a precomputed store for the whole corpus.
+
+    Creates <directory>/corpus_embeddings.npy (one row per corpus document,
+    in corpus order), <directory>/corpus_keys.npy (the content hash of each
+    row's document) and <directory>/corpus_index.json (metadata).
+
+    Args:
+        directory: Output directory, created if missing
+        embeddings: Embeddings in corpus order, already in the dtype to store
+        docs: The corpus documents the embeddings were computed from
+        model_name: Name of the embedding model
+    """
+    os.makedirs(directory, exist_ok=True)
+    keys = np.frombuffer(b"".join(document_key(doc) for doc in docs), dtype=np.uint8).reshape(-1, KEY_SIZE)
+    np.save(os.path.join(directory, "corpus_embeddings.npy"), embeddings)
+    np.save(os.path.join(directory, "corpus_keys.npy"), keys)
+    with open(os.path.join(directory, "corpus_index.json"), "w") as f:
+        json.dump({
+            "model": model_name,
+            "num_docs": len(docs),
+            "dim": int(embeddings.shape[1]),
+            "dtype": str(embeddings.dtype),
+        }, f, indent=2)
+
+
+def load_corpus_embeddings(directory: str, docs: Sequence[str],
+                           model_name: str = EMBEDDING_MODEL_NAME) -> Optional[np.ndarray]:
+    """
+    Memory-map a precomputed corpus store, if one exists and matches the corpus.
+
+    The store is rejected when it was built with another model or when any
+    document hash differs from the corpus loaded on this worker (for example
+    after a scikit-learn upgrade changed the header/footer/quote stripping).
+
+    Args:
+        directory: Directory written by save_corpus_embeddings
+        docs: The corpus loaded on this worker
+        model_name: Name of the embedding model the handler uses
+
+    Returns:
+        Read-only memory-mapped embeddings in corpus order, or None
+    """
+    index_path = os.path.join(directory, "corpus_index.json")
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path) as f:
+        index = json.load(f)
+    if index["model"] != model_name or index["num_docs"] != len(docs):
+        print(f"Ignoring precomputed embeddings in {directory}: built for "
+              f"{index['model']} with {index['num_docs']} documents")
+        return None
+
+    keys = np.load(os.path.join(directory, "corpus_keys.npy"))
+    expected = np.frombuffer(b"".join(document_key(docs[i]) for i in range(len(docs))),
+                             dtype=np.uint8).reshape(-1, KEY_SIZE)
+    if not np.array_equal(keys, expected):
+        print(f"Ignoring precomputed embeddings in {directory}: corpus contents differ")
+        return None
+
+    return np.load(os.path.join(directory, "corpus_embeddings.npy"), mmap_mode="r")
+
+
+def take_embeddings(store: np.ndarray, indices: Sequence[int]) -> np.ndarray:
+    """
+    Gather the rows for sampled corpus indices as float32.
+
+    Only the sampled rows are read from the memory map, and they are gathered
+    straight into the output array. A contiguous, in-order range is returned
+    as a view without copying when the store is already float32.
+
+    Args:
+        store: Precomputed embeddings from load_corpus_embeddings
+        indices: Sampled corpus indices
+
+    Returns:
+        float32 array with one row per index
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) and store.dtype == np.float32 and np.array_equal(
+            indices, np.arange(indices[0], indices[0] + len(indices))):
+        return store[indices[0]:indices[0] + len(indices)]
+    out = np.empty((len(indices), store.shape[1]), dtype=store.dtype)
+    np.take(store, indices, axis=0, out=out)
+    return out.astype(np.float32, copy=False)
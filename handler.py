@@ -1,16 +1,60 @@
-from typing import Optional, List
+import time
+WORKER_START_TIME = time.time()  # Taken before the heavy imports so cold start includes them
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from corpus import get_corpus, sample_documents
+from embeddings import EMBEDDING_MODEL_NAME, load_corpus_embeddings
+
+
+def _load_data():
+    """Load the corpus and its precomputed embeddings, timing each."""
+    corpus = get_corpus()
+    start_time = time.time()
+    store = load_corpus_embeddings(
+        os.environ.get("CORPUS_EMBEDDINGS_DIR", "corpus_embeddings"), corpus, EMBEDDING_MODEL_NAME)
+    return corpus, store, {"corpus": corpus.load_time, "corpus_embeddings": time.time() - start_time}
+
+
+# Read the data from disk in the background while the heavy libraries below are imported
+_startup_pool = ThreadPoolExecutor(max_workers=1)
+_data_future = _startup_pool.submit(_load_data)
+
+from typing import Any, Optional, List, Dict, Iterable, Tuple
+import numpy as np
 from bertopic import BERTopic
-from sentence_transformers import SentenceTransformer
-import torch
 import runpod
-from sklearn.datasets import fetch_20newsgroups
-import random
+import asyncio
+import gc
+import threading
+from contextlib import nullcontext
+from umap import UMAP
+from hdbscan import HDBSCAN
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+from bertopic.vectorizers import OnlineCountVectorizer
+from concurrency import DocumentBudget, default_doc_budget
+from deadline import Deadline, DeadlineExceeded
+from embeddings import (ENCODING_BATCH_KEYS, EmbeddingCache, embed_documents, load_embedding_model,
+                        take_embeddings)
+from hierarchy import HIERARCHY_MODES, build_hierarchy, hierarchy_fidelity
+from metrics import THROUGHPUT_BUCKETS, MetricsRegistry, start_exporters
+from profiling import StageProfiler, current_rss_bytes
+from result_encoding import RESULT_FORMATS, encode_result
+from reusable_bertopic import ReusableBERTopic
 
 def run_topic_model_hierarchical(
     topic_model, 
     docs, 
     topics: Optional[List[str]] = None, 
-    nr_topics: Optional[int] = None
+    nr_topics: Optional[int] = None,
+    embeddings: Optional[np.ndarray] = None,
+    timings: Optional[Dict[str, float]] = None,
+    profiler: Optional[StageProfiler] = None,
+    hierarchy: str = "full",
+    document_counts: Optional[np.ndarray] = None,
+    deadline: Optional[Deadline] = None
 ):
     """
     Run hierarchical topic modeling on the provided documents.
@@ -20,68 +64,628 @@ def run_topic_model_hierarchical(
         docs: List of documents to process
         topics: Optional list of predefined topics
         nr_topics: Optional number of topics to reduce to after fitting
+        embeddings: Optional precomputed document embeddings; the model's
+            embedding backend is only used when omitted
+        timings: Optional dict that receives the fit, reduce and hierarchy
+            stage times in seconds
+        profiler: Optional StageProfiler that records each stage's CPU time
+            and peak RSS, including BERTopic's internal fit stages
+        hierarchy: One of HIERARCHY_MODES (see hierarchy.build_hierarchy)
+        document_counts: Optional number of times each document was sampled,
+            passed to ReusableBERTopic to weight its bag-of-words
+        deadline: Optional Deadline, checked before every stage (raises DeadlineExceeded)
 
     Returns:
         tuple: Contains:
             - topics: List of identified topics
             - probs: Topic probabilities for each document
-            - hierarchical_topics: Hierarchical structure of topics
+            - hierarchical_topics: Hierarchical structure of topics, None for "none"
     """
-    # First fit the model normally
-    topics, probs = topic_model.fit_transform(docs)
+    if timings is None:
+        timings = {}
+    if deadline is None:
+        deadline = Deadline()
+
+    def stage(name):
+        return profiler.stage(name) if profiler is not None else nullcontext()
+
+    # First fit the model normally; a profiler also times BERTopic's internal fit stages
+    deadline.check("fit")
+    stage_start = time.time()
+    with stage("fit"), profiler.instrument(topic_model) if profiler is not None else nullcontext(), \
+            deadline.instrument(topic_model):
+        fit_kwargs = {"document_counts": document_counts} if document_counts is not None else {}
+        topics, probs = topic_model.fit_transform(docs, embeddings=embeddings, **fit_kwargs)
+    timings["fit"] = time.time() - stage_start
 
     # If nr_topics is specified, reduce the topics
     if nr_topics is not None:
-        topic_model.reduce_topics(docs, nr_topics=nr_topics)
+        deadline.check("reduce")
+        stage_start = time.time()
+        with stage("reduce"):
+            topic_model.reduce_topics(docs, nr_topics=nr_topics)
         topics = topic_model.topics_
         probs = topic_model.probabilities_
+        timings["reduce"] = time.time() - stage_start
 
-    hierarchical_topics = topic_model.hierarchical_topics(docs)
+    if hierarchy == "none":
+        return topics, probs, None
+    deadline.check("hierarchy")
+    stage_start = time.time()
+    with stage("hierarchy"):
+        hierarchical_topics = build_hierarchy(topic_model, docs, hierarchy)
+    timings["hierarchy"] = time.time() - stage_start
     return topics, probs, hierarchical_topics
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-topic_model = BERTopic(embedding_model=SentenceTransformer("all-MiniLM-L6-v2",      
-device=device))
+def run_topic_model_online(
+    topic_model,
+    chunks: Iterable[Tuple[List[str], np.ndarray]],
+    timings: Optional[Dict[str, float]] = None,
+    profiler: Optional[StageProfiler] = None,
+    hierarchy: str = "ctfidf",
+    deadline: Optional[Deadline] = None
+):
+    """
+    Fit an online topic model chunk by chunk, keeping memory bounded.
+
+    Only one chunk of documents and embeddings is alive at a time. The number
+    of topics is fixed by the clustering model, so there is no reduction
+    step, and the hierarchy is built from the fitted c-TF-IDF matrix instead
+    of the full document list.
+
+    Args:
+        topic_model: BERTopic model with online sub-models (see build_online_topic_model)
+        chunks: Iterable of (documents, embeddings) chunks
+        timings: Optional dict that receives the fit and hierarchy stage times
+        profiler: Optional StageProfiler
+        hierarchy: "ctfidf", "embeddings" or "none"; "full" needs the documents
+            and is treated as "ctfidf"
+        deadline: Optional Deadline, checked before every chunk (raises DeadlineExceeded)
+
+    Returns:
+        tuple: Contains:
+            - topics: Topic of every document, in chunk order
+            - probs: None, the online clustering has no probabilities
+            - hierarchical_topics: Hierarchical structure of topics, None for "none"
+    """
+    if timings is None:
+        timings = {}
+    if deadline is None:
+        deadline = Deadline()
+
+    def stage(name):
+        return profiler.stage(name) if profiler is not None else nullcontext()
+
+    topics = []
+    timings["fit"] = 0.0
+    for chunk_docs, chunk_embeddings in chunks:
+        deadline.check("partial_fit")
+        stage_start = time.time()
+        with stage("partial_fit"):
+            # MiniBatchKMeans keeps float64 centers after its first batch and rejects later
+            # float32 batches, so feed every chunk as float64
+            topic_model.partial_fit(chunk_docs, embeddings=chunk_embeddings.astype(np.float64))
+        timings["fit"] += time.time() - stage_start
+        topics.extend(topic_model.topics_)
+
+    if hierarchy == "none":
+        return topics, None, None
+    deadline.check("hierarchy")
+    stage_start = time.time()
+    with stage("hierarchy"):
+        hierarchical_topics = build_hierarchy(topic_model, None, "ctfidf" if hierarchy == "full" else hierarchy)
+    timings["hierarchy"] = time.time() - stage_start
+    return topics, None, hierarchical_topics
+
+STARTUP_TIMINGS = {"imports": time.time() - WORKER_START_TIME}
+
+_embedding_model: Optional[Any] = None
+_embedding_model_lock = threading.Lock()
+
+
+def get_embedding_model() -> Any:
+    """
+    Return the process-wide SentenceTransformer, loading it on first use.
+
+    The encoder is the only expensive, stateless part of the pipeline, so all
+    jobs share one warm instance. It is loaded from the weights baked into the
+    image when EMBEDDING_MODEL_PATH is set.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                _embedding_model = load_embedding_model()
+    return _embedding_model
+
+
+def build_topic_model(min_topic_size: int = 10, random_state: Optional[int] = None) -> BERTopic:
+    """
+    Build a fresh BERTopic pipeline for one job.
+
+    BERTopic keeps fitted state (topics_, probabilities_, reduced topics) on
+    the instance, so every job gets its own model. Only the shared embedding
+    model is reused; the UMAP and HDBSCAN components are unfitted and cheap
+    to construct. Their settings match BERTopic's defaults.
+
+    The model is a ReusableBERTopic, so reduce_topics and hierarchical_topics
+    reuse the bag-of-words from the fit instead of re-vectorizing the
+    documents; topics and hierarchy are the same as plain BERTopic's.
+
+    Args:
+        min_topic_size: Minimum cluster size for HDBSCAN
+        random_state: Seed for UMAP, making the fit reproducible (and single-threaded)
+
+    Returns:
+        Unfitted BERTopic model
+    """
+    umap_model = UMAP(n_neighbors=15, n_components=5, min_dist=0.0, metric="cosine",
+                      random_state=random_state)
+    hdbscan_model = HDBSCAN(min_cluster_size=min_topic_size, metric="euclidean",
+                            cluster_selection_method="eom", prediction_data=True)
+    return ReusableBERTopic(embedding_model=get_embedding_model(), umap_model=umap_model,
+                            hdbscan_model=hdbscan_model, min_topic_size=min_topic_size)
+
+
+def build_online_topic_model(nr_topics: int, random_state: Optional[int] = None) -> BERTopic:
+    """
+    Build a BERTopic pipeline that supports partial_fit for large jobs.
+
+    IncrementalPCA stands in for UMAP, MiniBatchKMeans for HDBSCAN (with the
+    requested number of topics as clusters) and OnlineCountVectorizer keeps
+    the bag-of-words vocabulary up to date across chunks.
+
+    Args:
+        nr_topics: Number of topics (clusters) to learn
+        random_state: Seed for the clustering
+
+    Returns:
+        Unfitted BERTopic model
+    """
+    return BERTopic(embedding_model=get_embedding_model(),
+                    umap_model=IncrementalPCA(n_components=5),
+                    hdbscan_model=MiniBatchKMeans(n_clusters=nr_topics, random_state=random_state),
+                    vectorizer_model=OnlineCountVectorizer())
+
+
+# Embedding backend and encoding settings, chosen per deployment (see embeddings.py)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND") or "torch"
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "32"))
+# Padded tokens per length-bucketed encoding batch; 0 keeps SentenceTransformer's fixed-size batches
+EMBEDDING_TOKEN_BUDGET = int(os.environ.get("EMBEDDING_TOKEN_BUDGET", "0")) or None
+
+_model_start = time.time()
+# Warm the shared encoder at start-up so the first job doesn't pay for it
+embedding_model = get_embedding_model()
+STARTUP_TIMINGS["embedding_model"] = time.time() - _model_start
+print(f"Loaded {EMBEDDING_BACKEND} embedding backend (batch size {EMBEDDING_BATCH_SIZE})")
+
+_reference_model: Optional[Any] = None
+
+
+def get_reference_model() -> Any:
+    """The fp32 PyTorch encoder that other backends are checked against, loaded on first use."""
+    global _reference_model
+    if EMBEDDING_BACKEND == "torch":
+        return embedding_model
+    if _reference_model is None:
+        with _embedding_model_lock:
+            if _reference_model is None:
+                _reference_model = load_embedding_model(backend="torch")
+    return _reference_model
+
+# Embeddings of previously seen documents, keyed by content hash
+embedding_cache = EmbeddingCache(
+    max_bytes=int(os.environ.get("EMBEDDING_CACHE_MB", "256")) * 2**20,
+    disk_dir=os.environ.get("EMBEDDING_CACHE_DIR") or None,
+    disk_capacity=int(os.environ.get("EMBEDDING_CACHE_DISK_ROWS", "100000")))
+
+# The cleaned corpus (loaded once per worker so jobs only pay for sampling) and the
+# embeddings pre-computed for it at image build time by build_embeddings.py
+_data_wait_start = time.time()
+corpus, corpus_embeddings, _data_timings = _data_future.result()
+_startup_pool.shutdown()
+STARTUP_TIMINGS.update(_data_timings)
+STARTUP_TIMINGS["data_wait"] = time.time() - _data_wait_start
+if corpus_embeddings is not None:
+    print(f"Using precomputed embeddings {corpus_embeddings.shape} {corpus_embeddings.dtype}")
+
+# Start-up cost (imports, model and corpus load) is reported once, by the first job
+WORKER_COLD_START_TIME = time.time() - WORKER_START_TIME
+STARTUP_TIMINGS["ready"] = WORKER_COLD_START_TIME
+_first_job = True
+_first_job_lock = threading.Lock()
+print(f"Worker ready in {WORKER_COLD_START_TIME:.2f}s: "
+      + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in STARTUP_TIMINGS.items()))
+
+# Concurrent jobs per worker (1 keeps the synchronous handler). Fitting runs in
+# a thread pool, since the heavy numba/numpy/torch work releases the GIL and
+# threads share the warm encoder, corpus and embeddings instead of copying them.
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "1"))
+WORKER_DOC_BUDGET = int(os.environ.get("WORKER_DOC_BUDGET", "0")) or default_doc_budget()
+
+# Jobs above this many unique documents stream through the online (partial_fit)
+# pipeline. Off by default: sampling is unique, and the whole ~18.8k-document
+# corpus fits the regular pipeline, so online mode is opt-in per job
+ONLINE_THRESHOLD_DOCS = int(os.environ.get("ONLINE_THRESHOLD_DOCS", "0"))
+ONLINE_CHUNK_SIZE = int(os.environ.get("ONLINE_CHUNK_SIZE", "5000"))
+
+# Worker metrics, served for scraping on METRICS_PORT and/or written to METRICS_SNAPSHOT_PATH
+METRICS_PORT = os.environ.get("METRICS_PORT")
+METRICS_HOST = os.environ.get("METRICS_HOST", "0.0.0.0")
+METRICS_SNAPSHOT_PATH = os.environ.get("METRICS_SNAPSHOT_PATH")
+METRICS_SNAPSHOT_INTERVAL = float(os.environ.get("METRICS_SNAPSHOT_INTERVAL", "15"))
+
+metrics = MetricsRegistry()
+JOBS = metrics.counter("bertopic_worker_jobs_total", "Jobs finished, by outcome", ["status"])
+JOBS_IN_PROGRESS = metrics.gauge("bertopic_worker_jobs_in_progress", "Jobs running on this worker")
+JOB_SECONDS = metrics.histogram("bertopic_worker_job_duration_seconds", "Handler time of completed jobs")
+STAGE_SECONDS = metrics.histogram("bertopic_worker_stage_seconds", "Time of each job stage", ["stage"])
+DOCUMENTS = metrics.counter("bertopic_worker_documents_total", "Unique documents of completed jobs")
+DOCS_PER_SECOND = metrics.histogram("bertopic_worker_job_documents_per_second",
+                                    "Unique documents per second of handler time", buckets=THROUGHPUT_BUCKETS)
+CACHE_HITS = metrics.counter("bertopic_worker_embedding_cache_hits_total", "Documents whose embedding was reused")
+CACHE_MISSES = metrics.counter("bertopic_worker_embedding_cache_misses_total", "Documents that had to be encoded")
+metrics.gauge("bertopic_worker_embedding_cache_hit_ratio", "Embedding cache hits over all lookups so far",
+              function=lambda: CACHE_HITS.value() / max(1, CACHE_HITS.value() + CACHE_MISSES.value()))
+metrics.gauge("bertopic_worker_resident_memory_bytes", "Resident set size of the worker process",
+              function=current_rss_bytes)
+metrics.gauge("bertopic_worker_cold_start_seconds", "Worker start-up time",
+              function=lambda: WORKER_COLD_START_TIME)
+if METRICS_PORT or METRICS_SNAPSHOT_PATH:
+    try:
+        start_exporters(metrics, int(METRICS_PORT) if METRICS_PORT else None, METRICS_SNAPSHOT_PATH,
+                        METRICS_SNAPSHOT_INTERVAL, METRICS_HOST)
+    except OSError as e:
+        # e.g. a second handler process on the same port; the worker itself still runs
+        print(f"Could not start metrics export: {e}")
+
+
+def record_job_metrics(output: Dict[str, Any]) -> None:
+    """
+    Add a completed job's timings, throughput and cache counts to the worker metrics.
+
+    Args:
+        output: The handler output
+    """
+    timings = output["timings"]
+    JOBS.inc(status="completed")
+    JOB_SECONDS.observe(timings["total"])
+    for stage, seconds in timings.items():
+        if stage not in ("total", "cold_start"):
+            STAGE_SECONDS.observe(seconds, stage=stage)
+    DOCUMENTS.inc(output["num_unique_docs"])
+    if timings["total"] > 0:
+        DOCS_PER_SECOND.observe(output["num_unique_docs"] / timings["total"])
+    CACHE_HITS.inc(output["embedding_cache"].get("hits", 0))
+    CACHE_MISSES.inc(output["embedding_cache"].get("misses", 0))
+
+
+def embed_sample(sample_indices: List[int], sample_docs: List[str], use_precomputed: bool = True,
+                 use_embedding_cache: bool = True) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Embed sampled documents: slice the precomputed store, or encode only cache misses.
+
+    Args:
+        sample_indices: Corpus indices of the documents
+        sample_docs: The documents themselves
+        use_precomputed: Use the build-time corpus embeddings when available
+        use_embedding_cache: Use the embedding cache when encoding
+
+    Returns:
+        tuple: Contains:
+            - embeddings: One row per document
+            - stats: Embedding cache hit/miss counts and encoding batch statistics
+    """
+    if corpus_embeddings is not None and use_precomputed:
+        embeddings = take_embeddings(corpus_embeddings, sample_indices)
+        return embeddings, {"hits": len(sample_docs), "misses": 0, "encoded": 0, "precomputed": True}
+    return embed_documents(embedding_model, sample_docs, embedding_cache if use_embedding_cache else None,
+                           batch_size=EMBEDDING_BATCH_SIZE, token_budget=EMBEDDING_TOKEN_BUDGET)
+
+
+def batch_report(batch_stats: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Encoding batch statistics with padding efficiency.
+
+    Args:
+        batch_stats: Summed batch statistics from encode_documents
+
+    Returns:
+        The statistics plus, when length bucketing was on, padding_efficiency
+        (real / padded tokens) and the efficiency SentenceTransformer.encode's
+        fixed-size, character-length sorted batches would have had
+    """
+    def efficiency(padded: int) -> float:
+        return batch_stats.get("real_tokens", 0) / padded if padded else 1.0
+
+    if "padded_tokens" not in batch_stats:
+        return dict(batch_stats)
+    return {
+        **batch_stats,
+        "padding_efficiency": efficiency(batch_stats.get("padded_tokens", 0)),
+        "fixed_batch_padding_efficiency": efficiency(batch_stats.get("fixed_batch_padded_tokens", 0)),
+    }
+
+
+def check_topic_agreement(docs: List[str], embeddings: np.ndarray, topics: List[int],
+                          nr_topics: Optional[int], random_state: int,
+                          document_counts: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    Compare a job's topics with a fit on fp32 reference embeddings.
+
+    The documents are encoded again with the fp32 PyTorch model and fitted
+    with the same settings and seed. The two topic assignments are then
+    compared with permutation-invariant scores, so topic IDs need not match.
+
+    Args:
+        docs: The job's documents
+        embeddings: Embeddings the job was fitted on
+        topics: Topic per document from the job's fit
+        nr_topics: Topic count the job reduced to
+        random_state: UMAP seed used for the job's fit
+        document_counts: Document counts the job was fitted with
+
+    Returns:
+        Adjusted Rand index and normalized mutual information between the
+        assignments, mean cosine similarity of the embeddings and the time
+        the check took
+    """
+    start_time = time.time()
+    reference = np.asarray(get_reference_model().encode(docs, batch_size=EMBEDDING_BATCH_SIZE,
+                                                        show_progress_bar=False), dtype=np.float32)
+    reference_model = build_topic_model(random_state=random_state)
+    reference_model.fit_transform(docs, embeddings=reference, document_counts=document_counts)
+    if nr_topics is not None:
+        reference_model.reduce_topics(docs, nr_topics=nr_topics)
+
+    cosine = np.sum(embeddings * reference, axis=1) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1) + 1e-12)
+    return {
+        "backend": EMBEDDING_BACKEND,
+        "reference": "torch-fp32",
+        "adjusted_rand_index": float(adjusted_rand_score(reference_model.topics_, topics)),
+        "normalized_mutual_info": float(normalized_mutual_info_score(reference_model.topics_, topics)),
+        "mean_embedding_cosine": float(cosine.mean()),
+        "min_embedding_cosine": float(cosine.min()),
+        "seconds": time.time() - start_time
+    }
 
 
 def handler(event):
+    global _first_job
+    JOBS_IN_PROGRESS.inc()
     try: 
+        job_start = time.time()
+        with _first_job_lock:
+            cold_start_time = WORKER_COLD_START_TIME if _first_job else 0.0
+            _first_job = False
+        
         input = event["input"]
         print("Received input:", input)
+        # Absolute Unix time after which the caller no longer wants the result
+        deadline = Deadline.from_input(input)
+        deadline.check("start")
         
         # Extract parameters
         num_docs = input.get("num_docs", 100)  # Number of documents to process
         num_topics = input.get("num_topics", 10)  # Number of topics to reduce to
         random_seed = input.get("random_seed", 42)  # Random seed for reproducibility
+        profile = input.get("profile", False)  # Per-stage timing, CPU and peak RSS
+        cprofile = input.get("cprofile", False)  # Also return a cProfile dump (implies profile)
+        use_embedding_cache = input.get("embedding_cache", True)  # Reuse embeddings of seen documents
+        use_precomputed = input.get("precomputed_embeddings", True)  # Slice build-time corpus embeddings
+        online = input.get("online")  # Stream chunks through partial_fit (default: above ONLINE_THRESHOLD_DOCS if set)
+        chunk_size = input.get("chunk_size", ONLINE_CHUNK_SIZE)  # Documents per partial_fit chunk
+        check_agreement = input.get("check_agreement", False)  # Compare topics with an fp32 embedding fit
+        if check_agreement:
+            # The precomputed store and the cache may hold fp32 embeddings; the check
+            # needs this deployment's backend to encode the sample itself
+            use_precomputed = use_embedding_cache = False
+        hierarchy = input.get("hierarchy", "full")  # Hierarchy mode, or False for flat topics only
+        check_hierarchy = input.get("check_hierarchy", False)  # Score an approximate hierarchy against "full"
+        if isinstance(hierarchy, bool):
+            hierarchy = "full" if hierarchy else "none"
+        if hierarchy not in HIERARCHY_MODES:
+            raise ValueError(f"Unknown hierarchy mode {hierarchy!r}, expected one of {HIERARCHY_MODES}")
+        result_format = input.get("result_format", "json")  # "json", "compact" (packed arrays) or "none"
+        result_compression = input.get("result_compression", "zlib")  # Compact arrays: "zlib" or "none"
+        result_chunk_size = input.get("result_chunk_size", 0)  # Documents per result chunk, 0 for one chunk
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Unknown result format {result_format!r}, expected one of {RESULT_FORMATS}")
         
         print(f"Processing {num_docs} documents with {num_topics} topics")
         
-        # Download and prepare the dataset
-        print("Loading 20 newsgroups dataset...")
-        newsgroups = fetch_20newsgroups(subset='all', remove=('headers', 'footers', 'quotes'))
-        docs = newsgroups.data
+        # Reuse the process-level corpus; only the first job ever pays for loading it
+        load_start = time.time()
+        docs = get_corpus()
+        corpus_load_time = time.time() - load_start
         
-        # Set random seed for reproducibility
-        random.seed(random_seed)
+        # Per-job generator: seeding the global RNG is not safe with concurrent jobs
+        rng = np.random.default_rng(random_seed)
         
-        # Sample the requested number of documents
-        if num_docs <= len(docs):
-            sample_docs = random.sample(docs, num_docs)
-        else:
-            # If requested more than available, use all and repeat
-            sample_docs = random.choices(docs, k=num_docs)
+        # Sample the requested number of documents as unique corpus indices; a document
+        # drawn more than once is embedded and clustered once and carries its count
+        sample_start = time.time()
+        sample_indices, sample_counts = sample_documents(len(docs), num_docs, rng)
+        if online is None:
+            online = 0 < ONLINE_THRESHOLD_DOCS < len(sample_indices)
+        # Large jobs materialize their documents one chunk at a time
+        sample_docs = docs.take(sample_indices) if not online else None
+        document_counts = sample_counts if len(sample_indices) < num_docs else None
+        sampling_time = time.time() - sample_start
         
-        print(f"Selected {len(sample_docs)} documents for processing")
+        print(f"Selected {len(sample_indices)} unique documents of {num_docs} for processing"
+              + (f" in chunks of {chunk_size} (online)" if online else ""))
         
-        # Run topic modeling
-        topics, probs, hierarchical_topics = run_topic_model_hierarchical(
-            topic_model, sample_docs, nr_topics=num_topics)
+        # Large jobs always report peak memory so we can check it stays bounded
+        profiler = StageProfiler(cprofile=cprofile) if (profile or cprofile or online) else None
+        with profiler if profiler is not None else nullcontext():
+            model_start = time.time()
+            model_timings = {}
+            cache_stats = {}
+            batch_stats = {}
+            embedding_time = 0.0
+            
+            def embed(indices, chunk_docs):
+                nonlocal embedding_time
+                deadline.check("embedding")
+                embedding_start = time.time()
+                with profiler.stage("embedding") if profiler is not None else nullcontext():
+                    embeddings, stats = embed_sample(indices, chunk_docs, use_precomputed, use_embedding_cache)
+                embedding_time += time.time() - embedding_start
+                for key in ENCODING_BATCH_KEYS:
+                    if key in stats:
+                        batch_stats[key] = batch_stats.get(key, 0) + stats.pop(key)
+                # Counts add up across chunks; cache sizes are the latest snapshot
+                for key in ("hits", "misses", "memory_hits", "disk_hits", "encoded"):
+                    if key in stats:
+                        stats[key] += cache_stats.get(key, 0)
+                cache_stats.update(stats)
+                return embeddings
+            
+            if online:
+                def chunks():
+                    for start in range(0, len(sample_indices), chunk_size):
+                        chunk_indices = sample_indices[start:start + chunk_size]
+                        chunk_docs = docs.take(chunk_indices)
+                        yield chunk_docs, embed(chunk_indices, chunk_docs)
+                
+                topic_model = build_online_topic_model(num_topics, random_state=random_seed)
+                topics, probs, hierarchical_topics = run_topic_model_online(
+                    topic_model, chunks(), timings=model_timings, profiler=profiler, hierarchy=hierarchy,
+                    deadline=deadline)
+            else:
+                embeddings = embed(sample_indices, sample_docs)
+                
+                # Run topic modeling on a model owned by this job; the agreement
+                # check needs a seeded fit to compare against
+                topic_model = build_topic_model(random_state=random_seed if check_agreement else None)
+                topics, probs, hierarchical_topics = run_topic_model_hierarchical(
+                    topic_model, sample_docs, nr_topics=num_topics, embeddings=embeddings,
+                    timings=model_timings, profiler=profiler, hierarchy=hierarchy,
+                    document_counts=document_counts, deadline=deadline)
+            
+            modeling_time = time.time() - model_start - embedding_time
+            print(f"Embedded documents: {cache_stats['hits']} cache hits, {cache_stats['misses']} misses")
         
         print(f"Completed topic modeling. Found {len(set(topics))} unique topics")
+        
+        deadline.check("serialization")
+        serialization_start = time.time()
+        result = None
+        if result_format != "none":
+            result = encode_result(topics, probs, hierarchical_topics, result_format,
+                                   result_compression, result_chunk_size, sample_indices, sample_counts)
+        serialization_time = time.time() - serialization_start
   
-        return {"completed": True}
+        output = {
+            "completed": True,
+            "online": online,
+            "num_unique_docs": len(sample_indices),
+            "corpus_initial_load_time": docs.load_time,
+            "timings": {
+                "cold_start": cold_start_time,
+                "corpus_load": corpus_load_time,
+                "sampling": sampling_time,
+                "embedding": embedding_time,
+                **model_timings,
+                "topic_modeling": modeling_time,
+                "serialization": serialization_time,
+                "total": time.time() - job_start
+            },
+            "embedding_cache": cache_stats,
+            # Embeddings gathered from the store were computed by the fp32 model, not this backend
+            "embedding_backend": "precomputed" if cache_stats.get("precomputed") else EMBEDDING_BACKEND,
+            "hierarchy": hierarchy if not (online and hierarchy == "full") else "ctfidf"
+        }
+        if result is not None:
+            output["result"] = result
+        if check_agreement and not online:
+            deadline.check("check_agreement")
+            # Runs after the timed stages so it does not skew them
+            output["agreement"] = check_topic_agreement(sample_docs, embeddings, topics, num_topics, random_seed,
+                                                        document_counts)
+            print(f"Topic agreement with fp32: ARI {output['agreement']['adjusted_rand_index']:.3f}")
+        if check_hierarchy and not online and hierarchy not in ("full", "none"):
+            # Also after the timed stages: the exact hierarchy is what the fast modes skip
+            deadline.check("check_hierarchy")
+            exact_start = time.time()
+            exact = build_hierarchy(topic_model, sample_docs, "full")
+            output["hierarchy_fidelity"] = {**hierarchy_fidelity(exact, hierarchical_topics),
+                                            "full_seconds": time.time() - exact_start}
+            print(f"Hierarchy fidelity ({hierarchy}): {output['hierarchy_fidelity']}")
+        if cold_start_time:
+            output["startup"] = STARTUP_TIMINGS
+        if profiler is not None:
+            output["profile"] = {"num_docs": len(sample_indices), **profiler.report()}
+            if batch_stats:
+                output["profile"]["embedding_batches"] = batch_report(batch_stats)
+        record_job_metrics(output)
+        return output
+    except DeadlineExceeded as e:
+        JOBS.inc(status="deadline_exceeded")
+        print(f"Aborting job: {e}")
+        # The job's documents, embeddings and model are unreachable now; free them
+        # before the next job rather than whenever the collector next runs
+        gc.collect()
+        return {
+            "error": str(e),
+            "deadline_exceeded": True,
+            "stage": e.stage,
+            "timings": {"total": time.time() - job_start}
+        }
     except Exception as e:
+        JOBS.inc(status="failed")
         print(f"Error: {e}")
         raise e
+    finally:
+        JOBS_IN_PROGRESS.dec()
+
+
+executor = ThreadPoolExecutor(max_workers=max(1, WORKER_CONCURRENCY))
+doc_budget = DocumentBudget(WORKER_DOC_BUDGET)
+
+
+async def async_handler(event):
+    """
+    Run a job in the bounded executor once its documents fit in the budget.
+
+    Args:
+        event: RunPod job event
+
+    Returns:
+        The handler output
+    """
+    # A job holds unique documents, so it never holds more than the whole corpus
+    num_docs = min(event["input"].get("num_docs", 100), len(get_corpus()))
+    async with doc_budget.reserve(num_docs):
+        # A job that expired waiting for the budget returns without taking an executor thread
+        try:
+            Deadline.from_input(event["input"]).check("start")
+        except DeadlineExceeded as e:
+            JOBS.inc(status="deadline_exceeded")
+            return {"error": str(e), "deadline_exceeded": True, "stage": e.stage}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, handler, event)
+
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """
+    Tell RunPod how many jobs this worker should take.
+
+    Stays at the number already running while the document budget is
+    exhausted or a job is waiting for it, so queued jobs can go to other
+    workers.
+    """
+    if doc_budget.free <= 0 or doc_budget.waiting:
+        return max(1, doc_budget.running)
+    return WORKER_CONCURRENCY
+
 
-runpod.serverless.start({"handler": handler})
\ No newline at end of file
+if __name__ == "__main__":
+    if WORKER_CONCURRENCY > 1:
+        print(f"Running up to {WORKER_CONCURRENCY} jobs at once with a budget of {WORKER_DOC_BUDGET} documents")
+        runpod.serverless.start({"handler": async_handler, "concurrency_modifier": concurrency_modifier})
+    else:
+        runpod.serverless.start({"handler": handler})
@@ -0,0 +1,235 @@
+"""
+Topic hierarchy built from the fitted topic vectors alone.
+
+BERTopic's hierarchical_topics(docs) needs every document again and
+recomputes c-TF-IDF for each merge. This builds the same kind of linkage
+over the fitted c-TF-IDF rows and names each merged topic by the top words
+of its children's summed c-TF-IDF, so it needs neither the documents nor
+the vectorizer to be re-run.
+
+hierarchy_from_topic_embeddings links the topic embeddings (the centroids
+of each topic's document embeddings) instead, which is the cheapest option
+for models with hundreds of topics.
+
+hierarchy_from_topic_bow reproduces BERTopic's hierarchical_topics exactly
+from a bag-of-words per topic that the caller already has.
+hierarchy_fidelity scores an approximate hierarchy against the exact one.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from bertopic._utils import get_unique_distances, validate_distance_matrix
+from scipy.cluster import hierarchy as sch
+from scipy.sparse import csr_matrix
+from scipy.stats import spearmanr
+from sklearn.metrics.pairwise import cosine_similarity
+
+# Per-request hierarchy modes: BERTopic's exact merge loop, links over c-TF-IDF
+# rows or over topic embeddings, or no hierarchy at all
+HIERARCHY_MODES = ("full", "ctfidf", "embeddings", "none")
+
+
+def _top_words_name(c_tf_idf_row: csr_matrix, words: np.ndarray, top_n: int = 5) -> str:
+    top = np.argsort(c_tf_idf_row.data)[::-1][:top_n]
+    return "_".join(words[c_tf_idf_row.indices[i]] for i in top if c_tf_idf_row.data[i] > 0)
+
+
+def hierarchy_from_topic_vectors(topic_model, vectors: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Hierarchical topics from a fitted model's c-TF-IDF matrix.
+
+    Uses the same distance (1 - cosine similarity) and linkage (ward) as
+    BERTopic's hierarchical_topics and returns the same columns.
+
+    Args:
+        topic_model: Fitted BERTopic model
+        vectors: Optional vectors to link instead of the c-TF-IDF rows, one
+            per topic excluding outliers; merged topics are still named
+            from c-TF-IDF
+
+    Returns:
+        DataFrame with Parent_ID, Parent_Name, Topics, Child_Left_ID,
+        Child_Left_Name, Child_Right_ID, Child_Right_Name and Distance
+    """
+    c_tf_idf = topic_model.c_tf_idf_[topic_model._outliers:]
+    words = np.asarray(topic_model.vectorizer_model.get_feature_names_out())
+    nr_topics = c_tf_idf.shape[0]
+    columns = ["Parent_ID", "Parent_Name", "Topics", "Child_Left_ID",
+               "Child_Left_Name", "Child_Right_ID", "Child_Right_Name", "Distance"]
+    if nr_topics < 2:
+        return pd.DataFrame(columns=columns)
+
+    X = validate_distance_matrix(1 - cosine_similarity(c_tf_idf if vectors is None else vectors), nr_topics)
+    Z = sch.linkage(X, "ward", optimal_ordering=True)
+    if len(Z[:, 2]) != len(np.unique(Z[:, 2])):
+        Z[:, 2] = get_unique_distances(Z[:, 2])
+
+    # Each node carries its leaf topics and summed c-TF-IDF, so merges are just additions
+    node_topics = [[topic] for topic in range(nr_topics)]
+    node_vectors = [csr_matrix(c_tf_idf[topic]) for topic in range(nr_topics)]
+    node_names = [_top_words_name(vector, words) for vector in node_vectors]
+
+    rows = []
+    for index, (left, right, distance, _) in enumerate(Z):
+        left, right = int(left), int(right)
+        node_topics.append(node_topics[left] + node_topics[right])
+        node_vectors.append(node_vectors[left] + node_vectors[right])
+        node_names.append(_top_words_name(node_vectors[-1], words))
+        rows.append([str(nr_topics + index), node_names[-1], sorted(node_topics[-1]), str(left),
+                     node_names[left], str(right), node_names[right], distance])
+
+    hier_topics = pd.DataFrame(rows, columns=columns)
+    return hier_topics.iloc[::-1].reset_index(drop=True)
+
+
+def hierarchy_from_topic_embeddings(topic_model) -> pd.DataFrame:
+    """
+    Hierarchical topics linked by topic embeddings instead of c-TF-IDF.
+
+    BERTopic keeps one embedding per topic (the mean of its documents'
+    embeddings, size-weighted after reduction). Linking those dense,
+    low-dimensional vectors is cheaper than linking c-TF-IDF rows over the
+    whole vocabulary. Falls back to c-TF-IDF when the model has no topic
+    embeddings.
+
+    Args:
+        topic_model: Fitted BERTopic model
+
+    Returns:
+        Same columns as hierarchy_from_topic_vectors
+    """
+    if topic_model.topic_embeddings_ is None:
+        return hierarchy_from_topic_vectors(topic_model)
+    return hierarchy_from_topic_vectors(topic_model, np.asarray(topic_model.topic_embeddings_)[topic_model._outliers:])
+
+
+def build_hierarchy(topic_model, docs: Optional[List[str]], mode: str = "full") -> Optional[pd.DataFrame]:
+    """
+    Hierarchical topics in one of HIERARCHY_MODES.
+
+    Args:
+        topic_model: Fitted BERTopic model
+        docs: The fitted documents; only "full" needs them
+        mode: "full" for topic_model.hierarchical_topics(docs), "ctfidf" for
+            hierarchy_from_topic_vectors, "embeddings" for
+            hierarchy_from_topic_embeddings, "none" to skip
+
+    Returns:
+        The hierarchy, or None for "none"
+    """
+    if mode == "full":
+        return topic_model.hierarchical_topics(docs)
+    if mode == "ctfidf":
+        return hierarchy_from_topic_vectors(topic_model)
+    if mode == "embeddings":
+        return hierarchy_from_topic_embeddings(topic_model)
+    if mode == "none":
+        return None
+    raise ValueError(f"Unknown hierarchy mode {mode!r}, expected one of {HIERARCHY_MODES}")
+
+
+def _merge_ranks(hier_topics: pd.DataFrame, nr_topics: int) -> np.ndarray:
+    """Index of the merge joining each pair of leaf topics (a rank-based cophenetic matrix)."""
+    leaves = {str(topic): [topic] for topic in range(nr_topics)}
+    ranks = np.zeros((nr_topics, nr_topics))
+    merges = hier_topics.assign(order=hier_topics.Parent_ID.astype(int)).sort_values("order")
+    for rank, row in enumerate(merges.itertuples(index=False), start=1):
+        left, right = leaves[str(row.Child_Left_ID)], leaves[str(row.Child_Right_ID)]
+        ranks[np.ix_(left, right)] = rank
+        ranks[np.ix_(right, left)] = rank
+        leaves[str(row.Parent_ID)] = left + right
+    return ranks
+
+
+def hierarchy_fidelity(exact: pd.DataFrame, approximate: pd.DataFrame) -> Dict[str, float]:
+    """
+    How closely an approximate hierarchy matches the exact one.
+
+    Both hierarchies must cover the same topics. Distances of different
+    modes are not comparable, so trees are compared by merge order only.
+
+    Args:
+        exact: Hierarchy from topic_model.hierarchical_topics(docs)
+        approximate: Hierarchy over the same topics from another mode
+
+    Returns:
+        cluster_recall: Fraction of the exact tree's merged topic sets that
+            also appear in the approximate tree
+        cophenetic_correlation: Spearman correlation between the two trees'
+            merge ranks over all topic pairs (1 means the same nesting)
+    """
+    nr_topics = len(exact) + 1
+    if nr_topics < 3:
+        return {"cluster_recall": 1.0, "cophenetic_correlation": 1.0}
+
+    exact_clusters = {frozenset(topics) for topics in exact.Topics}
+    approximate_clusters = {frozenset(topics) for topics in approximate.Topics}
+    pairs = np.triu_indices(nr_topics, k=1)
+    correlation = spearmanr(_merge_ranks(exact, nr_topics)[pairs],
+                            _merge_ranks(approximate, nr_topics)[pairs]).correlation
+    return {
+        "cluster_recall": len(exact_clusters & approximate_clusters) / len(exact_clusters),
+        "cophenetic_correlation": float(np.nan_to_num(correlation, nan=1.0)),
+    }
+
+
+def hierarchy_from_topic_bow(topic_model, topic_bow: csr_matrix) -> pd.DataFrame:
+    """
+    BERTopic's hierarchical_topics, computed from an existing topic bag-of-words.
+
+    Follows BERTopic's merge loop step for step (same linkage, clusters,
+    c-TF-IDF and naming), so the result is identical to
+    topic_model.hierarchical_topics(docs). Only the bag-of-words per topic
+    comes from the caller instead of joining, cleaning and re-vectorizing
+    every document.
+
+    Args:
+        topic_model: Fitted BERTopic model without a representation model
+        topic_bow: Bag-of-words per topic, one row per topic excluding outliers
+
+    Returns:
+        DataFrame with Parent_ID, Parent_Name, Topics, Child_Left_ID,
+        Child_Left_Name, Child_Right_ID, Child_Right_Name and Distance
+    """
+    c_tf_idf = topic_model.c_tf_idf_[topic_model._outliers:]
+    words = topic_model.vectorizer_model.get_feature_names_out()
+    X = validate_distance_matrix(1 - cosine_similarity(c_tf_idf), c_tf_idf.shape[0])
+    Z = sch.linkage(X, "ward", optimal_ordering=True)
+    if len(Z[:, 2]) != len(np.unique(Z[:, 2])):
+        Z[:, 2] = get_unique_distances(Z[:, 2])
+
+    def leaf_name(topic: int) -> str:
+        return "_".join([word for word, _ in topic_model.get_topic(topic)][:5])
+
+    nr_clusters = len(Z) + 1
+    selection = pd.DataFrame({"Topic": [0]})
+    rows = []
+    for index in range(len(Z)):
+        clusters = sch.fcluster(Z, t=Z[index][2], criterion="distance") - topic_model._outliers
+
+        # First leaf under the left child identifies the merged cluster
+        val = Z[index][0]
+        while val - nr_clusters >= 0:
+            val = Z[int(val - nr_clusters)][0]
+        clustered_topics = [i for i, x in enumerate(clusters) if x == clusters[int(val)]]
+
+        grouped = csr_matrix(topic_bow[clustered_topics].sum(axis=0))
+        words_per_topic = topic_model._extract_words_per_topic(
+            words, selection, topic_model.ctfidf_model.transform(grouped), calculate_aspects=False)
+        parent_name = "_".join([x[0] for x in words_per_topic[0]][:5])
+
+        left, right = int(Z[index][0]), int(Z[index][1])
+        left_name = leaf_name(left) if left < nr_clusters else rows[left - nr_clusters][1]
+        right_name = leaf_name(right) if right < nr_clusters else rows[right - nr_clusters][1]
+        rows.append([index + nr_clusters, parent_name, clustered_topics, left, left_name, right, right_name])
+
+    columns = ["Parent_ID", "Parent_Name", "Topics", "Child_Left_ID",
+               "Child_Left_Name", "Child_Right_ID", "Child_Right_Name"]
+    hier_topics = pd.DataFrame(rows, columns=columns, dtype=object)
+    hier_topics["Distance"] = Z[:, 2]
+    hier_topics = hier_topics.sort_values("Parent_ID", ascending=False)
+    hier_topics[["Parent_ID", "Child_Left_ID", "Child_Right_ID"]] = hier_topics[
+        ["Parent_ID", "Child_Left_ID", "Child_Right_ID"]].astype(str)
+    return hier_topics
@@ -1,18 +1,28 @@
 import json
 import time
-import requests
-import concurrent.futures
-from typing import List, Dict, Any, Optional
-import statistics
+import random
+import asyncio
+import aiohttp
+from typing import IO, List, Dict, Any, Optional, Tuple
 from sklearn.datasets import fetch_20newsgroups
 import argparse
+from aggregation import LatencyHistogram, ResultAggregator
+from metrics import MetricsRegistry, start_exporters
+from result_encoding import decode_result
 
-def generate_test_data(sizes: List[int]) -> Dict[int, Dict[str, Any]]:
+def generate_test_data(sizes: List[int], profile: bool = False, cprofile: bool = False,
+                       result_format: Optional[str] = None, result_compression: Optional[str] = None,
+                       result_chunk_size: Optional[int] = None) -> Dict[int, Dict[str, Any]]:
     """
     Generate test data of different sizes for load testing.
     
     Args:
         sizes: List of document counts to generate
+        profile: Ask the handler for per-stage timing, CPU and peak RSS
+        cprofile: Ask the handler for a cProfile dump as well
+        result_format: Result encoding to ask for ("json", "compact" or "none"), handler default if None
+        result_compression: Compression of compact results ("zlib" or "none")
+        result_chunk_size: Documents per result chunk
         
     Returns:
         Dictionary mapping size to test data
@@ -28,271 +38,890 @@ def generate_test_data(sizes: List[int]) -> Dict[int, Dict[str, Any]]:
                 "random_seed": 42   # For reproducibility
             }
         }
+        if profile or cprofile:
+            test_data[size]["input"]["profile"] = True
+        if cprofile:
+            test_data[size]["input"]["cprofile"] = True
+        if result_format is not None:
+            test_data[size]["input"]["result_format"] = result_format
+        if result_compression is not None:
+            test_data[size]["input"]["result_compression"] = result_compression
+        if result_chunk_size is not None:
+            test_data[size]["input"]["result_chunk_size"] = result_chunk_size
         print(f"Generated test data for {size} documents")
     
     return test_data
 
-def send_request(url: str, data: Dict[str, Any], api_key: Optional[str] = None, timeout: int = 300) -> Dict[str, Any]:
+DEFAULT_MIN_POLL_INTERVAL = 0.25  # First polls come quickly so short jobs are not overestimated
+DEFAULT_MAX_POLL_INTERVAL = 5.0   # Long-running jobs settle at this interval
+DEFAULT_POLL_BACKOFF = 0.1        # Poll delay grows with job age (10% of age)
+DEFAULT_MAX_RETRIES = 3           # Retries of a failed submit, and of consecutive failed polls
+DEFAULT_RETRY_BACKOFF = 0.5       # First retry waits up to this long, doubling per attempt
+DEFAULT_MAX_RETRY_DELAY = 10.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # Throttling and transient gateway errors
+
+
+def get_base_url(url: str) -> str:
     """
-    Send a request to the RunPod handler and poll for completion.
+    Derive the endpoint base URL from a /run URL.
     
     Args:
-        url: RunPod endpoint URL
-        data: Request payload
-        api_key: RunPod API key for authentication
-        timeout: Request timeout in seconds
+        url: RunPod endpoint URL, e.g. https://api.runpod.ai/v2/{endpoint_id}/run
         
     Returns:
-        Response data and timing information
+        Base URL that /status/{job_id} is appended to
+    """
+    if "/run" in url:
+        # Remove /run from the end to get the base URL
+        return url.replace("/run", "")
+    # Fallback: assume it's already the base URL
+    return url.rstrip("/")
+
+def next_poll_delay(job_age: float, min_interval: float = DEFAULT_MIN_POLL_INTERVAL,
+                    max_interval: float = DEFAULT_MAX_POLL_INTERVAL,
+                    backoff: float = DEFAULT_POLL_BACKOFF) -> float:
     """
-    start_time = time.time()
+    Adaptive poll delay: quick while a job is young, slower as it ages.
     
-    headers = {"Content-Type": "application/json"}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
+    Args:
+        job_age: Seconds since the job was submitted
+        min_interval: Smallest delay between polls
+        max_interval: Largest delay between polls
+        backoff: Fraction of the job age to wait before the next poll
+        
+    Returns:
+        Delay in seconds, jittered so jobs submitted together do not poll in lockstep
+    """
+    delay = min(max_interval, max(min_interval, job_age * backoff))
+    return delay * random.uniform(0.8, 1.2)
+
+def retry_delay(attempt: int, base: float = DEFAULT_RETRY_BACKOFF,
+                cap: float = DEFAULT_MAX_RETRY_DELAY) -> float:
+    """
+    Exponential backoff with full jitter before a retry.
     
-    try:
-        # Submit the job
-        response = requests.post(url, json=data, headers=headers, timeout=timeout)
+    Args:
+        attempt: Retries already made (0 for the first retry)
+        base: Upper bound of the first delay
+        cap: Largest upper bound
+        
+    Returns:
+        Delay in seconds, uniform up to min(cap, base * 2**attempt) so clients
+        that failed together do not retry together
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def job_completion_time(status_data: Dict[str, Any], submit_latency: float, observed_time: float) -> float:
+    """
+    Completion time taken from the job's own timing fields when available.
+    
+    RunPod reports delayTime (queue) and executionTime in milliseconds, which is
+    not rounded up to the poll interval like the time the poll observed.
+    
+    Args:
+        status_data: Status payload of the completed job
+        submit_latency: Seconds the submission request took
+        observed_time: Seconds from submission until the poll saw completion
+        
+    Returns:
+        Job completion time in seconds
+    """
+    delay_ms = status_data.get('delayTime')
+    execution_ms = status_data.get('executionTime')
+    if delay_ms is None or execution_ms is None:
+        return observed_time
+    return min(observed_time, submit_latency + (delay_ms + execution_ms) / 1000)
+
+def job_phases(status_data: Dict[str, Any], status_seen: Dict[str, float],
+               submit_latency: float, observed_time: float) -> Dict[str, float]:
+    """
+    Split a completed job's latency into phases.
+    
+    Phases are submit (POST round trip), queue (waiting for a worker),
+    cold_start (worker start-up reported by the handler for the first job it
+    runs), execution (running the handler) plus one stage_<name> entry per
+    handler-reported stage timing. When the payload has no delayTime or
+    executionTime, queue and execution fall back to the time the poll first
+    saw IN_PROGRESS.
+    
+    Args:
+        status_data: Status payload of the completed job
+        status_seen: Seconds from submission until each status was first seen
+        submit_latency: Seconds the submission request took
+        observed_time: Seconds from submission until the poll saw completion
         
-        if response.status_code != 200:
+    Returns:
+        Mapping of phase name to seconds
+    """
+    output = status_data.get('output') or {}
+    handler_timings = output.get('timings', {}) if isinstance(output, dict) else {}
+    cold_start = handler_timings.get('cold_start', 0.0)
+    
+    if 'delayTime' in status_data and 'executionTime' in status_data:
+        waiting = status_data['delayTime'] / 1000
+        execution = status_data['executionTime'] / 1000
+    else:
+        started = status_seen.get('IN_PROGRESS', observed_time)
+        waiting = max(0.0, started - submit_latency)
+        execution = observed_time - started
+    
+    phases = {
+        "submit": submit_latency,
+        # Worker start-up happens before the job leaves the queue, so it is counted in delayTime
+        "queue": max(0.0, waiting - cold_start),
+        "cold_start": cold_start,
+        "execution": execution
+    }
+    for stage, seconds in handler_timings.items():
+        if stage != 'cold_start' and isinstance(seconds, (int, float)):
+            phases[f"stage_{stage}"] = seconds
+    return phases
+
+def result_serialization(output: Any, parse_time: float) -> Dict[str, float]:
+    """
+    Serialization cost of a completed job's result, on both ends.
+    
+    Decodes the handler's "result" section the way a client would, to time it
+    and check it covers every document.
+    
+    Args:
+        output: Output of the completed job
+        parse_time: Seconds spent parsing the status response JSON
+        
+    Returns:
+        Mapping of handler_encode, client_parse and client_decode to seconds
+    """
+    handler_timings = output.get('timings', {}) if isinstance(output, dict) else {}
+    serialization = {"client_parse": parse_time}
+    if 'serialization' in handler_timings:
+        serialization["handler_encode"] = handler_timings['serialization']
+    if isinstance(output, dict) and output.get('result'):
+        decode_start = time.time()
+        decoded = decode_result(output['result'])
+        serialization["client_decode"] = time.time() - decode_start
+        if len(decoded["topics"]) != output['result']['num_docs']:
+            raise ValueError(f"Result has {len(decoded['topics'])} topics for "
+                             f"{output['result']['num_docs']} documents")
+    return serialization
+
+class DriverMetrics:
+    """
+    Load driver metrics, labelled by endpoint URL.
+    
+    Rates come from the counters: rate(loadtest_submits_total[1m]) in
+    Prometheus, or the difference between two snapshots.
+    """
+    
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or MetricsRegistry()
+        self.in_flight = self.registry.gauge("loadtest_jobs_in_flight", "Jobs submitted and not yet finished",
+                                             ["endpoint"])
+        self.submits = self.registry.counter("loadtest_submits_total",
+                                             "Submit attempts, by outcome (accepted, rejected, error)",
+                                             ["endpoint", "outcome"])
+        self.polls = self.registry.counter("loadtest_polls_total", "Status checks, by outcome (ok, failed)",
+                                           ["endpoint", "outcome"])
+        self.cancels = self.registry.counter("loadtest_cancels_total", "Cancel requests, by outcome",
+                                             ["endpoint", "outcome"])
+        self.jobs = self.registry.counter("loadtest_jobs_total", "Finished jobs, by outcome (success, failed)",
+                                          ["endpoint", "outcome"])
+        self.submit_latency = self.registry.histogram("loadtest_submit_latency_seconds",
+                                                      "Round trip of accepted submits", ["endpoint"])
+        self.job_latency = self.registry.histogram("loadtest_job_latency_seconds",
+                                                   "Response time of successful jobs", ["endpoint"])
+
+class JobTracker:
+    """
+    Submit jobs and track them to completion over one pooled HTTP session.
+    
+    Every job is a coroutine sleeping between status checks, so thousands of
+    outstanding job IDs cost no threads. Status checks are staggered by
+    jittered adaptive backoff and capped by a semaphore.
+    
+    Submits that fail to connect or get a status in RETRY_STATUSES are
+    retried up to `max_retries` times, as are status checks that fail in a
+    row, each after a jittered exponential delay. Every job's input carries
+    its "deadline" (submission time plus `timeout`, as Unix time) so the
+    handler can give up on work nobody will collect, and a job that times
+    out, or whose status cannot be read, is cancelled on the endpoint.
+    
+    Submits, status checks, cancels and finished jobs are counted in
+    `metrics`; per-poll log lines are only printed when `verbose`.
+    """
+    
+    def __init__(self, url: str, api_key: Optional[str] = None, timeout: int = 300,
+                 max_connections: int = 100, max_inflight_polls: int = 50,
+                 min_poll_interval: float = DEFAULT_MIN_POLL_INTERVAL,
+                 max_poll_interval: float = DEFAULT_MAX_POLL_INTERVAL,
+                 poll_backoff: float = DEFAULT_POLL_BACKOFF, verbose: bool = False,
+                 max_retries: int = DEFAULT_MAX_RETRIES, retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+                 max_retry_delay: float = DEFAULT_MAX_RETRY_DELAY, cancel_on_timeout: bool = True,
+                 send_deadline: bool = True, metrics: Optional[DriverMetrics] = None):
+        self.url = url
+        self.base_url = get_base_url(url)
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.verbose = verbose
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
+        self.cancel_on_timeout = cancel_on_timeout
+        self.send_deadline = send_deadline
+        self.metrics = metrics or DriverMetrics()
+        
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._poll_semaphore = asyncio.Semaphore(max_inflight_polls)
+    
+    async def __aenter__(self) -> "JobTracker":
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        self.session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.session.close()
+    
+    def _log(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+    
+    async def run_job(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Submit one job and wait for it to finish.
+        
+        Args:
+            data: Request payload
+            
+        Returns:
+            Response data and timing information
+        """
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.metrics.in_flight.inc(endpoint=self.url)
+        started_at = time.time()
+        retries = {"submit_retries": 0, "poll_retries": 0}
+        try:
+            result = await self._run_job(data, retries)
+        finally:
+            self.in_flight -= 1
+            self.metrics.in_flight.dec(endpoint=self.url)
+        self.metrics.jobs.inc(endpoint=self.url, outcome="success" if result["success"] else "failed")
+        if result["success"]:
+            self.metrics.job_latency.observe(result["response_time"], endpoint=self.url)
+        result.update(retries)
+        result["started_at"] = started_at
+        result["finished_at"] = time.time()
+        return result
+    
+    async def cancel(self, job_id: str) -> bool:
+        """
+        Ask the endpoint to cancel a job.
+        
+        Args:
+            job_id: ID of the job
+            
+        Returns:
+            Whether the endpoint accepted the cancel
+        """
+        try:
+            async with self.session.post(f"{self.base_url}/cancel/{job_id}",
+                                         timeout=aiohttp.ClientTimeout(total=10)) as response:
+                accepted = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.metrics.cancels.inc(endpoint=self.url, outcome="error")
+            self._log(f"    Cancel of {job_id} failed - {str(e)}")
+            return False
+        self.metrics.cancels.inc(endpoint=self.url, outcome="accepted" if accepted else "rejected")
+        self._log(f"    Cancel of {job_id}: {'accepted' if accepted else 'failed'}")
+        return accepted
+    
+    async def _run_job(self, data: Dict[str, Any], retries: Dict[str, int]) -> Dict[str, Any]:
+        start_time = time.time()
+        if self.send_deadline:
+            data = {**data, "input": {**data.get("input", {}), "deadline": start_time + self.timeout}}
+        
+        try:
+            # Submit the job; a submit that failed after connecting may have been
+            # accepted, so only failed connections and retryable statuses are sent again
+            submit_timeout = aiohttp.ClientTimeout(total=self.timeout)
+            while True:
+                attempt_start = time.time()
+                try:
+                    async with self.session.post(self.url, json=data, timeout=submit_timeout) as response:
+                        status_code = response.status
+                        job_response = await response.json() if status_code == 200 else {}
+                except aiohttp.ClientConnectorError as e:
+                    # The connection was never made, so the request never reached the endpoint
+                    self.metrics.submits.inc(endpoint=self.url, outcome="error")
+                    if retries["submit_retries"] >= self.max_retries:
+                        raise
+                    self._log(f"    Submit error, retrying - {str(e)}")
+                except aiohttp.ClientError:
+                    # Disconnects and bad responses can come after the job was accepted
+                    self.metrics.submits.inc(endpoint=self.url, outcome="error")
+                    raise
+                else:
+                    if status_code == 200:
+                        self.metrics.submits.inc(endpoint=self.url, outcome="accepted")
+                        self.metrics.submit_latency.observe(time.time() - attempt_start, endpoint=self.url)
+                    else:
+                        self.metrics.submits.inc(endpoint=self.url, outcome="rejected")
+                    if status_code not in RETRY_STATUSES or retries["submit_retries"] >= self.max_retries:
+                        break
+                    self._log(f"    Submit failed with {status_code}, retrying")
+                await asyncio.sleep(retry_delay(retries["submit_retries"], self.retry_backoff,
+                                                self.max_retry_delay))
+                retries["submit_retries"] += 1
+            submit_latency = time.time() - start_time
+            
+            if status_code != 200:
+                return {
+                    "status_code": status_code,
+                    "response_time": submit_latency,
+                    "success": False,
+                    "response_size": 0,
+                    "error": f"Job submission failed: {status_code}"
+                }
+            
+            # Parse the job ID from the response
+            job_id = job_response.get('id')
+            
+            if not job_id:
+                return {
+                    "status_code": status_code,
+                    "response_time": submit_latency,
+                    "success": False,
+                    "response_size": 0,
+                    "error": "No job ID received"
+                }
+            
+            self._log(f"    Job submitted with ID: {job_id}")
+            return await self._track(job_id, start_time, submit_latency, retries)
+            
+        except asyncio.TimeoutError:
+            self.metrics.submits.inc(endpoint=self.url, outcome="error")
             return {
-                "status_code": response.status_code,
-                "response_time": time.time() - start_time,
+                "status_code": None,
+                "response_time": self.timeout,
                 "success": False,
                 "response_size": 0,
-                "error": f"Job submission failed: {response.status_code}"
+                "error": "Initial request timeout"
             }
-        
-        # Parse the job ID from the response
-        job_response = response.json()
-        job_id = job_response.get('id')
-        
-        if not job_id:
+        except Exception as e:
             return {
-                "status_code": response.status_code,
+                "status_code": None,
                 "response_time": time.time() - start_time,
                 "success": False,
                 "response_size": 0,
-                "error": "No job ID received"
+                "error": str(e)
             }
+    
+    async def _track(self, job_id: str, start_time: float, submit_latency: float,
+                     retries: Dict[str, int]) -> Dict[str, Any]:
+        status_url = f"{self.base_url}/status/{job_id}"
+        poll_timeout = aiohttp.ClientTimeout(total=10)
+        deadline = start_time + self.timeout
+        poll_count = 0
+        failures = 0  # Status checks failed in a row
+        last_error = None
+        status_seen: Dict[str, float] = {}
         
-        print(f"    Job submitted with ID: {job_id}")
-        
-        # Poll for job completion
-        # Extract the endpoint ID from the URL
-        # URL format: https://api.runpod.ai/v2/{endpoint_id}/run
-        if "/run" in url:
-            # Remove /run from the end to get the base URL
-            base_url = url.replace("/run", "")
-        else:
-            # Fallback: assume it's already the base URL
-            base_url = url.rstrip("/")
-        
-        status_url = f"{base_url}/status/{job_id}"
-        print(f"    Status URL: {status_url}")
-        poll_interval = 5  # Poll every 30 seconds
-        max_polls = timeout // poll_interval
-        
-        for poll_count in range(max_polls):
-            time.sleep(poll_interval)
+        while True:
+            now = time.time()
+            if failures:
+                delay = retry_delay(failures - 1, self.retry_backoff, self.max_retry_delay)
+            else:
+                delay = next_poll_delay(now - start_time, self.min_poll_interval,
+                                        self.max_poll_interval, self.poll_backoff)
+            if now + delay > deadline:
+                break
+            await asyncio.sleep(delay)
+            poll_count += 1
             
             try:
-                status_response = requests.get(status_url, headers=headers, timeout=10)
-                
-                if status_response.status_code == 200:
-                    status_data = status_response.json()
-                    status = status_data.get('status')
-                    
-                    print(f"    Poll {poll_count + 1}: Status = {status}")
-                    
-                    if status == 'COMPLETED':
-                        # Job completed successfully
-                        end_time = time.time()
-                        result = status_data.get('output', {})
-                        
-                        return {
-                            "status_code": 200,
-                            "response_time": end_time - start_time,
-                            "success": True,
-                            "response_size": len(str(result)),
-                            "error": None,
-                            "job_id": job_id,
-                            "result": result
-                        }
-                    
-                    elif status == 'FAILED':
-                        # Job failed
-                        error_msg = status_data.get('error', 'Unknown error')
-                        return {
-                            "status_code": 500,
-                            "response_time": time.time() - start_time,
-                            "success": False,
-                            "response_size": 0,
-                            "error": f"Job failed: {error_msg}",
-                            "job_id": job_id
-                        }
-                    
-                    elif status in ['IN_QUEUE', 'IN_PROGRESS']:
-                        # Job still running, continue polling
-                        continue
-                    
-                    else:
-                        # Unknown status
-                        return {
-                            "status_code": status_response.status_code,
-                            "response_time": time.time() - start_time,
-                            "success": False,
-                            "response_size": 0,
-                            "error": f"Unknown status: {status}",
-                            "job_id": job_id
-                        }
-                
+                async with self._poll_semaphore:
+                    async with self.session.get(status_url, timeout=poll_timeout) as status_response:
+                        status_code = status_response.status
+                        body = await status_response.read() if status_code == 200 else b""
+                        # Content-Length is the size as sent, which is smaller than the body if compressed
+                        wire_bytes = status_response.content_length or len(body)
+                parse_start = time.time()
+                status_data = json.loads(body) if body else {}
+                parse_time = time.time() - parse_start
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                self._log(f"    Poll {poll_count}: Request error - {str(e)}")
+                status_code, last_error = None, f"Status request error: {str(e) or type(e).__name__}"
+            else:
+                if status_code == 200:
+                    failures = 0
                 else:
-                    print(f"    Poll {poll_count + 1}: Status check failed - {status_response.status_code}")
-                    
-            except requests.exceptions.RequestException as e:
-                print(f"    Poll {poll_count + 1}: Request error - {str(e)}")
+                    self._log(f"    Poll {poll_count}: Status check failed - {status_code}")
+                    last_error = f"Status check failed: {status_code}"
+            
+            self.metrics.polls.inc(endpoint=self.url, outcome="ok" if status_code == 200 else "failed")
+            if status_code != 200:
+                failures += 1
+                if (status_code is not None and status_code not in RETRY_STATUSES) or failures > self.max_retries:
+                    return {
+                        "status_code": status_code,
+                        "response_time": time.time() - start_time,
+                        "poll_count": poll_count,
+                        "success": False,
+                        "response_size": 0,
+                        "error": last_error,
+                        "cancelled": self.cancel_on_timeout and await self.cancel(job_id),
+                        "job_id": job_id
+                    }
+                retries["poll_retries"] += 1
+                continue
+            
+            status = status_data.get('status')
+            observed_time = time.time() - start_time
+            status_seen.setdefault(status, observed_time)
+            self._log(f"    Poll {poll_count}: Status = {status}")
+            
+            if status == 'COMPLETED':
+                # Job completed successfully
+                result = status_data.get('output', {})
+                return {
+                    "status_code": 200,
+                    "response_time": job_completion_time(status_data, submit_latency, observed_time),
+                    "observed_time": observed_time,
+                    "queue_delay": status_data['delayTime'] / 1000 if 'delayTime' in status_data else None,
+                    "phases": job_phases(status_data, status_seen, submit_latency, observed_time),
+                    "status_seen": status_seen,
+                    "poll_count": poll_count,
+                    "success": True,
+                    "response_size": len(body),
+                    "wire_bytes": wire_bytes,
+                    "serialization": result_serialization(result, parse_time),
+                    "error": None,
+                    "job_id": job_id,
+                    "result": result
+                }
+            
+            elif status in ('FAILED', 'CANCELLED', 'TIMED_OUT'):
+                # Job failed, was cancelled elsewhere or hit the endpoint's execution timeout
+                error_msg = status_data.get('error', 'Unknown error') if status == 'FAILED' else status
+                return {
+                    "status_code": 500,
+                    "response_time": observed_time,
+                    "poll_count": poll_count,
+                    "success": False,
+                    "response_size": 0,
+                    "error": f"Job failed: {error_msg}",
+                    "job_id": job_id
+                }
+            
+            elif status in ['IN_QUEUE', 'IN_PROGRESS']:
+                # Job still running, continue polling
+                continue
+            
+            else:
+                # Unknown status
+                return {
+                    "status_code": status_code,
+                    "response_time": observed_time,
+                    "poll_count": poll_count,
+                    "success": False,
+                    "response_size": 0,
+                    "error": f"Unknown status: {status}",
+                    "job_id": job_id
+                }
         
-        # Timeout reached
+        # Timeout reached; cancel so the job stops holding a worker (or is dropped from the queue)
         return {
             "status_code": None,
-            "response_time": timeout,
+            "response_time": self.timeout,
+            "poll_count": poll_count,
             "success": False,
             "response_size": 0,
-            "error": f"Job timeout after {timeout} seconds",
+            "error": f"Job timeout after {self.timeout} seconds",
+            "cancelled": self.cancel_on_timeout and await self.cancel(job_id),
             "job_id": job_id
         }
+    
+    async def run_jobs(self, data: Dict[str, Any], num_requests: int, concurrency: int,
+                       aggregator: ResultAggregator) -> None:
+        """
+        Run num_requests jobs with at most `concurrency` outstanding at once.
         
-    except requests.exceptions.Timeout:
-        return {
-            "status_code": None,
-            "response_time": timeout,
-            "success": False,
-            "response_size": 0,
-            "error": "Initial request timeout"
-        }
-    except Exception as e:
-        return {
-            "status_code": None,
-            "response_time": time.time() - start_time,
-            "success": False,
-            "response_size": 0,
-            "error": str(e)
-        }
+        Each result goes to the aggregator as soon as the job finishes and is
+        not kept here, so memory does not grow with the number of jobs.
+        
+        Args:
+            data: Request payload sent for every job
+            num_requests: Number of jobs to run
+            concurrency: Maximum number of outstanding jobs
+            aggregator: Receives every per-job result
+        """
+        remaining = num_requests
+        
+        async def worker() -> None:
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                aggregator.add(await self.run_job(data))
+                self._log(f"Completed request {aggregator.total}/{num_requests}")
+        
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, num_requests)))))
+
+def send_request(url: str, data: Dict[str, Any], api_key: Optional[str] = None, timeout: int = 300) -> Dict[str, Any]:
+    """
+    Send a request to the RunPod handler and poll for completion.
+    
+    Args:
+        url: RunPod endpoint URL
+        data: Request payload
+        api_key: RunPod API key for authentication
+        timeout: Request timeout in seconds
+        
+    Returns:
+        Response data and timing information
+    """
+    async def run() -> Dict[str, Any]:
+        async with JobTracker(url, api_key, timeout=timeout) as tracker:
+            return await tracker.run_job(data)
+    
+    return asyncio.run(run())
+
+def arrival_offsets(rate: float, duration: float, ramp_up: float = 0.0,
+                    arrival: str = "poisson", seed: Optional[int] = None) -> List[float]:
+    """
+    Schedule job submissions for an open-loop test.
+    
+    The arrival rate ramps linearly from 0 to `rate` over `ramp_up` seconds and
+    then holds. Arrivals are placed by inverting the cumulative rate, so
+    Poisson arrivals stay a correct non-homogeneous Poisson process during
+    the ramp.
+    
+    Args:
+        rate: Target arrival rate in jobs/sec
+        duration: Total test duration in seconds, including the ramp-up
+        ramp_up: Seconds to ramp from 0 to the target rate
+        arrival: "poisson" for exponential gaps or "constant" for fixed gaps
+        seed: Random seed for Poisson arrivals
+        
+    Returns:
+        Submission times in seconds from the start of the test
+    """
+    if arrival not in ("poisson", "constant"):
+        raise ValueError(f"Unknown arrival process: {arrival}")
+    if rate <= 0:
+        return []
+    
+    ramp_up = min(ramp_up, duration)
+    rng = random.Random(seed)
+    ramp_arrivals = rate * ramp_up / 2  # Expected arrivals during the ramp
+    
+    offsets = []
+    cumulative = 0.0
+    while True:
+        cumulative += rng.expovariate(1.0) if arrival == "poisson" else 1.0
+        if cumulative < ramp_arrivals:
+            offset = (2 * ramp_up * cumulative / rate) ** 0.5
+        else:
+            offset = (cumulative - ramp_arrivals) / rate + ramp_up
+        if offset >= duration:
+            return offsets
+        offsets.append(offset)
 
-def run_load_test(url: str, data: Dict[str, Any], api_key: Optional[str] = None, num_requests: int = 1, concurrent: int = 1) -> Dict[str, Any]:
+def run_load_test(url: str, data: Dict[str, Any], api_key: Optional[str] = None, num_requests: int = 1,
+                  concurrency: int = 1, timeout: int = 300, cprofile_dir: Optional[str] = None,
+                  records: Optional[IO[str]] = None, report_interval: float = 0.0,
+                  window: float = 60.0, tracker_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Run load test with specified parameters.
+    Run a closed-loop load test: a fixed number of requests, `concurrency` at a time.
     
     Args:
         url: RunPod endpoint URL
         data: Test data to send
         api_key: RunPod API key for authentication
         num_requests: Number of requests to send
-        concurrent: Number of concurrent requests
+        concurrency: Number of concurrent requests (1 runs them sequentially)
+        timeout: Per-job timeout in seconds
+        cprofile_dir: Directory to write returned cProfile dumps to
+        records: Open file that gets one JSON line per finished job
+        report_interval: Seconds between rolling-window reports (0 disables them)
+        window: Length of the rolling window in seconds
+        tracker_options: Extra JobTracker arguments (retries, cancel on timeout, deadlines,
+            metrics, verbose)
         
     Returns:
         Test results with timing statistics
     """
-    print(f"Running load test: {num_requests} requests, {concurrent} concurrent")
+    concurrency = max(1, concurrency)
+    print(f"Running load test: {num_requests} requests, {concurrency} concurrent")
+    aggregator = ResultAggregator(data["input"].get("num_docs"), records, cprofile_dir, window, report_interval)
     
-    results = []
+    async def run() -> None:
+        async with JobTracker(url, api_key, timeout=timeout, max_connections=max(100, concurrency),
+                              **(tracker_options or {})) as tracker:
+            await tracker.run_jobs(data, num_requests, concurrency, aggregator)
     
-    if concurrent != 1:
-        # Sequential requests
-        for i in range(num_requests):
-            print(f"Request {i+1}/{num_requests}")
-            result = send_request(url, data, api_key)
-            results.append(result)
-    else:
-        # Concurrent requests
-        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrent) as executor:
-            futures = [executor.submit(send_request, url, data, api_key) for _ in range(num_requests)]
+    asyncio.run(run())
+    return aggregator.summary()
+
+def run_open_loop_test(url: str, data: Dict[str, Any], api_key: Optional[str] = None, rate: float = 1.0,
+                       duration: float = 60.0, ramp_up: float = 0.0, arrival: str = "poisson",
+                       timeout: int = 300, seed: Optional[int] = None,
+                       cprofile_dir: Optional[str] = None, records: Optional[IO[str]] = None,
+                       report_interval: float = 0.0, window: float = 60.0,
+                       tracker_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run an open-loop load test: submit jobs on an arrival schedule regardless of
+    how fast earlier jobs complete.
+    
+    Args:
+        url: RunPod endpoint URL
+        data: Test data to send
+        api_key: RunPod API key for authentication
+        rate: Target arrival rate in jobs/sec
+        duration: Seconds over which jobs are submitted
+        ramp_up: Seconds to ramp from 0 to the target rate
+        arrival: "poisson" or "constant" arrivals
+        timeout: Per-job timeout in seconds
+        seed: Random seed for the arrival schedule
+        cprofile_dir: Directory to write returned cProfile dumps to
+        records: Open file that gets one JSON line per finished job
+        report_interval: Seconds between rolling-window reports (0 disables them)
+        window: Length of the rolling window in seconds
+        tracker_options: Extra JobTracker arguments (retries, cancel on timeout, deadlines,
+            metrics, verbose)
+        
+    Returns:
+        Test results with timing, throughput and queueing delay statistics
+    """
+    offsets = arrival_offsets(rate, duration, ramp_up, arrival, seed)
+    print(f"Running open-loop load test: {rate} jobs/sec ({arrival}), {duration}s "
+          f"with {ramp_up}s ramp-up, {len(offsets)} jobs scheduled")
+    aggregator = ResultAggregator(data["input"].get("num_docs"), records, cprofile_dir, window, report_interval)
+    
+    async def run() -> Tuple[float, float, float, int]:
+        async with JobTracker(url, api_key, timeout=timeout, max_connections=1000,
+                              **(tracker_options or {})) as tracker:
+            loop = asyncio.get_running_loop()
+            test_start = loop.time()
+            pending = set()
+            lag_total = lag_max = 0.0
             
-            for i, future in enumerate(concurrent.futures.as_completed(futures)):
-                print(f"Completed request {i+1}/{num_requests}")
-                results.append(future.result())
-    
-    # Calculate statistics
-    successful_requests = [r for r in results if r["success"]]
-    failed_requests = [r for r in results if not r["success"]]
-    
-    if successful_requests:
-        response_times = [r["response_time"] for r in successful_requests]
-        stats = {
-            "total_requests": len(results),
-            "successful_requests": len(successful_requests),
-            "failed_requests": len(failed_requests),
-            "success_rate": len(successful_requests) / len(results),
-            "avg_response_time": statistics.mean(response_times),
-            "min_response_time": min(response_times),
-            "max_response_time": max(response_times),
-            "median_response_time": statistics.median(response_times),
-            "std_response_time": statistics.stdev(response_times) if len(response_times) > 1 else 0,
-            "avg_response_size": statistics.mean([r["response_size"] for r in successful_requests]),
-            "errors": [r["error"] for r in failed_requests if r["error"]]
-        }
+            async def job() -> None:
+                aggregator.add(await tracker.run_job(data))
+            
+            for offset in offsets:
+                delay = test_start + offset - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # How far the generator itself fell behind schedule
+                lag = max(0.0, loop.time() - test_start - offset)
+                lag_total += lag
+                lag_max = max(lag_max, lag)
+                # Finished jobs drop out of the set, so only in-flight jobs are held
+                task = asyncio.create_task(job())
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            send_duration = loop.time() - test_start
+            if pending:
+                await asyncio.gather(*pending)
+            return lag_total, lag_max, send_duration, tracker.max_in_flight
+    
+    lag_total, lag_max, send_duration, max_in_flight = asyncio.run(run())
+    stats = aggregator.summary()
+    
+    # Completion rate measured between the first and last completion, independent of response time
+    if aggregator.successes > 1 and aggregator.last_finished > aggregator.first_finished:
+        throughput = (aggregator.successes - 1) / (aggregator.last_finished - aggregator.first_finished)
     else:
-        stats = {
-            "total_requests": len(results),
-            "successful_requests": 0,
-            "failed_requests": len(results),
-            "success_rate": 0,
-            "avg_response_time": 0,
-            "min_response_time": 0,
-            "max_response_time": 0,
-            "median_response_time": 0,
-            "std_response_time": 0,
-            "avg_response_size": 0,
-            "errors": [r["error"] for r in failed_requests if r["error"]]
-        }
+        throughput = 0
+    queue_delays = aggregator.queue_delays
     
+    stats.update({
+        "mode": "open",
+        "target_rate": rate,
+        "arrival": arrival,
+        "ramp_up": ramp_up,
+        "duration": duration,
+        "offered_rate": aggregator.total / send_duration if send_duration > 0 else 0,
+        "throughput": throughput,
+        "max_in_flight": max_in_flight,
+        "avg_schedule_lag": lag_total / len(offsets) if offsets else 0,
+        "max_schedule_lag": lag_max,
+        "avg_queue_delay": queue_delays.mean,
+        "median_queue_delay": queue_delays.percentile(50),
+        "max_queue_delay": queue_delays.max
+    })
     return stats
 
 def main():
     parser = argparse.ArgumentParser(description='Load test RunPod BERTopic handler')
-    parser.add_argument('--url', required=True, help='RunPod endpoint URL')
+    parser.add_argument('--url', help='RunPod endpoint URL (required without --scenario)')
+    parser.add_argument('--scenario', help='Scenario file (JSON or YAML) of weighted traffic mixes to run '
+                                           'concurrently, instead of --url and --sizes')
     parser.add_argument('--api-key', help='RunPod API key for authentication')
     parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000], 
                        help='Document sizes to test')
     parser.add_argument('--requests', type=int, default=3, help='Number of requests per size')
-    parser.add_argument('--concurrent', type=int, default=0, help='Number of concurrent requests')
+    parser.add_argument('--concurrent', type=int, default=1, help='Number of concurrent requests')
+    parser.add_argument('--timeout', type=int, default=300, help='Per-job timeout in seconds')
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed',
+                       help='closed: fixed number of requests; open: submit at a target arrival rate')
+    parser.add_argument('--rate', type=float, default=1.0, help='Open-loop target arrival rate (jobs/sec)')
+    parser.add_argument('--duration', type=float, default=60.0, help='Open-loop submission duration in seconds')
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='Open-loop ramp-up time in seconds')
+    parser.add_argument('--arrival', choices=['poisson', 'constant'], default='poisson',
+                       help='Open-loop arrival process')
+    parser.add_argument('--seed', type=int, help='Random seed for Poisson arrivals')
+    parser.add_argument('--profile', action='store_true',
+                       help='Ask the handler for per-stage timing, CPU and peak RSS')
+    parser.add_argument('--cprofile-dir', help='Also collect cProfile dumps and write them to this directory')
+    parser.add_argument('--result-format', choices=['json', 'compact', 'none'],
+                       help='Result encoding to ask the handler for (default: handler default, json)')
+    parser.add_argument('--result-compression', choices=['zlib', 'none'],
+                       help='Compression of compact results (default: handler default, zlib)')
+    parser.add_argument('--result-chunk-size', type=int, help='Documents per result chunk')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES,
+                       help='Retries of a failed submit and of consecutive failed status checks')
+    parser.add_argument('--retry-backoff', type=float, default=DEFAULT_RETRY_BACKOFF,
+                       help='Upper bound in seconds of the first jittered retry delay, doubling per retry')
+    parser.add_argument('--no-cancel', action='store_true', help='Do not cancel jobs that time out')
+    parser.add_argument('--no-deadline', action='store_true',
+                       help='Do not send each job its deadline (submission time plus --timeout)')
+    parser.add_argument('--metrics-port', type=int,
+                       help='Serve live driver metrics for Prometheus on this port (/metrics)')
+    parser.add_argument('--metrics-file',
+                       help='Periodically write driver metrics to this file (.json for JSON, else Prometheus text)')
+    parser.add_argument('--metrics-interval', type=float, default=15.0, help='Seconds between metrics file writes')
+    parser.add_argument('--verbose', action='store_true', help='Log every submit and status check')
     parser.add_argument('--output', default='load_test_results.json', help='Output file for results')
+    parser.add_argument('--records', default='load_test_records.jsonl',
+                       help='JSONL file that gets one record per finished job as it completes')
+    parser.add_argument('--report-interval', type=float, default=30.0,
+                       help='Seconds between rolling-window progress reports (0 disables them)')
+    parser.add_argument('--window', type=float, default=60.0, help='Rolling window length in seconds')
     
     args = parser.parse_args()
+    if not args.url and not args.scenario:
+        parser.error("--url is required unless --scenario is given")
+    tracker_options = {"max_retries": args.max_retries, "retry_backoff": args.retry_backoff,
+                       "cancel_on_timeout": not args.no_cancel, "send_deadline": not args.no_deadline,
+                       "verbose": args.verbose, "metrics": DriverMetrics()}
+    # One registry across sizes and scenarios, so the counters cover the whole run
+    _, metrics_writer = start_exporters(tracker_options["metrics"].registry, args.metrics_port,
+                                        args.metrics_file, args.metrics_interval)
+    try:
+        run_from_args(args, tracker_options)
+    finally:
+        if metrics_writer is not None:
+            metrics_writer.close()
+
+def run_from_args(args: argparse.Namespace, tracker_options: Dict[str, Any]) -> None:
+    """Run the load test or scenarios main() was asked for."""
+    
+    if args.scenario:
+        from scenarios import load_scenario_file, print_scenario_results, run_scenarios
+        
+        base_input = {}
+        if args.profile or args.cprofile_dir:
+            base_input["profile"] = True
+        if args.cprofile_dir:
+            base_input["cprofile"] = True
+        for key in ("result_format", "result_compression", "result_chunk_size"):
+            if getattr(args, key) is not None:
+                base_input[key] = getattr(args, key)
+        
+        with open(args.records, 'a') as records:
+            print(f"Streaming per-job records to {args.records}")
+            results = run_scenarios(load_scenario_file(args.scenario), args.api_key, args.timeout,
+                                    args.cprofile_dir, records, args.report_interval, args.window, base_input,
+                                    tracker_options)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print_scenario_results(results)
+        print(f"\nResults saved to {args.output}")
+        return
     
     print("Generating test data...")
-    test_data = generate_test_data(args.sizes)
+    test_data = generate_test_data(args.sizes, args.profile, bool(args.cprofile_dir), args.result_format,
+                                   args.result_compression, args.result_chunk_size)
     
     all_results = {}
-    
-    for size in args.sizes:
-        print(f"\n{'='*50}")
-        print(f"Testing with {size} documents")
-        print(f"{'='*50}")
+    with open(args.records, 'a') as records:
+        print(f"Streaming per-job records to {args.records}")
         
-        data = test_data[size]
-        print(f"Data size: {len(json.dumps(data))} bytes")
-        
-        results = run_load_test(args.url, data, args.api_key, args.requests, args.concurrent)
-        all_results[size] = results
-        
-        print(f"\nResults for {size} documents:")
-        print(f"  Success Rate: {results['success_rate']:.2%}")
-        print(f"  Avg Response Time: {results['avg_response_time']:.2f}s")
-        print(f"  Min Response Time: {results['min_response_time']:.2f}s")
-        print(f"  Max Response Time: {results['max_response_time']:.2f}s")
-        print(f"  Median Response Time: {results['median_response_time']:.2f}s")
-        print(f"  Std Response Time: {results['std_response_time']:.2f}s")
-        print(f"  Avg Response Size: {results['avg_response_size']:.0f} bytes")
-        
-        if results['errors']:
-            print(f"  Errors: {results['errors']}")
-    
-    # Save results
-    with open(args.output, 'w') as f:
-        json.dump(all_results, f, indent=2)
+        for size in args.sizes:
+            print(f"\n{'='*50}")
+            print(f"Testing with {size} documents")
+            print(f"{'='*50}")
+            
+            data = test_data[size]
+            print(f"Data size: {len(json.dumps(data))} bytes")
+            
+            if args.mode == 'open':
+                results = run_open_loop_test(args.url, data, args.api_key, args.rate, args.duration,
+                                             args.ramp_up, args.arrival, args.timeout, args.seed, args.cprofile_dir,
+                                             records, args.report_interval, args.window, tracker_options)
+            else:
+                results = run_load_test(args.url, data, args.api_key, args.requests, args.concurrent, args.timeout,
+                                        args.cprofile_dir, records, args.report_interval, args.window,
+                                        tracker_options)
+            all_results[size] = results
+            
+            # Save after every size so an interrupted run keeps the finished sizes
+            with open(args.output, 'w') as f:
+                json.dump(all_results, f, indent=2)
+            
+            print(f"\nResults for {size} documents:")
+            print(f"  Success Rate: {results['success_rate']:.2%}")
+            print(f"  Avg Response Time: {results['avg_response_time']:.2f}s")
+            print(f"  Min Response Time: {results['min_response_time']:.2f}s")
+            print(f"  Max Response Time: {results['max_response_time']:.2f}s")
+            print(f"  Median Response Time: {results['median_response_time']:.2f}s")
+            print(f"  Std Response Time: {results['std_response_time']:.2f}s")
+            print(f"  Avg Response Size: {results['avg_response_size']:.0f} bytes")
+            print(f"  Avg Wire Bytes: {results['avg_wire_bytes']:.0f} (max {results['max_wire_bytes']:.0f})")
+            print("  Response Time Percentiles: " + ", ".join(
+                f"{name} {seconds:.2f}s" for name, seconds in results['response_time_percentiles'].items()))
+            
+            if results['phases']:
+                print("  Latency Phases (p50 / p90 / p99 / p99.9):")
+                for phase, pct in results['phases'].items():
+                    print(f"    {phase}: {pct['p50']:.2f}s / {pct['p90']:.2f}s / {pct['p99']:.2f}s / "
+                          f"{pct['p99.9']:.2f}s")
+            
+            if results['serialization']:
+                print("  Serialization (p50 / p99):")
+                for step, pct in results['serialization'].items():
+                    print(f"    {step}: {pct['p50'] * 1000:.1f}ms / {pct['p99'] * 1000:.1f}ms")
+            
+            if results['profile']:
+                profile = results['profile']
+                print(f"  Profile ({profile['num_jobs']} jobs, {profile['avg_cpu_percent']:.0f}% CPU, "
+                      f"{profile['max_peak_rss_mb']:.0f} MB peak RSS):")
+                for stage, seconds in profile['avg_stage_seconds'].items():
+                    print(f"    {stage}: {seconds:.2f}s")
+            
+            if args.mode == 'open':
+                print(f"  Offered Rate: {results['offered_rate']:.2f} jobs/sec (target {results['target_rate']:.2f})")
+                print(f"  Throughput: {results['throughput']:.2f} jobs/sec")
+                print(f"  Max In Flight: {results['max_in_flight']}")
+                print(f"  Avg Queue Delay: {results['avg_queue_delay']:.2f}s")
+                print(f"  Max Queue Delay: {results['max_queue_delay']:.2f}s")
+                print(f"  Max Schedule Lag: {results['max_schedule_lag']:.3f}s")
+            
+            if results['submit_retries'] or results['poll_retries'] or results['cancelled_jobs']:
+                print(f"  Retries: {results['submit_retries']} submits, {results['poll_retries']} status checks; "
+                      f"{results['cancelled_jobs']} jobs cancelled")
+            
+            if results['errors']:
+                print(f"  Errors: {results['errors']}")
     
     print(f"\nResults saved to {args.output}")
     
@@ -304,6 +933,13 @@ def main():
         print(f"{size} docs: {results['success_rate']:.2%} success, "
               f"{results['avg_response_time']:.2f}s avg, "
               f"{results['max_response_time']:.2f}s max")
+    
+    # Histograms merge, so percentiles across all sizes come without the raw samples
+    overall = LatencyHistogram()
+    for results in all_results.values():
+        overall.merge(LatencyHistogram.from_dict(results['response_time_histogram']))
+    if overall.count:
+        print("All sizes: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in overall.percentiles().items()))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
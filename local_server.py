@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the RunPod serverless API.
+
+Serves /run, /runsync, /status/{job_id}, /cancel/{job_id} and /health (also under
+/v2/{endpoint_id}/...) and runs a handler function on this machine, either
+in threads of this process or in a pool of worker processes. Queue delay,
+worker cold start and failures can be injected, so load_test.py and the
+handler can be benchmarked end to end without a RunPod endpoint:
+
+    python local_server.py --workers 2 --queue-delay 0.5 --cold-start 5
+    python load_test.py --url http://localhost:8000/run --sizes 100
+"""
+
+import argparse
+import asyncio
+import importlib
+import random
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+_handlers: Dict[str, Callable] = {}
+
+
+def load_handler(spec: str) -> Callable:
+    """
+    Import a handler given as "module:function", once per process.
+
+    Args:
+        spec: Handler location, e.g. "handler:handler"
+
+    Returns:
+        The handler function
+    """
+    if spec not in _handlers:
+        module_name, _, function_name = spec.partition(":")
+        _handlers[spec] = getattr(importlib.import_module(module_name), function_name or "handler")
+    return _handlers[spec]
+
+
+def run_handler(spec: str, event: Dict[str, Any]) -> Any:
+    """Run a handler on one event; module-level so process pools can pickle it."""
+    return load_handler(spec)(event)
+
+
+class LocalRunPodServer:
+    """
+    In-memory job queue in front of a handler, speaking RunPod's job API.
+
+    Jobs move through IN_QUEUE, IN_PROGRESS and COMPLETED or FAILED, or
+    are CANCELLED. Status payloads carry delayTime and executionTime in
+    milliseconds like RunPod's. The first job on each worker slot also waits
+    `cold_start` seconds, which counts towards its delayTime as a worker
+    start-up would.
+
+    Cancelling a queued job drops it. A running handler cannot be stopped
+    from outside, so cancelling a running job discards its output and, in
+    thread pools, moves its input's "deadline" to now, so a deadline-aware
+    handler gives up at its next check and frees the worker slot.
+    """
+
+    def __init__(self, handler: str = "handler:handler", workers: int = 1, pool: str = "thread",
+                 queue_delay: float = 0.0, cold_start: float = 0.0, failure_rate: float = 0.0,
+                 result_ttl: float = 1800.0, seed: Optional[int] = None):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.pool = pool
+        self.queue_delay = queue_delay
+        self.cold_start = cold_start
+        self.failure_rate = failure_rate
+        self.result_ttl = result_ttl
+        self.rng = random.Random(seed)
+
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Queue] = None
+        self._warm_slots = set()
+
+    async def start(self, app: web.Application) -> None:
+        if self.pool == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=load_handler,
+                                                initargs=(self.handler,))
+        else:
+            # Import here so the handler's start-up cost is paid before the first job
+            load_handler(self.handler)
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._slots = asyncio.Queue()
+        for slot in range(self.workers):
+            self._slots.put_nowait(slot)
+
+    async def stop(self, app: web.Application) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _status(self, job_id: str) -> Dict[str, Any]:
+        job = self.jobs[job_id]
+        payload = {"id": job_id, "status": job["status"]}
+        if job["started_at"] is not None:
+            payload["delayTime"] = int((job["started_at"] - job["submitted_at"]) * 1000)
+        if job["started_at"] is not None and job["finished_at"] is not None:
+            payload["executionTime"] = int((job["finished_at"] - job["started_at"]) * 1000)
+        if job["status"] == "COMPLETED":
+            payload["output"] = job["output"]
+        elif job["status"] == "FAILED":
+            payload["error"] = job["error"]
+        return payload
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job["finished_at"] is not None and job["finished_at"] < cutoff]:
+            del self.jobs[job_id]
+
+    def submit(self, event: Dict[str, Any]) -> str:
+        """
+        Queue a job.
+
+        Args:
+            event: Request body; its "input" is passed to the handler
+
+        Returns:
+            The job ID
+        """
+        self._expire()
+        job_id = str(uuid.uuid4())
+        self.jobs[job_id] = {
+            "status": "IN_QUEUE",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "output": None,
+            "error": None,
+            "input": None,
+            # Decided at submission so a seeded run fails the same jobs every time
+            "inject_failure": self.rng.random() < self.failure_rate,
+        }
+        self.jobs[job_id]["done"] = asyncio.ensure_future(self._execute(job_id, event))
+        return job_id
+
+    async def _execute(self, job_id: str, event: Dict[str, Any]) -> None:
+        job = self.jobs[job_id]
+        if self.queue_delay > 0:
+            await asyncio.sleep(self.queue_delay)
+
+        slot = await self._slots.get()
+        try:
+            if slot not in self._warm_slots:
+                await asyncio.sleep(self.cold_start)
+                self._warm_slots.add(slot)
+
+            job["status"] = "IN_PROGRESS"
+            job["started_at"] = time.time()
+            # Kept on the job so a cancel can move the deadline of a thread-pool handler
+            handler_event = {"id": job_id, "input": dict(event.get("input", {}))}
+            job["input"] = handler_event["input"]
+            try:
+                if job["inject_failure"]:
+                    raise RuntimeError("Injected failure")
+                if self.pool != "process" and asyncio.iscoroutinefunction(load_handler(self.handler)):
+                    output = await load_handler(self.handler)(handler_event)
+                else:
+                    loop = asyncio.get_running_loop()
+                    output = await loop.run_in_executor(self.executor, run_handler, self.handler, handler_event)
+            except Exception as e:
+                if job["status"] != "CANCELLED":
+                    job["status"] = "FAILED"
+                    job["error"] = str(e)
+            else:
+                # The RunPod SDK reports a returned {"error": ...} as a failed job
+                if job["status"] == "CANCELLED":
+                    pass  # Finished after a cancel: the output is discarded
+                elif isinstance(output, dict) and "error" in output:
+                    job["status"] = "FAILED"
+                    job["error"] = output["error"]
+                else:
+                    job["status"] = "COMPLETED"
+                    job["output"] = output
+            if job["finished_at"] is None:
+                job["finished_at"] = time.time()
+        finally:
+            self._slots.put_nowait(slot)
+
+    async def handle_run(self, request: web.Request) -> web.Response:
+        job_id = self.submit(await request.json())
+        return web.json_response({"id": job_id, "status": "IN_QUEUE"})
+
+    async def handle_runsync(self, request: web.Request) -> web.Response:
+        job_id = self.submit(await request.json())
+        # wait() rather than awaiting the task, which raises once the job is cancelled
+        await asyncio.wait([self.jobs[job_id]["done"]])
+        return web.json_response(self._status(job_id))
+
+    async def handle_status(self, request: web.Request) -> web.Response:
+        job_id = request.match_info["job_id"]
+        if job_id not in self.jobs:
+            return web.json_response({"error": "job not found"}, status=404)
+        return web.json_response(self._status(job_id))
+
+    def cancel(self, job_id: str) -> None:
+        """
+        Cancel a job that has not finished; finished jobs are left as they are.
+
+        Args:
+            job_id: ID returned by submit
+        """
+        job = self.jobs[job_id]
+        if job["status"] == "IN_QUEUE":
+            job["done"].cancel()
+        elif job["status"] == "IN_PROGRESS":
+            if job["input"] is not None:
+                job["input"]["deadline"] = time.time()
+        else:
+            return
+        job["status"] = "CANCELLED"
+        job["finished_at"] = time.time()
+
+    async def handle_cancel(self, request: web.Request) -> web.Response:
+        job_id = request.match_info["job_id"]
+        if job_id not in self.jobs:
+            return web.json_response({"error": "job not found"}, status=404)
+        self.cancel(job_id)
+        return web.json_response({"id": job_id, "status": self.jobs[job_id]["status"]})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        counts = {"IN_QUEUE": 0, "IN_PROGRESS": 0, "COMPLETED": 0, "FAILED": 0, "CANCELLED": 0}
+        for job in self.jobs.values():
+            counts[job["status"]] += 1
+        return web.json_response({
+            "jobs": {"inQueue": counts["IN_QUEUE"], "inProgress": counts["IN_PROGRESS"],
+                     "completed": counts["COMPLETED"], "failed": counts["FAILED"],
+                     "cancelled": counts["CANCELLED"]},
+            "workers": {"running": self.workers - self._slots.qsize(), "idle": self._slots.qsize()}
+        })
+
+    def app(self) -> web.Application:
+        """The aiohttp application serving the job API."""
+        app = web.Application(client_max_size=64 * 2**20)
+        for prefix in ("", "/v2/{endpoint_id}"):
+            app.router.add_post(f"{prefix}/run", self.handle_run)
+            app.router.add_post(f"{prefix}/runsync", self.handle_runsync)
+            app.router.add_get(f"{prefix}/status/{{job_id}}", self.handle_status)
+            app.router.add_post(f"{prefix}/cancel/{{job_id}}", self.handle_cancel)
+            app.router.add_get(f"{prefix}/health", self.handle_health)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the RunPod serverless API')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--handler', default='handler:handler', help='Handler to run, as module:function')
+    parser.add_argument('--workers', type=int, default=1, help='Jobs run at once')
+    parser.add_argument('--pool', choices=['thread', 'process'], default='thread',
+                       help='thread: run in this process; process: one handler process per worker')
+    parser.add_argument('--queue-delay', type=float, default=0.0, help='Seconds every job waits in the queue')
+    parser.add_argument('--cold-start', type=float, default=0.0,
+                       help='Extra seconds before the first job on each worker')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of jobs failed on purpose')
+    parser.add_argument('--result-ttl', type=float, default=1800.0, help='Seconds finished jobs stay queryable')
+    parser.add_argument('--seed', type=int, help='Random seed for failure injection')
+
+    args = parser.parse_args()
+    server = LocalRunPodServer(args.handler, args.workers, args.pool, args.queue_delay, args.cold_start,
+                               args.failure_rate, args.result_ttl, args.seed)
+    print(f"Serving {args.handler} on http://{args.host}:{args.port}/run with {args.workers} "
+          f"{args.pool} worker(s)")
+    web.run_app(server.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Prometheus-style metrics for the worker and the load driver.
+
+A MetricsRegistry holds counters, gauges and histograms, each optionally
+labelled. Updating one costs a lock and a dict lookup, so it is cheap
+enough for every job and every status check. The registry renders in
+Prometheus' text exposition format, or as a JSON snapshot, and can be
+exposed two ways:
+
+- serve_metrics: a local HTTP endpoint (GET /metrics) for Prometheus to scrape
+- SnapshotWriter: a file rewritten every few seconds. ".json" files get the
+  JSON snapshot; anything else gets the text format, which node_exporter's
+  textfile collector reads
+
+No client library is needed.
+"""
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds, from sub-second polls up to long jobs
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Documents per second of a job
+THROUGHPUT_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key: LabelValues, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def snapshot(self) -> Any:
+        raise NotImplementedError
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. jobs finished."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{self._format_labels(key)} {_format_value(value)}" for key, value in values.items()]
+
+    def snapshot(self) -> Any:
+        with self._lock:
+            return {",".join(key): value for key, value in self._values.items()} if self.labelnames \
+                else self._values.get((), 0)
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, e.g. jobs in progress.
+
+    A gauge created with `function` has no stored value: it calls the
+    function (without labels) whenever it is rendered.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def _current(self) -> Dict[LabelValues, float]:
+        if self._function is not None:
+            return {(): self._function()}
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {_format_value(value)}"
+                for key, value in self._current().items()]
+
+    def snapshot(self) -> Any:
+        values = self._current()
+        return {",".join(key): value for key, value in values.items()} if self.labelnames else values.get((), 0)
+
+
+class Histogram(_Metric):
+    """Distribution of observations in fixed cumulative buckets, e.g. job durations."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (last is +Inf)], sum, count
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def _copy(self) -> Dict[LabelValues, Tuple[List[int], List[float]]]:
+        with self._lock:
+            return {key: (list(counts), list(totals)) for key, (counts, totals) in self._values.items()}
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, (total, count)) in self._copy().items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._format_labels(key, (('le', _format_value(bound)),))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {int(count)}")
+        return lines
+
+    def snapshot(self) -> Any:
+        snapshots = {}
+        for key, (counts, (total, count)) in self._copy().items():
+            cumulative = 0
+            buckets = {}
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                buckets[_format_value(bound)] = cumulative
+            snapshots[",".join(key)] = {"count": int(count), "sum": total, "buckets": buckets}
+        return snapshots if self.labelnames else snapshots.get("", {"count": 0, "sum": 0.0, "buckets": {}})
+
+
+class MetricsRegistry:
+    """Named collection of metrics, rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in Prometheus' text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """All metrics as a JSON-serializable dict, with the time it was taken."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {"timestamp": time.time(), "metrics": {metric.name: metric.snapshot() for metric in metrics}}
+
+
+def serve_metrics(registry: MetricsRegistry, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve a registry on http://host:port/metrics from a daemon thread.
+
+    Args:
+        registry: Metrics to serve
+        port: Port to listen on (0 picks a free one)
+        host: Address to listen on
+
+    Returns:
+        The running server; server_address has the port actually bound
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass  # One line per scrape is exactly the log noise metrics replace
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class SnapshotWriter:
+    """
+    Rewrite a metrics file every `interval` seconds from a daemon thread.
+
+    The file is replaced atomically, so readers never see a partial write.
+    close() writes a final snapshot.
+    """
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 15.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+
+    def write(self) -> None:
+        if self.path.endswith(".json"):
+            content = json.dumps(self.registry.snapshot(), indent=2)
+        else:
+            content = self.registry.render()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Could not write metrics snapshot to {self.path}: {e}")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+def start_exporters(registry: MetricsRegistry, port: Optional[int] = None, snapshot_path: Optional[str] = None,
+                    snapshot_interval: float = 15.0, host: str = "127.0.0.1"
+                    ) -> Tuple[Optional[ThreadingHTTPServer], Optional[SnapshotWriter]]:
+    """
+    Start whichever exporters are configured.
+
+    Args:
+        registry: Metrics to export
+        port: Port for the scrape endpoint, None to skip it
+        snapshot_path: File for periodic snapshots, None to skip them
+        snapshot_interval: Seconds between snapshots
+        host: Address the scrape endpoint listens on
+
+    Returns:
+        tuple: The HTTP server and the snapshot writer, each None if not started
+    """
+    server = writer = None
+    if port is not None:
+        server = serve_metrics(registry, port, host)
+        print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    if snapshot_path:
+        writer = SnapshotWriter(registry, snapshot_path, snapshot_interval)
+        print(f"Writing metrics to {snapshot_path} every {snapshot_interval:g}s")
+    return server, writer
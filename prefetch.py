@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Bake the embedding model and the cleaned corpus into the image.
+
+Run once at image build time (see Dockerfile). The model is saved to a
+local directory and the cleaned 20 Newsgroups corpus to a packed .npz, so a
+worker starting from zero loads both from disk without downloading,
+cleaning or contacting the Hugging Face Hub. With --onnx the ONNX export
+and its int8 quantized variant are written next to the weights for the
+onnx and onnx-int8 embedding backends.
+"""
+
+import argparse
+import time
+
+from corpus import load_corpus
+from embeddings import EMBEDDING_MODEL_NAME
+
+
+def prefetch(model_dir: str, corpus_path: str, onnx: bool = False) -> None:
+    """
+    Download the model and corpus and write them in the form workers load.
+
+    Args:
+        model_dir: Directory to save the SentenceTransformer to
+        corpus_path: File to write the packed corpus to
+        onnx: Also export the model to ONNX, plain and int8 quantized
+    """
+    from sentence_transformers import SentenceTransformer
+
+    start_time = time.time()
+    SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu").save(model_dir)
+    print(f"Saved {EMBEDDING_MODEL_NAME} to {model_dir} in {time.time() - start_time:.2f}s")
+
+    if onnx:
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        # Loading with the ONNX backend exports onnx/model.onnx when it is missing
+        onnx_model = SentenceTransformer(model_dir, device="cpu", backend="onnx")
+        onnx_model.save(model_dir)
+        export_dynamic_quantized_onnx_model(onnx_model, "avx2", model_dir)
+        print(f"Exported ONNX and int8 ONNX models to {model_dir}")
+
+    # Fetch and clean from scratch rather than reading a stale packed file
+    corpus = load_corpus(path="")
+    corpus.save(corpus_path)
+    print(f"Saved {len(corpus)} documents ({corpus.nbytes} bytes) to {corpus_path} "
+          f"in {corpus.load_time:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bake model weights and corpus into the image')
+    parser.add_argument('--model-dir', default='models/all-MiniLM-L6-v2', help='Model output directory')
+    parser.add_argument('--corpus-path', default='data/corpus.npz', help='Packed corpus output file')
+    parser.add_argument('--onnx', action='store_true', help='Also export ONNX and int8 ONNX models')
+
+    args = parser.parse_args()
+    prefetch(args.model_dir, args.corpus_path, args.onnx)
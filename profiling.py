@@ -0,0 +1,174 @@
+"""
+Opt-in per-stage profiling for the topic modelling pipeline.
+
+A StageProfiler times named stages, samples the process RSS in a background
+thread to find each stage's peak, measures CPU time per stage and can
+optionally capture a cProfile dump of the whole job. It can also instrument a
+BERTopic instance so the internal fit_transform stages (embedding, UMAP,
+HDBSCAN, c-TF-IDF) are timed individually.
+"""
+
+import base64
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# BERTopic internals wrapped by StageProfiler.instrument, mapped to stage names
+BERTOPIC_STAGES = {
+    "_extract_embeddings": "embedding",
+    "_reduce_dimensionality": "umap",
+    "_cluster_embeddings": "hdbscan",
+    "_extract_topics": "ctfidf",
+}
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process, falling back to the peak RSS off Linux."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageProfiler:
+    """Times named stages and records their CPU time and peak RSS."""
+
+    def __init__(self, sample_interval: float = 0.05, cprofile: bool = False):
+        self.sample_interval = sample_interval
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._stack: List[str] = []
+        self._peak_rss = current_rss_bytes()
+        self._job_peak_rss = self._peak_rss
+        self._start_rss = self._peak_rss
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._cprofile = cProfile.Profile() if cprofile else None
+        self._wall_time = 0.0
+        self._cpu_time = 0.0
+
+    def __enter__(self) -> "StageProfiler":
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._wall_start = time.time()
+        self._cpu_start = time.process_time()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._wall_time = time.time() - self._wall_start
+        self._cpu_time = time.process_time() - self._cpu_start
+        self._stop.set()
+        self._sampler.join()
+        self._record_rss()
+
+    def _record_rss(self) -> None:
+        rss = current_rss_bytes()
+        self._peak_rss = max(self._peak_rss, rss)
+        self._job_peak_rss = max(self._job_peak_rss, rss)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.sample_interval):
+            self._record_rss()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a stage. Stages nested inside another are named "<outer>.<name>".
+
+        Args:
+            name: Stage name
+        """
+        if self._stack:
+            name = f"{self._stack[-1]}.{name}"
+        self._stack.append(name)
+
+        # Track this stage's own peak, then fold it back into the enclosing one
+        outer_peak = self._peak_rss
+        self._peak_rss = current_rss_bytes()
+        wall_start = time.time()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.time() - wall_start
+            cpu = time.process_time() - cpu_start
+            self._record_rss()
+            stage_peak = self._peak_rss
+            self._peak_rss = max(outer_peak, stage_peak)
+            self._stack.pop()
+
+            record = self.stages.setdefault(name, {"seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_mb": 0.0, "calls": 0})
+            record["seconds"] += wall
+            record["cpu_seconds"] += cpu
+            record["peak_rss_mb"] = max(record["peak_rss_mb"], stage_peak / 2**20)
+            record["calls"] += 1
+
+    @contextmanager
+    def instrument(self, topic_model: Any) -> Iterator[None]:
+        """
+        Time BERTopic's internal stages on this instance for the duration of the block.
+
+        Args:
+            topic_model: BERTopic instance to instrument
+        """
+        patched = []
+        for method_name, stage_name in BERTOPIC_STAGES.items():
+            method = getattr(topic_model, method_name, None)
+            if method is None:
+                continue
+            setattr(topic_model, method_name, self._timed(method, stage_name))
+            patched.append(method_name)
+        try:
+            yield
+        finally:
+            # Dropping the instance attribute restores the class method
+            for method_name in patched:
+                delattr(topic_model, method_name)
+
+    def _timed(self, method, stage_name: str):
+        def timed(*args, **kwargs):
+            with self.stage(stage_name):
+                return method(*args, **kwargs)
+        return timed
+
+    def report(self, top_functions: int = 30) -> Dict[str, Any]:
+        """
+        Collect the profile for the handler output.
+
+        Args:
+            top_functions: Number of cProfile entries to include in the text summary
+
+        Returns:
+            Per-stage timings, job-level CPU and memory usage and the optional cProfile dump
+        """
+        report = {
+            "stages": self.stages,
+            "wall_seconds": self._wall_time,
+            "cpu_seconds": self._cpu_time,
+            "cpu_percent": 100 * self._cpu_time / self._wall_time if self._wall_time > 0 else 0,
+            "start_rss_mb": self._start_rss / 2**20,
+            "peak_rss_mb": self._job_peak_rss / 2**20,
+        }
+        if self._cprofile is not None:
+            stream = io.StringIO()
+            stats = pstats.Stats(self._cprofile, stream=stream)
+            stats.sort_stats("cumulative").print_stats(top_functions)
+            report["cprofile_summary"] = stream.getvalue()
+            # Same format as cProfile's dump_stats, loadable with pstats.Stats(path)
+            report["cprofile_dump"] = base64.b64encode(marshal.dumps(stats.stats)).decode("ascii")
+        return report
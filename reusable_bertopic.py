@@ -0,0 +1,136 @@
+"""
+BERTopic that reuses its fitted bag-of-words after fit_transform.
+
+Stock BERTopic re-vectorizes every document in reduce_topics (to rebuild
+c-TF-IDF for the merged topics) and again in hierarchical_topics (to get a
+bag-of-words per topic). ReusableBERTopic vectorizes each document once
+during the fit and keeps the per-document bag-of-words. Topic bag-of-words
+matrices for the fit, the reduction and the hierarchy are then sparse sums
+of those rows.
+
+With a unigram CountVectorizer whose vocabulary is not filtered by document
+frequency (BERTopic's default), the sums are exactly the matrices BERTopic
+would get by vectorizing the joined documents of each topic, so topics,
+c-TF-IDF and hierarchy are identical. For any other configuration the
+stock code paths are used.
+
+fit_transform also takes a count per document, for samples that hold some
+documents several times but fit each only once. The counts weight the
+document's bag-of-words, so topic words reflect the sample as drawn.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from bertopic import BERTopic
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer
+
+from hierarchy import hierarchy_from_topic_bow
+
+
+class ReusableBERTopic(BERTopic):
+    """BERTopic that keeps the per-document bag-of-words between fit, reduction and hierarchy."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.document_bow_: Optional[csr_matrix] = None
+        self.topic_bow_: Optional[csr_matrix] = None
+        self.document_counts_: Optional[np.ndarray] = None
+        self._extracting: Optional[pd.DataFrame] = None
+
+    def _bow_is_additive(self) -> bool:
+        """Whether summing per-document bag-of-words equals vectorizing the joined topic documents."""
+        vectorizer = self.vectorizer_model
+        return (
+            type(vectorizer) is CountVectorizer
+            and vectorizer.analyzer == "word"
+            and vectorizer.ngram_range[1] == 1
+            and vectorizer.min_df in (1, 1.0)
+            and vectorizer.max_df in (1, 1.0)
+            and vectorizer.max_features is None
+            and not self.seed_topic_list
+            and not getattr(self.ctfidf_model, "seed_words", None)
+        )
+
+    def _clean_documents(self, docs: List[str]) -> List[str]:
+        # _preprocess_text only removes or replaces characters, so cleaning doc + "x" and dropping
+        # the "x" gives the cleaned document without the "emptydoc" placeholder for empty strings
+        return [doc[:-1] for doc in self._preprocess_text([doc + "x" for doc in docs])]
+
+    def _aggregate_bow(self, documents: pd.DataFrame, topics: pd.Series) -> csr_matrix:
+        """Sum per-document bag-of-words rows into one row per topic, in the order of `topics`."""
+        topic_rows = {topic: row for row, topic in enumerate(topics)}
+        rows = documents.Topic.map(topic_rows).values
+        if self.document_counts_ is not None:
+            weights = self.document_counts_[documents.ID.values].astype(self.document_bow_.dtype)
+        else:
+            weights = np.ones(len(documents), dtype=self.document_bow_.dtype)
+        indicator = csr_matrix(
+            (weights, (rows, documents.ID.values)),
+            shape=(len(topic_rows), self.document_bow_.shape[0]))
+        return indicator @ self.document_bow_
+
+    def _extract_topics(self, documents: pd.DataFrame, embeddings: np.ndarray = None, mappings=None,
+                        verbose: bool = False):
+        # Let _c_tf_idf see which documents belong to which topic
+        self._extracting = documents
+        try:
+            super()._extract_topics(documents, embeddings=embeddings, mappings=mappings, verbose=verbose)
+        finally:
+            self._extracting = None
+
+    def _c_tf_idf(self, documents_per_topic: pd.DataFrame, fit: bool = True,
+                  partial_fit: bool = False) -> Tuple[csr_matrix, List[str]]:
+        documents = self._extracting
+        if documents is None or partial_fit or not fit or not self._bow_is_additive():
+            self.document_bow_ = self.topic_bow_ = None
+            return super()._c_tf_idf(documents_per_topic, fit=fit, partial_fit=partial_fit)
+
+        if self.document_bow_ is None:
+            documents = documents.sort_values("ID")
+            cleaned = self._clean_documents(documents.Document.tolist())
+
+            # A topic made of a single empty document would be vectorized as "emptydoc" when joined
+            sizes = documents.Topic.value_counts()
+            if any(sizes[topic] == 1 and doc == "" for topic, doc in zip(documents.Topic, cleaned)):
+                return super()._c_tf_idf(documents_per_topic, fit=fit, partial_fit=partial_fit)
+
+            self.document_bow_ = self.vectorizer_model.fit_transform(cleaned)
+
+        X = self._aggregate_bow(documents, documents_per_topic.Topic)
+        words = self.vectorizer_model.get_feature_names_out()
+        self.ctfidf_model = self.ctfidf_model.fit(X)
+        c_tf_idf = self.ctfidf_model.transform(X)
+        self.topic_bow_ = X
+        return c_tf_idf, words
+
+    def fit_transform(self, documents, embeddings=None, images=None, y=None,
+                      document_counts: Optional[np.ndarray] = None):
+        """
+        BERTopic's fit_transform, with an optional count per document.
+
+        The counts only weight the kept bag-of-words, so they apply when it
+        is used (see _bow_is_additive); clustering always sees each document
+        once.
+        """
+        # Every fit starts from fresh documents
+        self.document_bow_ = self.topic_bow_ = None
+        self.document_counts_ = np.asarray(document_counts) if document_counts is not None else None
+        return super().fit_transform(documents, embeddings=embeddings, images=images, y=y)
+
+    def hierarchical_topics(self, docs: List[str], use_ctfidf: bool = True,
+                            linkage_function=None, distance_function=None) -> pd.DataFrame:
+        """
+        Hierarchical topics from the kept topic bag-of-words.
+
+        Falls back to BERTopic's implementation, which re-vectorizes `docs`,
+        when no bag-of-words was kept or a custom linkage, distance,
+        representation model or semantic embeddings are requested.
+        """
+        if (self.topic_bow_ is None or not use_ctfidf or linkage_function is not None
+                or distance_function is not None or self.representation_model):
+            return super().hierarchical_topics(docs, use_ctfidf=use_ctfidf, linkage_function=linkage_function,
+                                               distance_function=distance_function)
+        return hierarchy_from_topic_bow(self, self.topic_bow_[self._outliers:])
@@ -0,0 +1,243 @@
+"""
+Weighted traffic mixes across endpoints, run at the same time by one scheduler.
+
+A scenario file (JSON, or YAML with PyYAML installed) lists endpoints and
+scenarios. Each scenario submits jobs open-loop at its own arrival rate to
+one endpoint and draws every job's input from a weighted mix:
+
+    {
+      "duration": 600,
+      "seed": 1,
+      "endpoints": {
+        "prod": {"url": "https://api.runpod.ai/v2/abc123/run", "api_key_env": "RUNPOD_API_KEY"}
+      },
+      "scenarios": [
+        {"name": "production", "endpoint": "prod", "rate": 2.0, "ramp_up": 30,
+         "mix": [
+           {"weight": 80, "input": {"num_docs": 100}},
+           {"weight": 15, "input": {"num_docs": 1000}},
+           {"weight": 5, "input": {"num_docs": 10000}}
+         ]}
+      ]
+    }
+
+All scenarios share one event loop and one connection pool per endpoint,
+so they compete for workers the way production traffic does. Results are
+broken down per scenario and per mix entry.
+"""
+
+import asyncio
+import json
+import os
+import random
+from contextlib import AsyncExitStack
+from typing import IO, Any, Dict, List, Optional
+
+from aggregation import LatencyHistogram, ResultAggregator
+from load_test import JobTracker, arrival_offsets
+
+DEFAULT_INPUT = {"num_topics": 10}
+
+
+def load_scenario_file(path: str) -> Dict[str, Any]:
+    """
+    Read and validate a scenario file.
+
+    Args:
+        path: .json, .yaml or .yml file
+
+    Returns:
+        The scenario configuration
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError as e:
+                raise ImportError("YAML scenario files need PyYAML (pip install pyyaml); "
+                                  "JSON files work without it") from e
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    validate_scenarios(config)
+    return config
+
+
+def validate_scenarios(config: Dict[str, Any]) -> None:
+    """Raise ValueError for a scenario configuration the scheduler cannot run."""
+    endpoints = config.get("endpoints", {})
+    scenarios = config.get("scenarios")
+    if not scenarios:
+        raise ValueError("Scenario file defines no scenarios")
+    names = [scenario.get("name") for scenario in scenarios]
+    if None in names or len(set(names)) != len(names):
+        raise ValueError("Every scenario needs a unique name")
+    for scenario in scenarios:
+        name = scenario["name"]
+        if "url" not in scenario and scenario.get("endpoint") not in endpoints:
+            raise ValueError(f"Scenario {name!r} needs a url or one of the endpoints {sorted(endpoints)}")
+        if scenario.get("rate", 0) <= 0:
+            raise ValueError(f"Scenario {name!r} needs a positive rate (jobs/sec)")
+        if not scenario.get("mix"):
+            raise ValueError(f"Scenario {name!r} has an empty mix")
+        if any(entry.get("weight", 1) <= 0 for entry in scenario["mix"]):
+            raise ValueError(f"Scenario {name!r} has a mix weight that is not positive")
+        labels = [entry_label(entry) for entry in scenario["mix"]]
+        if len(set(labels)) != len(labels):
+            raise ValueError(f"Scenario {name!r} has mix entries with the same label; give them names")
+
+
+def entry_label(entry: Dict[str, Any]) -> str:
+    """Name of a mix entry in the breakdown: its "name", else its document count."""
+    return entry.get("name") or f"{entry.get('input', {}).get('num_docs', 100)} docs"
+
+
+def _endpoint(config: Dict[str, Any], scenario: Dict[str, Any], api_key: Optional[str]) -> Dict[str, Any]:
+    endpoint = config.get("endpoints", {}).get(scenario.get("endpoint"), {})
+    url = scenario.get("url", endpoint.get("url"))
+    key = endpoint.get("api_key") or (os.environ.get(endpoint["api_key_env"]) if "api_key_env" in endpoint
+                                      else None) or api_key
+    return {"url": url, "api_key": key}
+
+
+def _throughput(aggregator: ResultAggregator) -> float:
+    # Completion rate between the first and last completion, as in run_open_loop_test
+    if aggregator.successes > 1 and aggregator.last_finished > aggregator.first_finished:
+        return (aggregator.successes - 1) / (aggregator.last_finished - aggregator.first_finished)
+    return 0
+
+
+async def _run_scenario(scenario: Dict[str, Any], tracker: JobTracker, duration: float, rng: random.Random,
+                        aggregator: ResultAggregator, entry_aggregators: Dict[str, ResultAggregator],
+                        base_input: Dict[str, Any]) -> Dict[str, Any]:
+    rate = scenario["rate"]
+    offsets = arrival_offsets(rate, scenario.get("duration", duration), scenario.get("ramp_up", 0.0),
+                              scenario.get("arrival", "poisson"), rng.randrange(2**32))
+    mix = scenario["mix"]
+    weights = [entry.get("weight", 1) for entry in mix]
+    base_input = {**DEFAULT_INPUT, **base_input, **scenario.get("input", {})}
+    print(f"Scenario {scenario['name']}: {rate} jobs/sec to {tracker.url}, {len(offsets)} jobs scheduled")
+
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(scenario.get("start", 0.0))
+    scenario_start = loop.time()
+    pending = set()
+    lag_max = 0.0
+
+    async def job(entry: Dict[str, Any], data: Dict[str, Any]) -> None:
+        result = await tracker.run_job(data)
+        aggregator.add(result)
+        entry_aggregators[entry_label(entry)].add(result)
+
+    for offset in offsets:
+        delay = scenario_start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lag_max = max(lag_max, loop.time() - scenario_start - offset)
+        entry = rng.choices(mix, weights)[0]
+        job_input = {**base_input, **entry.get("input", {})}
+        # Without a fixed seed every job samples different documents, like distinct requests would
+        job_input.setdefault("random_seed", rng.randrange(2**31))
+        task = asyncio.create_task(job(entry, {"input": job_input}))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    send_duration = loop.time() - scenario_start
+    if pending:
+        await asyncio.gather(*pending)
+
+    return {
+        **aggregator.summary(),
+        "endpoint": tracker.url,
+        "target_rate": rate,
+        "offered_rate": aggregator.total / send_duration if send_duration > 0 else 0,
+        "throughput": _throughput(aggregator),
+        "max_schedule_lag": lag_max,
+        "mix": {label: {**entry_aggregator.summary(), "throughput": _throughput(entry_aggregator)}
+                for label, entry_aggregator in entry_aggregators.items()},
+    }
+
+
+def run_scenarios(config: Dict[str, Any], api_key: Optional[str] = None, timeout: int = 300,
+                  cprofile_dir: Optional[str] = None, records: Optional[IO[str]] = None,
+                  report_interval: float = 0.0, window: float = 60.0,
+                  base_input: Optional[Dict[str, Any]] = None,
+                  tracker_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run every scenario of a configuration concurrently.
+
+    Args:
+        config: Scenario configuration from load_scenario_file
+        api_key: API key for endpoints that do not name their own
+        timeout: Per-job timeout in seconds (a "timeout" in the file wins)
+        cprofile_dir: Directory to write returned cProfile dumps to
+        records: Open file that gets one JSON line per finished job,
+            labelled "<scenario>/<mix entry>"
+        report_interval: Seconds between each scenario's rolling-window reports (0 disables them)
+        window: Length of the rolling window in seconds
+        base_input: Handler input for every job, below the scenario's and mix entry's own
+        tracker_options: Extra JobTracker arguments (retries, cancel on timeout, deadlines)
+
+    Returns:
+        Per-scenario summaries, each with a per-mix-entry breakdown, and
+        the response time percentiles over all scenarios
+    """
+    validate_scenarios(config)
+    rng = random.Random(config.get("seed"))
+    duration = config.get("duration", 60.0)
+    timeout = config.get("timeout", timeout)
+
+    async def run() -> List[Dict[str, Any]]:
+        async with AsyncExitStack() as stack:
+            trackers: Dict[str, JobTracker] = {}
+            runs = []
+            for scenario in config["scenarios"]:
+                endpoint = _endpoint(config, scenario, api_key)
+                if endpoint["url"] not in trackers:
+                    trackers[endpoint["url"]] = await stack.enter_async_context(
+                        JobTracker(endpoint["url"], endpoint["api_key"], timeout=timeout,
+                                   max_connections=1000, **(tracker_options or {})))
+                aggregator = ResultAggregator(scenario["name"], None, None, window, report_interval)
+                entry_aggregators = {
+                    entry_label(entry): ResultAggregator(f"{scenario['name']}/{entry_label(entry)}", records,
+                                                         cprofile_dir, window)
+                    for entry in scenario["mix"]
+                }
+                # Each scenario gets its own generator, so adding one does not change the others' traffic
+                runs.append(_run_scenario(scenario, trackers[endpoint["url"]], duration,
+                                          random.Random(rng.randrange(2**32)), aggregator, entry_aggregators,
+                                          base_input or {}))
+            return await asyncio.gather(*runs)
+
+    summaries = asyncio.run(run())
+    overall = LatencyHistogram()
+    for summary in summaries:
+        overall.merge(LatencyHistogram.from_dict(summary["response_time_histogram"]))
+    return {
+        "mode": "scenarios",
+        "scenarios": {scenario["name"]: summary for scenario, summary in zip(config["scenarios"], summaries)},
+        "overall": {
+            "total_requests": sum(summary["total_requests"] for summary in summaries),
+            "successful_requests": sum(summary["successful_requests"] for summary in summaries),
+            "cancelled_jobs": sum(summary["cancelled_jobs"] for summary in summaries),
+            "response_time_percentiles": overall.percentiles(),
+        },
+    }
+
+
+def print_scenario_results(results: Dict[str, Any]) -> None:
+    """Print each scenario's results with its per-mix-entry breakdown."""
+    for name, summary in results["scenarios"].items():
+        print(f"\nScenario {name} ({summary['endpoint']}):")
+        print(f"  {summary['total_requests']} jobs, {summary['success_rate']:.2%} success, "
+              f"offered {summary['offered_rate']:.2f}/s (target {summary['target_rate']:.2f}/s), "
+              f"throughput {summary['throughput']:.2f}/s")
+        for label, entry in [("all", summary)] + list(summary["mix"].items()):
+            pct = entry["response_time_percentiles"]
+            print(f"  {label:>12}: {entry['total_requests']:5d} jobs, {entry['success_rate']:7.2%} success, "
+                  f"p50 {pct['p50']:.2f}s, p90 {pct['p90']:.2f}s, p99 {pct['p99']:.2f}s")
+        if summary["errors"]:
+            print(f"  Errors: {summary['errors']}")
+
+    overall = results["overall"]
+    print(f"\nAll scenarios: {overall['successful_requests']}/{overall['total_requests']} succeeded, "
+          + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in overall["response_time_percentiles"].items()))
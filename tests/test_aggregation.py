@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from aggregation import (MAX_ERROR_CATEGORIES, LatencyHistogram, ResultAggregator, error_category,
+                         percentile)
+
+
+def test_histogram_percentiles_within_relative_error():
+    histogram = LatencyHistogram()
+    values = [i / 1000 for i in range(1, 10001)]  # 1ms .. 10s
+    random.Random(0).shuffle(values)
+    for value in values:
+        histogram.record(value)
+    for q in (50, 90, 99, 99.9):
+        assert histogram.percentile(q) == pytest.approx(percentile(values, q), rel=2e-3)
+    assert histogram.count == len(values)
+    assert histogram.percentile(100) == pytest.approx(10.0, rel=1e-3)
+    assert histogram.mean == pytest.approx(sum(values) / len(values))
+
+
+def test_histogram_merge_matches_single_histogram():
+    rng = random.Random(1)
+    values = [rng.lognormvariate(0, 1) for _ in range(5000)]
+    whole, first, second = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for i, value in enumerate(values):
+        whole.record(value)
+        (first if i % 2 else second).record(value)
+    merged = first.merge(second)
+    assert merged.counts == whole.counts
+    assert merged.percentiles() == whole.percentiles()
+    assert (merged.min, merged.max) == (whole.min, whole.max)
+
+
+def test_histogram_dict_round_trip_and_precision_check():
+    histogram = LatencyHistogram()
+    for value in (0.01, 0.2, 3.0):
+        histogram.record(value)
+    restored = LatencyHistogram.from_dict(histogram.to_dict())
+    assert restored.percentiles() == histogram.percentiles()
+    assert LatencyHistogram.from_dict(LatencyHistogram().to_dict()).percentile(50) == 0
+    with pytest.raises(ValueError):
+        histogram.merge(LatencyHistogram(significant_digits=2))
+
+
+def result(success, error=None, finished_at=0.0):
+    return {"success": success, "response_time": 1.0, "response_size": 10, "error": error,
+            "finished_at": finished_at}
+
+
+def test_recent_window_not_kept_without_reports():
+    aggregator = ResultAggregator()
+    for _ in range(1000):
+        aggregator.add(result(True))
+    assert len(aggregator._recent) == 0
+    assert aggregator.summary()["total_requests"] == 1000
+
+
+def test_recent_window_trimmed_to_window():
+    aggregator = ResultAggregator(window=60.0, report_interval=3600.0)
+    for i in range(1000):
+        # All but the last few finished long before the window
+        aggregator.add(result(True, finished_at=0.0 if i < 990 else 2e9))
+    assert len(aggregator._recent) == 10
+
+
+def test_errors_grouped_by_category():
+    aggregator = ResultAggregator()
+    for i in range(200):
+        aggregator.add(result(False, f"Job failed: Deadline exceeded by {i / 100:.2f}s before fit"))
+    aggregator.add(result(False, "Job submission failed: 503"))
+    summary = aggregator.summary()
+    assert summary["errors"] == {"Job failed: Deadline exceeded by #s before fit": 200,
+                                 "Job submission failed: 503": 1}
+    assert len(summary["error_examples"]["Job failed: Deadline exceeded by #s before fit"]) == 3
+
+
+def test_error_categories_capped():
+    aggregator = ResultAggregator()
+    for i in range(MAX_ERROR_CATEGORIES + 20):
+        aggregator.add(result(False, f"error kind {chr(65 + i % 26)}{i // 26}"))
+    assert len(aggregator.errors) == MAX_ERROR_CATEGORIES + 1
+    assert aggregator.errors["other"] == 20
+
+
+def test_error_category_masks_job_ids():
+    assert error_category("Job 0b7c9d2e-1f3a-4b5c-8d9e-0a1b2c3d4e5f not found") == "Job # not found"
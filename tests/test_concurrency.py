@@ -0,0 +1,56 @@
+import asyncio
+
+from concurrency import DocumentBudget
+
+
+async def job(budget, name, num_docs, seconds, started):
+    async with budget.reserve(num_docs):
+        started.append(name)
+        await asyncio.sleep(seconds)
+
+
+def test_small_jobs_fit_side_by_side():
+    async def run():
+        budget = DocumentBudget(1000)
+        started = []
+        tasks = [asyncio.create_task(job(budget, i, 100, 0.05, started)) for i in range(10)]
+        await asyncio.sleep(0.01)
+        assert len(started) == 10 and budget.in_use == 1000
+        await asyncio.gather(*tasks)
+        assert budget.in_use == 0 and budget.running == 0
+    asyncio.run(run())
+
+
+def test_large_job_not_starved_by_later_small_jobs():
+    async def run():
+        budget = DocumentBudget(1000)
+        started = []
+        tasks = [asyncio.create_task(job(budget, "small-0", 300, 0.2, started))]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(job(budget, "large", 100000, 0.05, started)))
+        await asyncio.sleep(0.01)
+        # Overlapping small jobs keep arriving; each would fit next to small-0
+        for i in range(1, 6):
+            tasks.append(asyncio.create_task(job(budget, f"small-{i}", 100, 0.2, started)))
+            await asyncio.sleep(0.02)
+        assert started == ["small-0"]
+        assert budget.waiting == 6
+        await asyncio.gather(*tasks)
+        assert started == ["small-0", "large"] + [f"small-{i}" for i in range(1, 6)]
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_block_queue():
+    async def run():
+        budget = DocumentBudget(1000)
+        started = []
+        first = asyncio.create_task(job(budget, "first", 1000, 0.1, started))
+        await asyncio.sleep(0.01)
+        cancelled = asyncio.create_task(job(budget, "cancelled", 1000, 0.1, started))
+        behind = asyncio.create_task(job(budget, "behind", 10, 0.01, started))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.gather(first, behind)
+        assert started == ["first", "behind"]
+        assert budget.waiting == 0 and budget.in_use == 0
+    asyncio.run(run())
@@ -0,0 +1,28 @@
+import numpy as np
+
+from corpus import sample_documents
+
+
+def test_sample_below_corpus_size_is_unique():
+    indices, counts = sample_documents(1000, 300, np.random.default_rng(0))
+    assert len(indices) == 300
+    assert len(np.unique(indices)) == 300
+    assert np.all(np.diff(indices) > 0)
+    assert np.all(counts == 1)
+    assert indices.min() >= 0 and indices.max() < 1000
+
+
+def test_sample_above_corpus_size_folds_repeats_into_counts():
+    indices, counts = sample_documents(100, 10000, np.random.default_rng(0))
+    assert len(indices) <= 100
+    assert np.all(np.diff(indices) > 0)
+    assert counts.sum() == 10000
+    assert counts.min() >= 1
+
+
+def test_sample_is_deterministic_per_seed():
+    first = sample_documents(5000, 1000, np.random.default_rng(42))
+    second = sample_documents(5000, 1000, np.random.default_rng(42))
+    other = sample_documents(5000, 1000, np.random.default_rng(43))
+    np.testing.assert_array_equal(first[0], second[0])
+    assert not np.array_equal(first[0], other[0])
@@ -0,0 +1,74 @@
+import numpy as np
+
+from embeddings import EmbeddingCache, embed_documents, encode_documents, encode_length_bucketed
+
+
+class FakeModel:
+    """Stand-in for a SentenceTransformer whose embedding depends only on the document."""
+
+    max_seq_length = 16
+
+    def __init__(self):
+        self.batches = []
+
+    def tokenizer(self, docs, truncation=True, max_length=None):
+        return {"input_ids": [(["[CLS]"] + doc.split() + ["[SEP]"])[:max_length] for doc in docs]}
+
+    def encode(self, docs, batch_size=32, show_progress_bar=False):
+        self.batches.append(list(docs))
+        return np.array([[len(doc), sum(map(ord, doc)) % 97, len(doc.split())] for doc in docs], dtype=np.float32)
+
+
+def make_docs():
+    rng = np.random.default_rng(0)
+    docs = [" ".join(f"w{j}" for j in range(rng.integers(1, 30))) for _ in range(200)]
+    docs[3] = docs[50] = ""
+    docs[7] = "  \n "
+    return docs
+
+
+def test_bucketed_matches_unbucketed_in_input_order():
+    docs = make_docs()
+    expected = np.array([[len(doc), sum(map(ord, doc)) % 97, len(doc.split())] for doc in docs], dtype=np.float32)
+    # Empty and whitespace-only documents share the embedding of ""
+    expected[[3, 7, 50]] = [0, 0, 0]
+
+    plain_model, bucketed_model = FakeModel(), FakeModel()
+    plain, plain_stats = encode_documents(plain_model, docs, batch_size=8)
+    bucketed, bucketed_stats = encode_documents(bucketed_model, docs, batch_size=8, token_budget=64)
+
+    np.testing.assert_array_equal(plain, expected)
+    np.testing.assert_array_equal(bucketed, expected)
+    assert plain_stats == {"empty_docs": 3}
+    assert bucketed_stats["empty_docs"] == 3
+    assert bucketed_stats["batches"] == len(bucketed_model.batches) - 1  # Plus the one encode of ""
+
+
+def test_default_is_one_stock_encode_call():
+    model = FakeModel()
+    encode_documents(model, make_docs(), batch_size=8)
+    assert model.batches[-1] == [doc for doc in make_docs() if doc.strip()]
+
+
+def test_bucketed_batches_stay_within_budget():
+    model = FakeModel()
+    _, stats = encode_length_bucketed(model, make_docs(), batch_size=8, token_budget=64)
+    for batch in model.batches[1:]:
+        longest = max(min(len(doc.split()) + 2, model.max_seq_length) for doc in batch)
+        assert len(batch) == 1 or len(batch) * longest <= 64
+    assert stats["padded_tokens"] >= stats["real_tokens"]
+
+
+def test_cache_counts_are_per_document(tmp_path):
+    model = FakeModel()
+    embed_documents(model, ["a b", "c d e"], EmbeddingCache(disk_dir=str(tmp_path)))
+
+    # Fresh memory tier, same disk: "a b" comes from disk, "x" is new, repeats included
+    cache = EmbeddingCache(disk_dir=str(tmp_path))
+    embed_documents(model, ["c d e"], cache)
+    _, stats = embed_documents(model, ["a b", "c d e", "a b", "x", "c d e", "x"], cache)
+    assert stats["memory_hits"] == 2
+    assert stats["disk_hits"] == 2
+    assert stats["hits"] == 4
+    assert stats["misses"] == 2
+    assert stats["encoded"] == 1
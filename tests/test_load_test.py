@@ -0,0 +1,76 @@
+import asyncio
+import socket
+
+import pytest
+
+from load_test import JobTracker, arrival_offsets, retry_delay
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_retry_delay_is_jittered_and_capped():
+    delays = [retry_delay(attempt, base=0.5, cap=2.0) for attempt in range(10) for _ in range(20)]
+    assert all(0 <= delay <= 2.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_submit_retried_when_connection_fails():
+    async def run():
+        url = f"http://127.0.0.1:{free_port()}/run"  # Nothing listens here
+        async with JobTracker(url, timeout=10, max_retries=2, retry_backoff=0.01) as tracker:
+            return await tracker.run_job({"input": {}})
+    result = asyncio.run(run())
+    assert not result["success"]
+    assert result["submit_retries"] == 2
+
+
+def test_submit_not_retried_after_disconnect():
+    connections = 0
+
+    async def run():
+        async def drop(reader, writer):
+            # Reads the request, as an endpoint that accepted the job would, then hangs up
+            nonlocal connections
+            connections += 1
+            await reader.readuntil(b"\r\n\r\n")
+            writer.close()
+
+        server = await asyncio.start_server(drop, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/run"
+        async with server:
+            async with JobTracker(url, timeout=10, max_retries=3, retry_backoff=0.01) as tracker:
+                return await tracker.run_job({"input": {}})
+
+    result = asyncio.run(run())
+    assert not result["success"]
+    assert result["submit_retries"] == 0
+    assert connections == 1
+
+
+def test_constant_arrivals_hold_the_rate():
+    offsets = arrival_offsets(rate=4.0, duration=10.0, arrival="constant")
+    assert len(offsets) == 39  # 0.25, 0.5, ... 9.75
+    assert offsets == sorted(offsets)
+    assert all(abs(b - a - 0.25) < 1e-9 for a, b in zip(offsets, offsets[1:]))
+
+
+def test_poisson_arrivals_ramp_up_and_are_seeded():
+    offsets = arrival_offsets(rate=50.0, duration=100.0, ramp_up=20.0, seed=7)
+    assert offsets == arrival_offsets(rate=50.0, duration=100.0, ramp_up=20.0, seed=7)
+    assert offsets == sorted(offsets) and offsets[-1] < 100.0
+    # Expected arrivals: half the rate over the ramp, then the full rate
+    ramp = sum(1 for offset in offsets if offset < 20.0)
+    assert abs(ramp - 500) < 4 * 500 ** 0.5
+    assert abs(len(offsets) - 4500) < 4 * 4500 ** 0.5
+    # The ramp's first half gets a quarter of its arrivals
+    assert abs(sum(1 for offset in offsets if offset < 10.0) / ramp - 0.25) < 0.05
+
+
+def test_arrival_offsets_edge_cases():
+    assert arrival_offsets(rate=0.0, duration=10.0) == []
+    with pytest.raises(ValueError):
+        arrival_offsets(rate=1.0, duration=10.0, arrival="burst")
@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import local_server
+from deadline import Deadline, DeadlineExceeded
+from local_server import LocalRunPodServer
+
+
+def deadline_aware_handler(event):
+    deadline = Deadline.from_input(event["input"])
+    try:
+        for _ in range(100):
+            deadline.check("step")
+            time.sleep(0.02)
+    except DeadlineExceeded as e:
+        return {"error": str(e), "deadline_exceeded": True}
+    return {"done": True}
+
+
+local_server._handlers["tests:deadline_aware_handler"] = deadline_aware_handler
+
+
+async def wait_for_status(server, job_id, status, timeout=5.0):
+    start = time.time()
+    while server.jobs[job_id]["status"] != status:
+        assert time.time() - start < timeout, f"job never reached {status}"
+        await asyncio.sleep(0.01)
+
+
+def run_with_server(test):
+    async def run():
+        server = LocalRunPodServer("tests:deadline_aware_handler", workers=1)
+        await server.start(None)
+        try:
+            await test(server)
+        finally:
+            await server.stop(None)
+    asyncio.run(run())
+
+
+def test_cancel_in_progress_job_frees_slot_early():
+    async def test(server):
+        job_id = server.submit({"input": {}})
+        await wait_for_status(server, job_id, "IN_PROGRESS")
+        cancelled_at = time.time()
+        server.cancel(job_id)
+        await server.jobs[job_id]["done"]
+        # The handler would run for 2s; it stops at its next check instead
+        assert time.time() - cancelled_at < 0.5
+        assert server._slots.qsize() == 1
+        assert server._status(job_id)["status"] == "CANCELLED"
+        assert "output" not in server._status(job_id)
+
+    run_with_server(test)
+
+
+def test_cancel_queued_job_never_runs():
+    async def test(server):
+        running = server.submit({"input": {}})
+        queued = server.submit({"input": {}})
+        await wait_for_status(server, running, "IN_PROGRESS")
+        server.cancel(queued)
+        assert server.jobs[queued]["status"] == "CANCELLED"
+        server.cancel(running)
+        await asyncio.wait([server.jobs[running]["done"], server.jobs[queued]["done"]])
+        assert server.jobs[queued]["started_at"] is None
+        assert server._slots.qsize() == 1
+
+    run_with_server(test)
+
+
+def test_cancel_leaves_finished_job():
+    async def test(server):
+        job_id = server.submit({"input": {"deadline": time.time() + 60}})
+        await server.jobs[job_id]["done"]
+        server.cancel(job_id)
+        assert server.jobs[job_id]["status"] == "COMPLETED"
+
+    run_with_server(test)
+
+
+def echo_handler(event):
+    return {"echo": event["input"]}
+
+
+local_server._handlers["tests:echo_handler"] = echo_handler
+
+
+def run_with_client(test, **options):
+    from aiohttp.test_utils import TestClient, TestServer
+
+    async def run():
+        server = LocalRunPodServer("tests:echo_handler", **options)
+        async with TestClient(TestServer(server.app())) as client:
+            await test(client)
+    asyncio.run(run())
+
+
+def test_run_and_status_report_runpod_timings():
+    async def test(client):
+        response = await client.post("/v2/endpoint/run", json={"input": {"num_docs": 5}})
+        job_id = (await response.json())["id"]
+        while True:
+            status = await (await client.get(f"/v2/endpoint/status/{job_id}")).json()
+            if status["status"] not in ("IN_QUEUE", "IN_PROGRESS"):
+                break
+            await asyncio.sleep(0.01)
+        assert status["status"] == "COMPLETED"
+        assert status["output"] == {"echo": {"num_docs": 5}}
+        # The first job on a slot waits for the cold start, which counts as queue time
+        assert status["delayTime"] >= 200
+        assert status["executionTime"] >= 0
+        health = await (await client.get("/health")).json()
+        assert health["jobs"]["completed"] == 1
+
+    run_with_client(test, cold_start=0.2)
+
+
+def test_runsync_injected_failure_and_unknown_job():
+    async def test(client):
+        status = await (await client.post("/runsync", json={"input": {}})).json()
+        assert status["status"] == "FAILED"
+        assert status["error"] == "Injected failure"
+        assert (await client.get("/status/missing")).status == 404
+        assert (await client.post("/cancel/missing")).status == 404
+
+    run_with_client(test, failure_rate=1.0)
+
+
+def test_cancel_route():
+    async def test(client):
+        queued = (await (await client.post("/run", json={"input": {}})).json())["id"]
+        cancelled = await (await client.post(f"/cancel/{queued}")).json()
+        assert cancelled == {"id": queued, "status": "CANCELLED"}
+        health = await (await client.get("/health")).json()
+        assert health["jobs"]["cancelled"] == 1
+
+    run_with_client(test, queue_delay=1.0)
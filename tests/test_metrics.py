@@ -0,0 +1,70 @@
+import json
+import urllib.request
+
+import pytest
+
+from metrics import MetricsRegistry, SnapshotWriter, serve_metrics
+
+
+def registry_with_samples():
+    registry = MetricsRegistry()
+    jobs = registry.counter("jobs_total", "Jobs", ["status"])
+    jobs.inc(status="completed")
+    jobs.inc(2, status='odd "label"\n')
+    seconds = registry.histogram("job_seconds", "Job time", buckets=(1, 10))
+    for value in (0.5, 1, 5, 100):
+        seconds.observe(value)
+    registry.gauge("rss_bytes", "RSS", function=lambda: 1024)
+    return registry
+
+
+def test_text_exposition_format():
+    lines = registry_with_samples().render().splitlines()
+    assert "# TYPE jobs_total counter" in lines
+    assert 'jobs_total{status="completed"} 1' in lines
+    assert 'jobs_total{status="odd \\"label\\"\\n"} 2' in lines
+    # Buckets are cumulative and "le" is inclusive
+    assert 'job_seconds_bucket{le="1"} 2' in lines
+    assert 'job_seconds_bucket{le="10"} 3' in lines
+    assert 'job_seconds_bucket{le="+Inf"} 4' in lines
+    assert "job_seconds_sum 106.5" in lines
+    assert "job_seconds_count 4" in lines
+    assert "rss_bytes 1024" in lines
+
+
+def test_snapshot_matches_text():
+    snapshot = registry_with_samples().snapshot()["metrics"]
+    assert snapshot["jobs_total"]["completed"] == 1
+    assert snapshot["job_seconds"]["count"] == 4
+    assert snapshot["job_seconds"]["buckets"] == {"1": 2, "10": 3, "+Inf": 4}
+    assert snapshot["rss_bytes"] == 1024
+
+
+def test_labels_and_names_checked():
+    registry = MetricsRegistry()
+    counter = registry.counter("c_total", "C", ["kind"])
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        registry.gauge("c_total", "duplicate")
+
+
+def test_scrape_endpoint():
+    server = serve_metrics(registry_with_samples(), 0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert 'jobs_total{status="completed"} 1' in response.read().decode()
+    finally:
+        server.shutdown()
+
+
+def test_snapshot_file(tmp_path):
+    registry = registry_with_samples()
+    json_path, text_path = tmp_path / "metrics.json", tmp_path / "metrics.prom"
+    for path in (json_path, text_path):
+        writer = SnapshotWriter(registry, str(path), interval=3600)
+        writer.close()
+    assert json.loads(json_path.read_text())["metrics"]["rss_bytes"] == 1024
+    assert text_path.read_text() == registry.render()
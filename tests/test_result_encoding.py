@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from result_encoding import decode_array, decode_result, encode_array, encode_result
+
+
+def job_result(num_docs=1000, num_topics=12, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.integers(-1, num_topics, size=num_docs).tolist()
+    probs = rng.random(num_docs)
+    indices = np.sort(rng.choice(20000, size=num_docs, replace=False))
+    counts = rng.integers(1, 4, size=num_docs)
+    hierarchy = pd.DataFrame({"Parent_ID": [12, 13], "Child_Left_ID": [0, 2], "Child_Right_ID": [1, 12],
+                              "Distance": [0.25, 0.5]})
+    return topics, probs, hierarchy, indices, counts
+
+
+@pytest.mark.parametrize("compression", ["zlib", "none"])
+def test_encode_array_round_trip(compression):
+    values = np.arange(-50, 50, dtype=np.int32).reshape(10, 10)
+    decoded = decode_array(json.loads(json.dumps(encode_array(values, compression))))
+    assert decoded.dtype == values.dtype
+    np.testing.assert_array_equal(decoded, values)
+
+
+@pytest.mark.parametrize("result_format,compression,chunk_size", [
+    ("json", "zlib", None),
+    ("compact", "zlib", None),
+    ("compact", "none", 128),
+    ("json", "none", 300),
+])
+def test_result_round_trip(result_format, compression, chunk_size):
+    topics, probs, hierarchy, indices, counts = job_result()
+    encoded = encode_result(topics, probs, hierarchy, result_format, compression, chunk_size, indices, counts)
+    # Decode what a client would receive
+    decoded = decode_result(json.loads(json.dumps(encoded)))
+
+    assert encoded["num_docs"] == len(topics)
+    assert encoded["num_sampled"] == int(counts.sum())
+    assert len(encoded["chunks"]) == (-(-len(topics) // chunk_size) if chunk_size else 1)
+    np.testing.assert_array_equal(decoded["topics"], topics)
+    np.testing.assert_array_equal(decoded["indices"], indices)
+    np.testing.assert_array_equal(decoded["counts"], counts)
+    if result_format == "compact":
+        # float16 keeps about three significant digits
+        np.testing.assert_allclose(decoded["probs"], probs, rtol=1e-3, atol=1e-3)
+    else:
+        np.testing.assert_array_equal(decoded["probs"], probs)
+    assert decoded["hierarchy"] == json.loads(hierarchy.to_json(orient="records"))
+
+
+def test_result_without_optional_parts():
+    encoded = encode_result([0, 1, 1], None, None, "compact")
+    decoded = decode_result(encoded)
+    np.testing.assert_array_equal(decoded["topics"], [0, 1, 1])
+    assert decoded["probs"] is None and decoded["indices"] is None and decoded["hierarchy"] is None
+    assert encoded["num_sampled"] == 3
+
+
+def test_empty_result():
+    decoded = decode_result(encode_result([], None, None, "compact"))
+    assert len(decoded["topics"]) == 0
+
+
+def test_unknown_format_rejected():
+    with pytest.raises(ValueError):
+        encode_result([0], None, None, "none")
+    with pytest.raises(ValueError):
+        encode_result([0], None, None, "compact", compression="gzip")
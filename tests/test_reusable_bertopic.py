@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+bertopic = pytest.importorskip("bertopic")
+hdbscan = pytest.importorskip("hdbscan")
+umap = pytest.importorskip("umap")
+
+from reusable_bertopic import ReusableBERTopic  # noqa: E402
+
+SEED = 42
+THEMES = [
+    "space orbit rocket launch nasa shuttle moon",
+    "hockey goal season team playoff score game",
+    "windows driver card video monitor install",
+    "gun law rights crime police control",
+    "god church bible faith belief religion",
+    "car engine dealer price oil speed",
+]
+
+
+def make_corpus():
+    rng = np.random.default_rng(SEED)
+    docs, embeddings = [], []
+    centers = rng.normal(size=(len(THEMES), 32)) * 4
+    for theme, center in zip(THEMES, centers):
+        words = theme.split()
+        for _ in range(50):
+            docs.append(" ".join(rng.choice(words, size=rng.integers(3, 12))))
+            embeddings.append(center + rng.normal(size=32))
+    docs[10] = ""  # An empty post inside a topic is vectorized as nothing, not as "emptydoc"
+    return docs, np.array(embeddings, dtype=np.float32)
+
+
+def fit(model_class, docs, embeddings):
+    # Same components as handler.build_topic_model, seeded
+    model = model_class(
+        umap_model=umap.UMAP(n_neighbors=15, n_components=5, min_dist=0.0, metric="cosine", random_state=SEED),
+        hdbscan_model=hdbscan.HDBSCAN(min_cluster_size=10, metric="euclidean", cluster_selection_method="eom",
+                                      prediction_data=True),
+        min_topic_size=10)
+    model.fit_transform(docs, embeddings)
+    return model
+
+
+def assert_same_model(stock, reusable, docs):
+    assert stock.topics_ == reusable.topics_
+    assert stock.get_topic_info().equals(reusable.get_topic_info())
+    np.testing.assert_allclose(stock.c_tf_idf_.toarray(), reusable.c_tf_idf_.toarray(), rtol=1e-6, atol=1e-12)
+    pd.testing.assert_frame_equal(stock.hierarchical_topics(docs), reusable.hierarchical_topics(docs))
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    docs, embeddings = make_corpus()
+    return docs, fit(bertopic.BERTopic, docs, embeddings), fit(ReusableBERTopic, docs, embeddings)
+
+
+def test_fit_matches_stock_bertopic(fitted):
+    docs, stock, reusable = fitted
+    assert reusable.topic_bow_ is not None  # The kept bag-of-words path was taken
+    assert len(set(stock.topics_) - {-1}) > 2
+    assert_same_model(stock, reusable, docs)
+
+
+def test_reduce_topics_matches_stock_bertopic(fitted):
+    docs, stock, reusable = fitted
+    stock.reduce_topics(docs, nr_topics=3)
+    reusable.reduce_topics(docs, nr_topics=3)
+    assert_same_model(stock, reusable, docs)